@@ -0,0 +1,175 @@
+"""Per-child progress metrics materialized into the child_metrics collection.
+
+The job only looks at sessions with messages newer than its watermark
+(stored in job_state). It loads their messages in chunks, computes the
+per-session metrics with pandas and upserts one row per session. On
+MongoDB it uses $merge, so re-running it is idempotent. Vocabulary growth
+is derived at view time from the per-session vocabularies.
+
+Usage (e.g. from cron every few minutes):
+    python analytics.py [--full] [--chunk-size 200]
+"""
+import argparse
+from datetime import datetime, timedelta
+import pandas as pd
+from dotenv import load_dotenv
+from storage import create_backend_from_env, get_backend
+
+JOB_NAME = "child_metrics"
+
+# Messages are timestamped by the app before they are written, so a message
+# can land slightly after a newer watermark; re-reading this window is harmless
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Spanish words including accented letters
+WORD_PATTERN = r"[a-záéíóúüñ]+"
+
+
+def _messages_frame(backend, session_ids):
+    """One row per message of the given sessions"""
+    rows = []
+    for session_id in session_ids:
+        for message in backend.iter_messages(session_id):
+            timings = message.get("timings") or {}
+            rows.append({
+                "session_id": session_id,
+                "role": message.get("role"),
+                "content": message.get("content") or "",
+                "input_mode": message.get("input_mode"),
+                "image_generated": bool(message.get("image_generated")),
+                "latency_ms": timings.get("total_ms"),
+                "first_audio_ms": timings.get("time_to_first_audio_ms")
+            })
+    frame = pd.DataFrame(rows, columns=[
+        "session_id", "role", "content", "input_mode", "image_generated", "latency_ms", "first_audio_ms"
+    ])
+    # Sessions recorded before turn timings existed have no latencies at all
+    for column in ("latency_ms", "first_audio_ms"):
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+
+def compute_session_metrics(messages):
+    """Per-session metrics from a messages frame (vectorized with pandas)"""
+    if messages.empty:
+        return pd.DataFrame()
+
+    child = messages[messages["role"] == "user"].copy()
+    child["words"] = child["content"].str.lower().str.findall(WORD_PATTERN)
+    child["word_count"] = child["words"].str.len()
+    child["is_voice"] = child["input_mode"] == "voice"
+
+    child_stats = child.groupby("session_id").agg(
+        turns=("content", "size"),
+        mlu_words=("word_count", "mean"),
+        voice_turns=("is_voice", "sum")
+    )
+    vocabulary = (
+        child[["session_id", "words"]].explode("words").dropna()
+        .groupby("session_id")["words"].agg(lambda words: sorted(set(words)))
+        .rename("vocabulary")
+    )
+
+    assistant = messages[messages["role"] == "assistant"]
+    latency = assistant.groupby("session_id")["latency_ms"]
+    assistant_stats = pd.DataFrame({
+        "latency_ms_mean": latency.mean(),
+        "latency_ms_p95": latency.quantile(0.95),
+        "first_audio_ms_mean": assistant.groupby("session_id")["first_audio_ms"].mean(),
+        "images": assistant.groupby("session_id")["image_generated"].sum()
+    })
+
+    metrics = child_stats.join(vocabulary, how="outer").join(assistant_stats, how="outer")
+    metrics["turns"] = metrics["turns"].fillna(0)
+    metrics["voice_turns"] = metrics["voice_turns"].fillna(0)
+    metrics["images"] = metrics["images"].fillna(0)
+    metrics["vocabulary"] = metrics["vocabulary"].apply(lambda words: words if isinstance(words, list) else [])
+    metrics["vocabulary_size"] = metrics["vocabulary"].str.len()
+    metrics["voice_share"] = (metrics["voice_turns"] / metrics["turns"].where(metrics["turns"] > 0)).fillna(0.0)
+    return metrics
+
+
+def _number(value, cast=float):
+    return None if pd.isna(value) else cast(value)
+
+
+def _to_documents(metrics, sessions_by_id, computed_at):
+    """Turn the metrics frame into plain documents (no NumPy types, NaN as None)"""
+    documents = []
+    for session_id, row in metrics.iterrows():
+        session = sessions_by_id.get(session_id)
+        if session is None:
+            # Messages of a deleted session
+            continue
+
+        documents.append({
+            "session_id": session_id,
+            "user_id": session.get("user_id"),
+            "session_date": session.get("created_at"),
+            "turns": _number(row["turns"], int),
+            "mlu_words": _number(row.get("mlu_words")),
+            "vocabulary": list(row["vocabulary"]),
+            "vocabulary_size": int(row["vocabulary_size"]),
+            "voice_turns": _number(row["voice_turns"], int),
+            "voice_share": _number(row["voice_share"]),
+            "images": _number(row["images"], int),
+            "latency_ms_mean": _number(row.get("latency_ms_mean")),
+            "latency_ms_p95": _number(row.get("latency_ms_p95")),
+            "first_audio_ms_mean": _number(row.get("first_audio_ms_mean")),
+            "computed_at": computed_at
+        })
+    return documents
+
+
+def run_metrics_job(db, full=False, chunk_size=200, progress=None):
+    """Recompute the metrics of sessions changed since the watermark; returns the number updated"""
+    backend = get_backend(db)
+    started = datetime.now()
+    watermark = None if full else backend.get_job_state(JOB_NAME).get("watermark")
+
+    session_ids = sorted(backend.changed_session_ids(watermark))
+    updated = 0
+    # Chunks keep memory bounded when a full rebuild touches every session
+    for start in range(0, len(session_ids), chunk_size):
+        chunk = session_ids[start:start + chunk_size]
+        sessions_by_id = {session["session_id"]: session for session in backend.find_sessions(chunk)}
+        metrics = compute_session_metrics(_messages_frame(backend, chunk))
+        documents = _to_documents(metrics, sessions_by_id, started)
+        backend.merge_child_metrics(documents)
+        updated += len(documents)
+        if progress:
+            progress(f"{min(start + chunk_size, len(session_ids))}/{len(session_ids)} sessions")
+
+    backend.set_job_state(JOB_NAME, {"watermark": started - WATERMARK_OVERLAP, "last_run": started})
+    return updated
+
+
+def vocabulary_growth(metric_rows):
+    """Per-session frame with new words and cumulative vocabulary of a child, oldest first"""
+    frame = pd.DataFrame(metric_rows)
+    if frame.empty:
+        return frame
+    frame = frame.sort_values("session_date").reset_index(drop=True)
+    words = frame[["session_date", "vocabulary"]].explode("vocabulary").dropna()
+    # A word is new in the first session where it appears
+    first_seen = words.drop_duplicates("vocabulary", keep="first")
+    frame["new_words"] = first_seen.groupby(level=0).size().reindex(frame.index, fill_value=0)
+    frame["cumulative_vocabulary"] = frame["new_words"].cumsum()
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize per-child progress metrics")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and recompute every session")
+    parser.add_argument("--chunk-size", type=int, default=200, help="Sessions loaded per chunk")
+    args = parser.parse_args()
+
+    load_dotenv()
+    backend = create_backend_from_env()
+    backend.setup_indexes()
+    updated = run_metrics_job(backend, full=args.full, chunk_size=args.chunk_size, progress=print)
+    print(f"Updated metrics for {updated} sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,28 +3,23 @@ import hashlib
 import re
 import secrets
 from datetime import datetime
+from db_operations import find_user_by_credentials, insert_user
+from session_tokens import forget_login, remember_login
+
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
 
 # Function to handle user signup
 # This function checks if the email already exists, hashes the password, and stores the user information in the database.
 def signup(email, password, user_type, name, db, age=None):
     try:
-        # Get users collection
-        users_collection = db["users"]
-        
-        # Check if email already exists
-        existing_user = users_collection.find_one({"email": email})
-        if existing_user:
-            st.session_state.auth_status = {
-                "message": "This email is already registered. Please use a different email or try logging in.",
-                "type": "error"
-            }
-            return False
-            
         # Generate a user ID
         user_id = secrets.token_hex(16)
         
         # Hash the password
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        password_hash = hash_password(password)
         
         # Prepare user document for MongoDB
         user_document = {
@@ -40,8 +35,13 @@ def signup(email, password, user_type, name, db, age=None):
         if age is not None:
             user_document["age"] = age
         
-        # Insert user document into MongoDB collection
-        users_collection.insert_one(user_document)
+        # Insert user document (the unique email index rejects taken emails, no lookup needed)
+        if not insert_user(db, user_document):
+            st.session_state.auth_status = {
+                "message": "This email is already registered. Please use a different email or try logging in.",
+                "type": "error"
+            }
+            return False
         
         # Set auth status for signup success
         st.session_state.auth_status = {
@@ -62,17 +62,11 @@ def signup(email, password, user_type, name, db, age=None):
 # This function checks the user's credentials against the database and sets session state variables accordingly.
 def login(email, password, db):
     try:
-        # Get users collection
-        users_collection = db["users"]
-
         # Hash the password
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        password_hash = hash_password(password)
         
         # Query user by email and password hash
-        user = users_collection.find_one({
-            "email": email,
-            "password_hash": password_hash
-        })
+        user = find_user_by_credentials(db, email, password_hash)
         
         if not user:
             st.session_state.auth_status = {
@@ -99,6 +93,9 @@ def login(email, password, db):
             "type": "success"
         }
         
+        # Signed cookie so a refresh or reconnect does not need another login
+        remember_login(user_data)
+        
         return True
         
     except Exception as e:
@@ -124,20 +121,18 @@ def display_status_message():
 # This function uses a regex pattern to check if the email is valid.
 def is_valid_email(email):
 
-    # Regular expression pattern for email validation
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    
     # Check if the email matches the pattern
-    if re.match(pattern, email):
+    if re.match(EMAIL_PATTERN, email):
         return True
     
     return False
 
 # Function to handle logout
 # This function resets the session state variables related to authentication.
-def logout():
+def logout(db):
     st.session_state.logged_in = False
     st.session_state.user_info = {}
+    forget_login(db)
     st.session_state.auth_status = {
         "message": "You have been logged out successfully.",
         "type": "info"
@@ -0,0 +1,159 @@
+"""Local stand-in for the OpenAI HTTP API used by the app.
+
+Serves chat completions, text-to-speech and image generation with a
+configurable latency so the app can be load tested without network calls
+or API costs. Point the app at it with OPENAI_BASE_URL=http://host:port/v1.
+
+Usage (standalone):
+    python -m benchmarks.fake_openai [--port 8765] [--chat-latency 0.4] [--tts-latency 0.3] [--image-latency 2.0]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_REPLIES = [
+    "¡Hola! ¡Qué alegría verte! ¿Qué te gustaría hacer hoy?",
+    "¡Muy bien! Me encanta. ¿Me cuentas más?",
+    "¡Qué divertido! ¿Prefieres jugar con colores o con animales?",
+    "¡Genial! ¿Quieres que dibujemos algo juntos?",
+]
+ROBOT_EMOTIONS = ["saludo", "correcto", "risa", "pensar", "sorprendido"]
+
+# A few bytes are enough: the app only base64-encodes the audio for the browser
+FAKE_MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\x00" * 512
+
+
+class LatencyProfile:
+    """Mean latency in seconds per endpoint, with +/- jitter as a fraction of the mean"""
+
+    def __init__(self, chat=0.4, tts=0.3, image=2.0, jitter=0.2):
+        self.latencies = {"chat": chat, "tts": tts, "image": image}
+        self.jitter = jitter
+
+    def sleep(self, endpoint):
+        mean = self.latencies.get(endpoint, 0.0)
+        if mean > 0:
+            time.sleep(max(0.0, random.uniform(mean * (1 - self.jitter), mean * (1 + self.jitter))))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        profile = self.server.latency_profile
+        path = self.path.split("?")[0].rstrip("/")
+        payload = self._read_json()
+        self.server.count_request(path)
+
+        if path.endswith("/chat/completions"):
+            profile.sleep("chat")
+            self._send(200, self._chat_completion(payload))
+        elif path.endswith("/audio/speech"):
+            profile.sleep("tts")
+            self._send(200, FAKE_MP3, content_type="audio/mpeg")
+        elif path.endswith("/images/generations"):
+            profile.sleep("image")
+            self._send(200, {
+                "created": int(time.time()),
+                "data": [{"url": f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/images/{uuid.uuid4()}.png"}]
+            })
+        else:
+            self._send(404, {"error": {"message": f"Unknown endpoint {path}", "type": "invalid_request_error"}})
+
+    def _chat_completion(self, payload):
+        messages = payload.get("messages", [])
+        last_content = str(messages[-1].get("content", "")) if messages else ""
+        # The robot image classifier expects a single emotion name
+        if "Responde SOLO con el nombre de la imagen" in last_content:
+            content = random.choice(ROBOT_EMOTIONS)
+        else:
+            content = random.choice(CHAT_REPLIES)
+
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in messages)
+        completion_tokens = len(content.split())
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_profile):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency_profile = latency_profile
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+
+    def count_request(self, path):
+        with self._counts_lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_fake_openai(host="127.0.0.1", port=0, latency_profile=None):
+    """Start the server on a background thread and return it (port 0 picks a free port)"""
+    server = FakeOpenAIServer((host, port), latency_profile or LatencyProfile())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency", type=float, default=0.4)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    args = parser.parse_args()
+
+    profile = LatencyProfile(args.chat_latency, args.tts_latency, args.image_latency, args.jitter)
+    server = FakeOpenAIServer((args.host, args.port), profile)
+    print(f"Fake OpenAI API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
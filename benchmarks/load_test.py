@@ -0,0 +1,207 @@
+"""End-to-end load test of the Streamlit app.
+
+Drives the real main.py (auth page, ChatHandler, SessionHandler and the
+staff page) through Streamlit's AppTest. N simulated children sign up,
+log in and chat concurrently against a local fake OpenAI server and a
+local database. The script reports turns/sec, turn latency percentiles
+and memory per session.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test [--children 10] [--turns 10] [--storage memory|mongomock|mongodb]
+                                   [--chat-latency 0.4] [--tts-latency 0.3] [--image-latency 2.0]
+                                   [--json results.json]
+
+--storage mongodb uses MONGODB_URI (e.g. a local mongod) with a scratch
+database that is dropped at the end.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fake_openai import LatencyProfile, start_fake_openai
+
+CHILD_UTTERANCES = [
+    "hola Pepper",
+    "sí",
+    "me gusta el azul",
+    "quiero jugar con los dinosaurios",
+    "haz un dibujo de un perro",
+    "no sé",
+    "mi mamá me llevó al parque",
+    "vale",
+]
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _new_app(timeout):
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(APP_FILE, default_timeout=timeout)
+
+
+def _sign_up_and_log_in(app, name, email, user_type="child"):
+    """Create an account and log in through the real auth page"""
+    password = "loadtest-password"
+    app.run()
+    if user_type == "staff":
+        app.radio(key="user_type_radio").set_value(1)
+    app.text_input(key="signup_name").input(name)
+    app.text_input(key="signup_email").input(email)
+    app.text_input(key="signup_password").input(password)
+    app.text_input(key="signup_password_confirm").input(password)
+    app.button(key="signup_button").click().run()
+
+    app.text_input(key="login_email").input(email)
+    app.text_input(key="login_password").input(password)
+    app.button(key="login_button").click().run()
+    if not app.session_state["logged_in"]:
+        raise RuntimeError(f"Could not log in as {email}: {app.session_state['auth_status']}")
+
+
+def run_child(index, turns, timeout, errors):
+    """Simulate one child session and return the latency of each turn in seconds"""
+    app = _new_app(timeout)
+    _sign_up_and_log_in(app, f"Niño {index}", f"child{index}-{uuid.uuid4().hex[:8]}@loadtest.local")
+    latencies = []
+
+    for turn in range(turns):
+        utterance = CHILD_UTTERANCES[(index + turn) % len(CHILD_UTTERANCES)]
+        started = time.perf_counter()
+        app.text_input(key="text_input").input(utterance).run()
+        latencies.append(time.perf_counter() - started)
+
+        if app.exception:
+            errors.append(f"child {index}, turn {turn}: {app.exception[0].message}")
+            break
+
+    return latencies, app
+
+
+def measure_memory_per_session(sessions, turns, timeout):
+    """Average Python heap retained per live child session (measured with tracemalloc)"""
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    apps = []
+    errors = []
+    for index in range(sessions):
+        _, app = run_child(10_000 + index, turns, timeout, errors)
+        apps.append(app)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (retained - baseline) / max(1, sessions), peak - baseline
+
+
+def measure_staff_page(timeout):
+    """Log in as staff and time the dashboard render with all simulated children present"""
+    app = _new_app(timeout)
+    _sign_up_and_log_in(app, "Staff", f"staff-{uuid.uuid4().hex[:8]}@loadtest.local", user_type="staff")
+    started = time.perf_counter()
+    app.run()
+    return time.perf_counter() - started, app.exception
+
+
+def configure_environment(args, fake_server):
+    os.environ["OPENAI_API_KEY"] = "sk-loadtest"
+    os.environ["OPENAI_BASE_URL"] = fake_server.base_url
+    os.environ["OPENAI_API_BASE"] = fake_server.base_url
+    os.environ["STORAGE_BACKEND"] = args.storage
+    if args.storage == "mongodb":
+        os.environ["MONGODB_DATABASE"] = args.database
+        if not os.getenv("MONGODB_URI"):
+            os.environ["MONGODB_URI"] = "mongodb://localhost:27017"
+
+
+def drop_scratch_database(args):
+    if args.storage == "mongodb":
+        import pymongo
+        pymongo.MongoClient(os.environ["MONGODB_URI"]).drop_database(args.database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the therapy app")
+    parser.add_argument("--children", type=int, default=10, help="Concurrent simulated children")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per child")
+    parser.add_argument("--storage", default="memory", choices=["memory", "sqlite", "mongomock", "mongodb"])
+    parser.add_argument("--database", default="asd-therapy-loadtest")
+    parser.add_argument("--chat-latency", type=float, default=0.4)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--memory-sessions", type=int, default=3,
+                        help="Sessions used for the (slower) tracemalloc memory measurement")
+    parser.add_argument("--timeout", type=float, default=120.0, help="AppTest timeout per run in seconds")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    fake_server = start_fake_openai(latency_profile=LatencyProfile(
+        args.chat_latency, args.tts_latency, args.image_latency, args.jitter
+    ))
+    configure_environment(args, fake_server)
+
+    errors = []
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.children) as executor:
+            futures = [executor.submit(run_child, index, args.turns, args.timeout, errors) for index in range(args.children)]
+            latencies = [latency for future in futures for latency in future.result()[0]]
+        elapsed = time.perf_counter() - started
+
+        staff_time, staff_exception = measure_staff_page(args.timeout)
+        memory_per_session, memory_peak = measure_memory_per_session(args.memory_sessions, args.turns, args.timeout)
+    finally:
+        fake_server.shutdown()
+        drop_scratch_database(args)
+
+    results = {
+        "children": args.children,
+        "turns_per_child": args.turns,
+        "storage": args.storage,
+        "completed_turns": len(latencies),
+        "wall_time_s": round(elapsed, 3),
+        "turns_per_sec": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "turn_latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p95": round(_percentile(latencies, 95) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1)
+        },
+        "staff_page_render_ms": round(staff_time * 1000, 1),
+        "memory_per_session_kb": round(memory_per_session / 1024, 1),
+        "memory_peak_kb": round(memory_peak / 1024, 1),
+        "openai_requests": dict(fake_server.request_counts),
+        "errors": errors + ([str(staff_exception[0].message)] if staff_exception else [])
+    }
+
+    print(f"{results['children']} children x {results['turns_per_child']} turns on {results['storage']} storage")
+    print(f"  completed turns      {results['completed_turns']} in {results['wall_time_s']} s "
+          f"({results['turns_per_sec']} turns/s)")
+    latency = results["turn_latency_ms"]
+    print(f"  turn latency (ms)    p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  mean {latency['mean']}")
+    print(f"  staff dashboard      {results['staff_page_render_ms']} ms")
+    print(f"  memory per session   {results['memory_per_session_kb']} KB (peak {results['memory_peak_kb']} KB)")
+    print(f"  OpenAI requests      {results['openai_requests']}")
+    for error in results["errors"]:
+        print(f"  ERROR {error}", file=sys.stderr)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    sys.exit(1 if results["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Compare the per-document and bucketed message layouts.
+
+Writes the same synthetic sessions with both layouts through the
+db_operations API and reports write latency per turn, read latency per
+session load and storage size of each collection.
+
+Usage (from the repository root):
+    python -m benchmarks.message_layout [--sessions 50] [--turns 40] [--bucket-size 50]
+
+Uses MONGODB_URI and a scratch database that is dropped at the end.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+import pymongo
+from dotenv import load_dotenv
+from db_operations import load_session_messages, save_message_batch
+from storage import MESSAGE_LAYOUT_BUCKETS, MESSAGE_LAYOUT_DOCUMENTS, setup_bucket_indexes
+
+CHILD_UTTERANCES = ["sí", "no", "me gusta", "un perro", "quiero jugar", "azul", "hola Pepper", "no sé"]
+ASSISTANT_REPLIES = [
+    "¡Muy bien! ¿Qué más te gusta hacer?",
+    "¡Qué divertido! ¿Me cuentas más sobre tu perro?",
+    "Vamos a jugar juntos. ¿Prefieres colores o animales?",
+]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _turn(session_id, turn_index, start_time):
+    timestamp = start_time + timedelta(seconds=turn_index * 10)
+    return [
+        {
+            "message_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "role": "user",
+            "content": random.choice(CHILD_UTTERANCES),
+            "timestamp": timestamp
+        },
+        {
+            "message_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "role": "assistant",
+            "content": random.choice(ASSISTANT_REPLIES),
+            "timestamp": timestamp + timedelta(seconds=2)
+        }
+    ]
+
+
+def _collection_size(db, name):
+    try:
+        stats = db.command("collStats", name)
+        return stats.get("size", 0), stats.get("storageSize", 0), stats.get("totalIndexSize", 0)
+    except pymongo.errors.OperationFailure:
+        return 0, 0, 0
+
+
+def run_layout(db, layout, sessions, turns):
+    """Write and read back all sessions with one layout and return timings"""
+    os.environ["MESSAGE_LAYOUT"] = layout
+    if layout == MESSAGE_LAYOUT_BUCKETS:
+        setup_bucket_indexes(db)
+    else:
+        db["messages"].create_index("session_id")
+        db["messages"].create_index("timestamp")
+
+    random.seed(42)
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    start_time = datetime.now()
+
+    write_times = []
+    for turn_index in range(turns):
+        for session_id in session_ids:
+            started = time.perf_counter()
+            save_message_batch(db, _turn(session_id, turn_index, start_time))
+            write_times.append(time.perf_counter() - started)
+
+    read_times = []
+    for session_id in session_ids:
+        started = time.perf_counter()
+        messages = load_session_messages(db, session_id)
+        read_times.append(time.perf_counter() - started)
+        assert len(messages) == turns * 2, f"expected {turns * 2} messages, got {len(messages)}"
+
+    collection = "message_buckets" if layout == MESSAGE_LAYOUT_BUCKETS else "messages"
+    return {
+        "write": write_times,
+        "read": read_times,
+        "size": _collection_size(db, collection)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message storage layouts")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--bucket-size", type=int, default=50)
+    parser.add_argument("--database", default="asd-therapy-bench")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+    os.environ["MESSAGE_BUCKET_SIZE"] = str(args.bucket_size)
+
+    client = pymongo.MongoClient(mongodb_uri)
+    client.drop_database(args.database)
+    db = client[args.database]
+
+    try:
+        results = {
+            layout: run_layout(db, layout, args.sessions, args.turns)
+            for layout in (MESSAGE_LAYOUT_DOCUMENTS, MESSAGE_LAYOUT_BUCKETS)
+        }
+    finally:
+        client.drop_database(args.database)
+
+    print(f"{args.sessions} sessions x {args.turns} turns, bucket size {args.bucket_size}")
+    print(f"{'layout':<10} {'write p50':>10} {'write p95':>10} {'read p50':>10} {'read p95':>10} "
+          f"{'data KB':>10} {'storage KB':>11} {'index KB':>10}")
+    for layout, result in results.items():
+        data_size, storage_size, index_size = result["size"]
+        print(f"{layout:<10} "
+              f"{statistics.median(result['write']) * 1000:>8.2f}ms "
+              f"{_percentile(result['write'], 95) * 1000:>8.2f}ms "
+              f"{statistics.median(result['read']) * 1000:>8.2f}ms "
+              f"{_percentile(result['read'], 95) * 1000:>8.2f}ms "
+              f"{data_size / 1024:>10.1f} {storage_size / 1024:>11.1f} {index_size / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
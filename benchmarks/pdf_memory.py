@@ -0,0 +1,89 @@
+"""Peak memory of in-memory vs streaming PDF generation.
+
+For transcripts of 1k, 10k and 100k messages, renders the PDF the old way
+(full message list + story list + BytesIO + getvalue copy) and the
+streaming way (messages from an iterator, incremental layout into a
+spooled temporary file). Each run happens in a fresh process so the peak
+RSS numbers do not influence each other.
+
+Usage (from the repository root):
+    python -m benchmarks.pdf_memory [--sizes 1000 10000 100000]
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+import tracemalloc
+
+CHILD_LINES = ["sí", "me gusta el perro", "quiero jugar", "azul", "no sé", "mi hermano tiene un balón rojo"]
+ASSISTANT_LINES = [
+    "¡Muy bien! ¿Qué más te gusta hacer?",
+    "¡Qué divertido! ¿Me cuentas más sobre tu perro? ¿Cómo se llama?",
+    "Vamos a jugar juntos. ¿Prefieres colores o animales?",
+]
+
+
+def synthetic_messages(count):
+    """Yield count alternating child/assistant messages without building a list"""
+    for index in range(count):
+        if index % 2 == 0:
+            yield {"role": "user", "content": CHILD_LINES[index % len(CHILD_LINES)]}
+        else:
+            yield {"role": "assistant", "content": ASSISTANT_LINES[index % len(ASSISTANT_LINES)]}
+
+
+def _render(mode, count, queue):
+    from pdf_generator import PDFGenerator
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    generator = PDFGenerator()
+
+    if mode == "in-memory":
+        # What the staff page used to do: load everything, build, then copy out
+        messages = list(synthetic_messages(count))
+        pdf_bytes = generator.create_pdf(messages, "Niño", "Benchmark").getvalue()
+        size = len(pdf_bytes)
+    else:
+        pdf_file = generator.create_pdf_file(synthetic_messages(count), "Niño", "Benchmark")
+        pdf_file.seek(0, 2)
+        size = pdf_file.tell()
+        pdf_file.close()
+
+    elapsed = time.perf_counter() - started
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queue.put({
+        "python_peak_mb": python_peak / 1024 / 1024,
+        # ru_maxrss is in KB on Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "pdf_mb": size / 1024 / 1024,
+        "seconds": elapsed
+    })
+
+
+def measure(mode, count):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_render, args=(mode, count, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF generation memory")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'messages':>9} {'mode':<10} {'py peak MB':>11} {'max RSS MB':>11} {'PDF MB':>8} {'seconds':>8}")
+    for count in args.sizes:
+        for mode in ("in-memory", "streaming"):
+            result = measure(mode, count)
+            print(f"{count:>9} {mode:<10} {result['python_peak_mb']:>11.1f} {result['max_rss_mb']:>11.1f} "
+                  f"{result['pdf_mb']:>8.1f} {result['seconds']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compare storage backends through the db_operations API.
+
+Runs the same workload (create sessions, save turns, list sessions, load
+transcripts, delete sessions) against the in-memory and SQLite backends,
+and against MongoDB when MONGODB_URI is set.
+
+Usage (from the repository root):
+    python -m benchmarks.storage_backends [--sessions 50] [--turns 40] [--no-mongodb]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from db_operations import (
+    create_session,
+    delete_session,
+    load_session_messages,
+    load_user_sessions,
+    save_message_batch
+)
+from storage import MongoBackend, SQLiteBackend
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _timed(samples, operation, *args):
+    started = time.perf_counter()
+    result = operation(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def run_workload(db, sessions, turns):
+    """Run the benchmark workload and return latency samples per operation"""
+    timings = {"create_session": [], "save_turn": [], "list_sessions": [], "load_messages": [], "delete_session": []}
+    user_id = f"bench-{uuid.uuid4()}"
+    start_time = datetime.now()
+
+    session_ids = [_timed(timings["create_session"], create_session, db, user_id) for _ in range(sessions)]
+
+    for turn_index in range(turns):
+        timestamp = start_time + timedelta(seconds=turn_index * 10)
+        for session_id in session_ids:
+            _timed(timings["save_turn"], save_message_batch, db, [
+                {"message_id": str(uuid.uuid4()), "session_id": session_id, "role": "user",
+                 "content": "quiero jugar", "timestamp": timestamp},
+                {"message_id": str(uuid.uuid4()), "session_id": session_id, "role": "assistant",
+                 "content": "¡Qué bien! ¿A qué quieres jugar?", "timestamp": timestamp + timedelta(seconds=2)}
+            ])
+
+    _timed(timings["list_sessions"], load_user_sessions, db, user_id)
+    for session_id in session_ids:
+        _timed(timings["load_messages"], load_session_messages, db, session_id)
+    for session_id in session_ids:
+        _timed(timings["delete_session"], delete_session, db, session_id)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark storage backends")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--no-mongodb", action="store_true", help="Skip the MongoDB backend")
+    parser.add_argument("--database", default="asd-therapy-bench")
+    args = parser.parse_args()
+
+    load_dotenv()
+    backends = {"memory": lambda: SQLiteBackend(":memory:")}
+
+    sqlite_dir = tempfile.mkdtemp()
+    backends["sqlite"] = lambda: SQLiteBackend(os.path.join(sqlite_dir, "bench.db"))
+
+    mongo_client = None
+    if not args.no_mongodb and os.getenv("MONGODB_URI"):
+        import pymongo
+        mongo_client = pymongo.MongoClient(os.getenv("MONGODB_URI"))
+        mongo_client.drop_database(args.database)
+        backends["mongodb"] = lambda: MongoBackend(mongo_client[args.database])
+
+    results = {}
+    try:
+        for name, factory in backends.items():
+            backend = factory()
+            backend.setup_indexes()
+            results[name] = run_workload(backend, args.sessions, args.turns)
+    finally:
+        if mongo_client is not None:
+            mongo_client.drop_database(args.database)
+
+    print(f"{args.sessions} sessions x {args.turns} turns (latency in ms, p50 / p95)")
+    operations = list(next(iter(results.values())).keys())
+    print(f"{'operation':<16}" + "".join(f"{name:>20}" for name in results))
+    for operation in operations:
+        row = f"{operation:<16}"
+        for timings in results.values():
+            samples = timings[operation]
+            row += f"{statistics.median(samples) * 1000:>11.2f} / {_percentile(samples, 95) * 1000:>6.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
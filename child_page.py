@@ -1,5 +1,8 @@
+import functools
 import streamlit as st
 from auth import logout
+from metrics import REGISTRY
+from session_memory import SWEEP_INTERVAL_SECONDS, evict_if_requested, track_session
 from child_page_components import (
     ChatHandler,
     AudioHandler,
@@ -8,10 +11,32 @@ from child_page_components import (
     get_child_page_styles
 )
 
+fragment_runs = REGISTRY.counter(
+    "child_page_fragment_runs_total",
+    "Executions of each child page fragment (page = full script runs)"
+)
+fragment_render_seconds = REGISTRY.histogram(
+    "child_page_fragment_render_seconds",
+    "Render time of each child page fragment"
+)
+
+def _timed_fragment(name):
+    """Turn a render function into an st.fragment whose runs and render time are recorded"""
+    def decorator(func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            fragment_runs.inc(fragment=name)
+            with fragment_render_seconds.time(fragment=name):
+                return func(*args, **kwargs)
+        return st.fragment(timed)
+    return decorator
+
 def display_child_page(db):
     """Main function to display the child-friendly therapy assistant interface"""
+    fragment_runs.inc(fragment="page")
+    track_session(st.session_state.user_info["user_id"])
     
-    # Apply custom CSS
+    # Apply custom CSS (only on full reruns; fragment reruns keep it)
     st.markdown(get_child_page_styles(), unsafe_allow_html=True)
     
     # Initialize components
@@ -29,16 +54,21 @@ def display_child_page(db):
     # Create two-column layout
     col1, col2 = st.columns([1, 2], gap="small")
     
-    # Render sidebar
-    _render_sidebar()
+    # Render sidebar (fragments cannot write to st.sidebar from inside, so enter it first)
+    with st.sidebar:
+        _render_sidebar(db)
     
-    # Column 1: Robot character
+    # Column 1: Robot character (a placeholder the chat fragment redraws when the face changes)
     with col1:
-        ui_renderer.render_robot_section()
+        robot_panel = st.empty()
+        _render_robot_section(ui_renderer, robot_panel)
     
     # Column 2: Chat interface
     with col2:
-        _render_chat_section(chat_handler, audio_handler, session_handler)
+        _render_chat_section(chat_handler, audio_handler, session_handler, ui_renderer, robot_panel)
+    
+    # Lets the memory sweeper evict this tab's heavy state from the tab's own thread while it is idle
+    _memory_watch()
 
 def _initialize_session_states():
     """Initialize all required session states"""
@@ -68,46 +98,84 @@ def _handle_user_change_and_prepare_fresh(session_handler):
         st.session_state.last_active_user != current_user or
         not st.session_state.fresh_session_prepared):
         
+        # Evicted state of another user's conversation is not brought back
+        st.session_state.pop("evicted_session_id", None)
+        
         # Reset all session data
         session_handler.reset_user_sessions()
         
-        # Prepare a new session (generate ID but don't save to DB yet)
-        session_handler.prepare_new_session()
+        # A new browser session (reload, reconnect or another replica) continues the shared conversation
+        # state, then a recent session from the DB; otherwise prepare a new one (generate ID but don't save to DB yet)
+        if st.session_state.pop("start_new_session", False):
+            session_handler.prepare_new_session()
+            # Other tabs and replicas switch to the new conversation too
+            session_handler.publish_state()
+        elif not session_handler.restore_shared_state() and not session_handler.resume_latest_session():
+            session_handler.prepare_new_session()
         
         # Mark that we've prepared a fresh session for this user
         st.session_state.last_active_user = current_user
         st.session_state.fresh_session_prepared = True
+    elif not session_handler.ensure_resident():
+        # Pick up turns another replica or tab served since this session's last run
+        session_handler.sync_shared_state()
 
-def _render_sidebar():
+@_timed_fragment("sidebar")
+def _render_sidebar(db):
     """Render the sidebar with user info and settings (no conversation history)"""
+    track_session(st.session_state.user_info["user_id"])
+    
     # User info
-    st.sidebar.title(f"Welcome, {st.session_state.user_info.get('name', 'User')}")
-    st.sidebar.write(f"Type: {st.session_state.user_info['user_type'].capitalize()}")
+    st.title(f"Welcome, {st.session_state.user_info.get('name', 'User')}")
+    st.write(f"Type: {st.session_state.user_info['user_type'].capitalize()}")
     
     # Settings section
-    st.sidebar.markdown("---")
-    st.sidebar.markdown("## Settings")
+    st.markdown("---")
+    st.markdown("## Settings")
     
-    # TTS toggle
-    st.session_state["tts_enabled"] = st.sidebar.toggle(
+    # TTS toggle (only this fragment reruns; the chat reads the flag on the next turn)
+    st.session_state["tts_enabled"] = st.toggle(
         "Enable voice responses", 
         value=st.session_state["tts_enabled"]
     )
     
+    # Start over instead of continuing the resumed session
+    st.markdown("---")
+    if st.button("🆕 Nueva conversación", key="new_conversation"):
+        st.session_state.fresh_session_prepared = False
+        st.session_state.start_new_session = True
+        st.rerun(scope="app")
+    
     # Logout button
-    st.sidebar.markdown("---")
-    if st.sidebar.button("Logout"):
+    if st.button("Logout"):
         # Reset session flags on logout
         st.session_state.fresh_session_prepared = False
         st.session_state.session_created_in_db = False
-        logout()
-        st.rerun()
+        logout(db)
+        st.rerun(scope="app")
+
+def _render_robot_section(ui_renderer, robot_panel):
+    """Render the robot panel into its placeholder and remember which face is on screen"""
+    fragment_runs.inc(fragment="robot")
+    with fragment_render_seconds.time(fragment="robot"):
+        with robot_panel.container():
+            ui_renderer.render_robot_section()
+    st.session_state.rendered_robot_emotion = ui_renderer.current_emotion()
 
-def _render_chat_section(chat_handler, audio_handler, session_handler):
+@_timed_fragment("chat_input")
+def _render_chat_section(chat_handler, audio_handler, session_handler, ui_renderer, robot_panel):
     """Render the main chat interface"""
+    # Fragment reruns are activity too, and may find the conversation evicted
+    track_session(st.session_state.user_info["user_id"])
+    session_handler.ensure_resident()
+    
+    # A turn processed in this fragment's callback may have changed the robot face:
+    # redraw only the robot placeholder (st.empty replaces its content, so nothing piles up)
+    if st.session_state.get("rendered_robot_emotion") != ui_renderer.current_emotion():
+        _render_robot_section(ui_renderer, robot_panel)
     
     # Display chat messages
-    chat_handler.display_messages()
+    _render_message_list(chat_handler, session_handler)
     
     # Display audio player if needed
     chat_handler.display_audio_player()
@@ -125,4 +193,17 @@ def _render_chat_section(chat_handler, audio_handler, session_handler):
             )
         
         with col2:
-            audio_handler.render_audio_input(chat_handler, session_handler)
\ No newline at end of file
+            audio_handler.render_audio_input(chat_handler, session_handler)
+
+@_timed_fragment("message_list")
+def _render_message_list(chat_handler, session_handler):
+    """Render the transcript; reruns with the chat input or on its own interactions"""
+    # Its own reruns ("load earlier messages") are activity, and may find the conversation evicted
+    track_session(st.session_state.user_info["user_id"])
+    session_handler.ensure_resident()
+    chat_handler.display_messages()
+
+@st.fragment(run_every=SWEEP_INTERVAL_SECONDS)
+def _memory_watch():
+    """Evict this session's heavy state if the sweeper flagged it (renders nothing, is not activity)"""
+    evict_if_requested()
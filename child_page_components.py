@@ -1,25 +1,76 @@
 import streamlit as st
-import PIL.Image
+from streamlit.errors import StreamlitAPIException
 import tempfile
 import soundfile as sf
 import os
+import time
 import uuid
 from audiorecorder import audiorecorder
-from datetime import datetime  
+from datetime import datetime, timedelta
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain.schema import SystemMessage
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
 from llm_therapist import (
     initialize_llm_chain, 
-    process_message, 
     generate_speech, 
     create_audio_player,
-    select_robot_image
+    select_robot_emotion
+)
+from robot_media import DEFAULT_EMOTION, robot_image_html
+from conversation_state import get_conversation_store, history_entries
+from session_memory import measure_current_session, session_rehydrations, track_session
+from model_router import (
+    TEMPLATE_EMOTION,
+    TIER_FAST,
+    TIER_FULL,
+    TIER_TEMPLATE,
+    fast_max_tokens,
+    fast_model,
+    full_model,
+    routed_process_message
 )
 from db_operations import (
+    create_session,
+    load_latest_session,
+    load_session,
+    load_recent_session_messages,
     setup_database_indexes,
     save_message,
     save_message_batch
 )
+from turn_tracing import TurnTrace
+
+# Messages rendered as chat bubbles on every rerun; older ones load in blocks of this size
+MESSAGE_WINDOW = 40
+
+def resume_within():
+    """A reload continues the latest session if it had messages this recently (read when used, so .env values apply)"""
+    return timedelta(minutes=int(os.getenv("CHILD_RESUME_MINUTES", "120")))
+
+def resume_turns():
+    """Number of turns loaded when a session is resumed"""
+    return int(os.getenv("CHILD_RESUME_TURNS", "10"))
+
+HISTORY_MESSAGE_CLASSES = {"system": SystemMessage, "human": HumanMessage, "ai": AIMessage}
+
+@st.cache_resource
+def get_llm_chains():
+    """One chain per model tier and process: conversations only differ by the history passed in"""
+    with open("system_prompt4.txt", "r", encoding="utf-8") as file:
+        system_prompt_content = file.read()
+    _, full_chain = initialize_llm_chain(system_prompt_content, model=full_model())
+    _, fast_chain = initialize_llm_chain(system_prompt_content, model=fast_model(), max_tokens=fast_max_tokens())
+    return {TIER_FULL: full_chain, TIER_FAST: fast_chain}
+
+def _message_html(message):
+    """Static HTML for a message shown in the collapsed earlier history"""
+    if message.get("type") == "image":
+        # loading="lazy" so old DALL·E images are only fetched when scrolled into view
+        return (
+            f'<div class="earlier-message"><img class="earlier-image" src="{message["content"]}" '
+            f'loading="lazy" alt="Imagen generada por DALL·E"></div>'
+        )
+    role_class = "user-message" if message["role"] == "user" else "assistant-message"
+    return f'<div class="earlier-message"><div class="{role_class}">{message["content"]}</div></div>'
 
 class ChatHandler:
     """Handles all chat-related functionality"""
@@ -31,27 +82,39 @@ class ChatHandler:
         self._pending_messages = []  # For batch operations
     
     def _initialize_llm(self):
-        """Initialize LLM chain if needed"""
-        if "llm" not in st.session_state or "agent_chain" not in st.session_state:
-            # Load system prompt from file
-            with open("system_prompt4.txt", "r", encoding="utf-8") as file:
-                system_prompt_content = file.read()
-            
-            st.session_state.llm, st.session_state.agent_chain = initialize_llm_chain(system_prompt_content)
-            
-            # Initialize chat history
-            if "chat_history" not in st.session_state:
-                st.session_state.chat_history = ChatMessageHistory()
-                st.session_state.chat_history.add_message(SystemMessage(content=system_prompt_content))
+        """Use the shared LLM chains and make sure there is a chat history"""
+        # The system prompt is the first message of the chains' prompt template, not part of the history
+        self.agent_chains = get_llm_chains()
+        if "chat_history" not in st.session_state:
+            st.session_state.chat_history = ChatMessageHistory()
     
     def _ensure_database_setup(self):
         """Ensure database indexes exist for better performance - only once"""
         setup_database_indexes(self.db)
         
     def display_messages(self):
-        """Display chat messages from history"""
-        # Display chat messages from history
-        for message in st.session_state.messages:
+        """Display the last MESSAGE_WINDOW messages; older ones load on demand as cached HTML"""
+        messages = st.session_state.messages
+        tail_start = max(0, len(messages) - MESSAGE_WINDOW)
+        earlier_shown = st.session_state.get("earlier_messages_shown", 0)
+        earlier_start = tail_start
+        if earlier_shown:
+            # Start on a block boundary so the loaded history is made of cacheable blocks
+            earlier_start = max(0, tail_start - earlier_shown)
+            earlier_start -= earlier_start % MESSAGE_WINDOW
+        
+        # Older history stays collapsed until asked for (reruns only the message list fragment)
+        if earlier_start > 0:
+            st.button(
+                f"⬆️ Cargar mensajes anteriores ({earlier_start})",
+                key="load_earlier_messages",
+                on_click=self._show_earlier_messages
+            )
+        if earlier_start < tail_start:
+            st.markdown(self._earlier_messages_html(messages, earlier_start, tail_start), unsafe_allow_html=True)
+        
+        # Display the recent window as regular chat messages
+        for message in messages[tail_start:]:
             role_class = "user-message" if message["role"] == "user" else "assistant-message"
             
             if message.get("type", "text") == "text":
@@ -61,6 +124,28 @@ class ChatHandler:
                 with st.chat_message(message["role"]):
                     st.image(message["content"], caption="Imagen generada por DALL·E", use_container_width=True)
     
+    def _show_earlier_messages(self):
+        st.session_state.earlier_messages_shown = st.session_state.get("earlier_messages_shown", 0) + MESSAGE_WINDOW
+    
+    def _earlier_messages_html(self, messages, start, end):
+        """HTML of messages[start:end] (start on a block boundary), reusing cached blocks"""
+        cache = st.session_state.get("transcript_html_cache")
+        if not cache or cache.get("session_id") != st.session_state.current_session_id:
+            cache = st.session_state.transcript_html_cache = {"session_id": st.session_state.current_session_id}
+        
+        parts = []
+        for block_start in range(start, end, MESSAGE_WINDOW):
+            block_end = block_start + MESSAGE_WINDOW
+            if block_end <= end:
+                # A complete block never changes, so it is rendered only once per session
+                if block_start not in cache:
+                    cache[block_start] = "".join(map(_message_html, messages[block_start:block_end]))
+                parts.append(cache[block_start])
+            else:
+                # The block next to the live window is still growing
+                parts.append("".join(map(_message_html, messages[block_start:end])))
+        return f'<div class="earlier-messages">{"".join(parts)}</div>'
+    
     def display_audio_player(self):
         """Display audio player if there's a response to be played"""
         if st.session_state.audio_response and st.session_state.tts_enabled:
@@ -81,20 +166,30 @@ class ChatHandler:
         """Handle user text input - for compatibility with audio handler"""
         self.process_user_message(user_input, session_handler)
     
-    def process_user_message(self, user_input, session_handler):
+    def process_user_message(self, user_input, session_handler, trace=None, input_mode="text"):
         """Process user message through LLM and handle response"""
+        # Time every stage of the turn (voice turns pass in the trace with transcription timed)
+        trace = trace or TurnTrace()
+        
+        # Callbacks run before any page or fragment code: the tab may have been evicted while idle
+        track_session(st.session_state.user_info["user_id"])
+        session_handler.ensure_resident()
+        
         # Create session in database only when first message is sent
         if not st.session_state.session_created_in_db:
             session_handler.create_session_in_database()
         
-        # Add user message to UI messages
+        # Add user message to UI messages (stamped now, so it sorts before the reply when reloaded)
+        received_at = datetime.now()
+        turn_start = len(st.session_state.messages)
         st.session_state.messages.append({"role": "user", "content": user_input, "type": "text"})
         
-        # Process message through LLM agent (updated to handle 4 return values)
-        human_message, ai_message, response_content, image_url = process_message(
-            st.session_state.agent_chain,
+        # Process message through the model tier the router picks for it (updated to handle 4 return values)
+        (human_message, ai_message, response_content, image_url), route = routed_process_message(
+            self.agent_chains,
             user_input,
-            st.session_state.chat_history
+            st.session_state.chat_history,
+            trace=trace
         )
         
         # Add messages to chat history
@@ -108,27 +203,54 @@ class ChatHandler:
         if image_url:
             st.session_state.messages.append({"role": "assistant", "content": image_url, "type": "image"})
         
-        # Save messages to database using batch operation for better performance
-        self._save_messages_batch([
-            {
-                "message_id": f"user_{len(st.session_state.messages)}",
-                "session_id": st.session_state.current_session_id,
-                "role": "user",
-                "content": user_input,
-                "timestamp": datetime.now()
-            },
-            {
-                "message_id": f"assistant_{len(st.session_state.messages)}",
-                "session_id": st.session_state.current_session_id,
-                "role": "assistant",
-                "content": response_content,
-                "timestamp": datetime.now()
-            }
-        ])
+        # Select the robot face once per turn instead of on every rerun
+        with trace.stage("robot_selection"):
+            if route.tier == TIER_TEMPLATE:
+                # A templated reinforcement is praise: no classifier call needed
+                st.session_state.robot_emotion = TEMPLATE_EMOTION
+            else:
+                st.session_state.robot_emotion = select_robot_emotion(user_input, response_content)
         
         # Generate audio if TTS is enabled
         if st.session_state.tts_enabled:
-            st.session_state.audio_response = generate_speech(response_content)
+            with trace.stage("tts"):
+                st.session_state.audio_response = generate_speech(response_content)
+            trace.mark_first_audio()
+        
+        # Let any replica serve the next turn (before the write, so its time is stored with the turn)
+        with trace.stage("state_save"):
+            session_handler.publish_state(
+                st.session_state.messages[turn_start:],
+                history_entries(st.session_state.chat_history)[-2:]
+            )
+        
+        # Save messages to database using batch operation for better performance
+        assistant_doc = {
+            "message_id": str(uuid.uuid4()),
+            "session_id": st.session_state.current_session_id,
+            "role": "assistant",
+            "content": response_content,
+            "timestamp": datetime.now(),
+            "timings": trace.as_dict()
+        }
+        if image_url:
+            assistant_doc["image_generated"] = True
+        
+        with trace.stage("db_write"):
+            self._save_messages_batch([
+                {
+                    "message_id": str(uuid.uuid4()),
+                    "session_id": st.session_state.current_session_id,
+                    "role": "user",
+                    "content": user_input,
+                    "input_mode": input_mode,
+                    "timestamp": received_at
+                },
+                assistant_doc
+            ])
+        
+        # The session grew by one turn: measure it once here rather than on every rerun
+        measure_current_session()
     
     def _save_messages_batch(self, messages):
         """Save multiple messages in a single batch operation"""
@@ -145,6 +267,14 @@ class ChatHandler:
             for msg in messages:
                 save_message(self.db, msg['session_id'], msg['role'], msg['content'])
 
+def rerun_chat_fragment():
+    """Rerun only the chat fragment (it also redraws the robot panel if the face changed)"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # Fragment-scoped reruns are only allowed during a fragment rerun
+        st.rerun()
+
 class AudioHandler:
     """Handles audio recording and transcription using audiorecorder library"""
     
@@ -183,15 +313,17 @@ class AudioHandler:
             with st.spinner("Transcribiendo audio..."):
                 try:
                     from llm_therapist import load_whisper_model
-                    model = load_whisper_model()
-                    result = model.transcribe(temp_path, language="es")
+                    trace = TurnTrace()
+                    with trace.stage("transcription"):
+                        model = load_whisper_model()
+                        result = model.transcribe(temp_path, language="es")
                     transcribed_text = result["text"]
                     
                     if transcribed_text and transcribed_text.strip():
                         st.info(f"Transcribed: {transcribed_text}")
                         # Process through chat handler
-                        chat_handler.process_user_message(transcribed_text, session_handler)
-                        st.rerun()
+                        chat_handler.process_user_message(transcribed_text, session_handler, trace=trace, input_mode="voice")
+                        rerun_chat_fragment()
                     else:
                         st.error("No se pudo transcribir el audio. Por favor, inténtalo de nuevo.")
                 except Exception as e:
@@ -219,6 +351,10 @@ class SessionHandler:
         st.session_state.current_session_id = None
         st.session_state.messages = []
         st.session_state.session_created_in_db = False
+        st.session_state.robot_emotion = DEFAULT_EMOTION
+        st.session_state.earlier_messages_shown = 0
+        st.session_state.conversation_state_version = 0
+        st.session_state.pop("transcript_html_cache", None)
         
         # Clear chat history completely
         if "chat_history" in st.session_state:
@@ -230,6 +366,10 @@ class SessionHandler:
             if key in st.session_state:
                 del st.session_state[key]
     
+    def _new_chat_history(self):
+        """Empty chat history (the system prompt comes from the chain's prompt template)"""
+        return ChatMessageHistory()
+    
     def prepare_new_session(self):
         """Prepare a new therapy session (generate ID but don't save to DB yet)"""
         
@@ -240,19 +380,8 @@ class SessionHandler:
         # Ensure messages list is completely empty
         st.session_state.messages = []
         
-        # Re-initialize chat history with system prompt
-        from langchain_community.chat_message_histories import ChatMessageHistory
-        from langchain.schema import SystemMessage
-        
-        st.session_state.chat_history = ChatMessageHistory()
-        
-        # Re-add system prompt
-        try:
-            with open("system_prompt4.txt", "r", encoding="utf-8") as file:
-                system_prompt_content = file.read()
-            st.session_state.chat_history.add_message(SystemMessage(content=system_prompt_content))
-        except Exception as e:
-            st.error(f"Error loading system prompt: {str(e)}")
+        # Re-initialize chat history
+        st.session_state.chat_history = self._new_chat_history()
         
         # Reset sessions loaded flag
         st.session_state.sessions_loaded = False
@@ -260,31 +389,173 @@ class SessionHandler:
         # Mark that session is not yet created in database
         st.session_state.session_created_in_db = False
     
+    def resume_latest_session(self, max_idle=None):
+        """Continue the child's latest session if it was active within max_idle (default: resume_within()); returns True if resumed.
+        
+        Only the last resume_turns() turns are loaded (one query from the end of the
+        session), plus the session summary if the summarizer has written one.
+        """
+        session = load_latest_session(self.db, st.session_state.user_info["user_id"])
+        return session is not None and self._resume_session(session, max_idle or resume_within())
+    
+    def _resume_session(self, session, max_idle=None):
+        """Continue a stored session from its last resume_turns() turns; returns False if it has none"""
+        recent = load_recent_session_messages(self.db, session["session_id"], resume_turns() * 2)
+        recent = [message for message in recent if message.get("role") in ("user", "assistant")]
+        if not recent or (max_idle is not None and datetime.now() - recent[-1]["timestamp"] > max_idle):
+            return False
+        
+        chat_history = self._new_chat_history()
+        if session.get("summary"):
+            # Stands in for the turns that were not loaded
+            chat_history.add_message(SystemMessage(content=f"Resumen de la conversación hasta ahora: {session['summary']}"))
+        for message in recent:
+            message_class = HumanMessage if message["role"] == "user" else AIMessage
+            chat_history.add_message(message_class(content=message["content"]))
+        
+        st.session_state.current_session_id = session["session_id"]
+        st.session_state.messages = [
+            {"role": message["role"], "content": message["content"], "type": "text"} for message in recent
+        ]
+        st.session_state.chat_history = chat_history
+        st.session_state.sessions_loaded = False
+        st.session_state.session_created_in_db = True
+        return True
+    
+    def _apply_shared_state(self, version, state):
+        """Take over a conversation state saved by this or another replica"""
+        chat_history = self._new_chat_history()
+        for role, content in state["history"]:
+            chat_history.add_message(HISTORY_MESSAGE_CLASSES[role](content=content))
+        
+        st.session_state.current_session_id = state["session_id"]
+        st.session_state.messages = state["messages"]
+        st.session_state.chat_history = chat_history
+        st.session_state.robot_emotion = state.get("robot_emotion") or DEFAULT_EMOTION
+        st.session_state.session_created_in_db = state["session_created_in_db"]
+        st.session_state.conversation_state_version = version
+        st.session_state.sessions_loaded = False
+        st.session_state.earlier_messages_shown = 0
+        st.session_state.pop("transcript_html_cache", None)
+    
+    def restore_shared_state(self, session_id=None):
+        """Continue the conversation saved by any replica if it was active recently; returns True if it did.
+        
+        With session_id, only that session is restored, however old. Otherwise the stored
+        version is remembered, so only later writes are picked up by sync_shared_state.
+        """
+        try:
+            version, state = get_conversation_store(self.db).load(st.session_state.user_info["user_id"])
+        except Exception as e:
+            st.error(f"Error loading conversation state: {str(e)}")
+            return False
+        st.session_state.conversation_state_version = version
+        if state is None:
+            return False
+        if session_id is not None and state["session_id"] != session_id:
+            return False
+        if session_id is None and time.time() - state["updated_at"] > resume_within().total_seconds():
+            return False
+        self._apply_shared_state(version, state)
+        return True
+    
+    def rehydrate_session(self, session_id):
+        """Rebuild the conversation whose state was evicted while its tab was idle (session_memory.py).
+        
+        Only that session is reloaded, never another one of the child. A session that was
+        never saved (evicted before its first message) starts over as a new session.
+        """
+        if session_id is not None:
+            if self.restore_shared_state(session_id):
+                return
+            session = load_session(self.db, session_id)
+            if session and session.get("user_id") == st.session_state.user_info["user_id"] and self._resume_session(session):
+                return
+        self.prepare_new_session()
+    
+    def ensure_resident(self):
+        """Rebuild the conversation if its heavy state was evicted while idle; returns True if it was"""
+        if "evicted_session_id" not in st.session_state:
+            return False
+        session_id = st.session_state.pop("evicted_session_id")
+        self.reset_user_sessions()
+        self.rehydrate_session(session_id)
+        session_rehydrations.inc()
+        return True
+    
+    def sync_shared_state(self):
+        """Adopt a turn another replica or tab saved since this browser session last saw the state"""
+        store = get_conversation_store(self.db)
+        user_id = st.session_state.user_info["user_id"]
+        try:
+            if store.version(user_id) <= st.session_state.get("conversation_state_version", 0):
+                return
+            version, state = store.load(user_id)
+        except Exception as e:
+            st.error(f"Error loading conversation state: {str(e)}")
+            return
+        if state is not None:
+            self._apply_shared_state(version, state)
+    
+    def publish_state(self, new_messages=None, new_history=None):
+        """Save the conversation to the shared store.
+        
+        With a turn (new_messages, new_history) the turn is appended to the stored
+        state if that is the same session, so turns saved meanwhile by another tab
+        are kept; otherwise the stored state is replaced by this one.
+        """
+        local_state = {
+            "session_id": st.session_state.current_session_id,
+            "messages": list(st.session_state.messages),
+            "history": history_entries(st.session_state.chat_history),
+            "robot_emotion": st.session_state.get("robot_emotion"),
+            "session_created_in_db": st.session_state.session_created_in_db
+        }
+        
+        def add_turn(stored):
+            if stored is None or new_messages is None or stored["session_id"] != local_state["session_id"]:
+                return local_state
+            stored["messages"].extend(new_messages)
+            stored["history"].extend(new_history)
+            stored["robot_emotion"] = local_state["robot_emotion"]
+            stored["session_created_in_db"] = local_state["session_created_in_db"]
+            return stored
+        
+        try:
+            version, state = get_conversation_store(self.db).update(st.session_state.user_info["user_id"], add_turn)
+        except Exception as e:
+            st.error(f"Error saving conversation state: {str(e)}")
+            return
+        if version == st.session_state.get("conversation_state_version", 0) + 1:
+            st.session_state.conversation_state_version = version
+        else:
+            # Merged with turns saved elsewhere since this session's last save
+            self._apply_shared_state(version, state)
+    
     def create_session_in_database(self):
         """Actually create the session in the database when first message is sent"""
         if not st.session_state.session_created_in_db and st.session_state.current_session_id:
-            try:
-                # Create session in database using the pre-generated ID
-                from datetime import datetime
-                
-                new_session = {
-                    "session_id": st.session_state.current_session_id,
-                    "user_id": st.session_state.user_info["user_id"],
-                    "title": f"Session {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                    "created_at": datetime.now(),
-                }
-                
-                self.db["sessions"].insert_one(new_session)
+            # Create session in database using the pre-generated ID
+            session_id = create_session(
+                self.db,
+                st.session_state.user_info["user_id"],
+                session_id=st.session_state.current_session_id
+            )
+            
+            if session_id:
                 st.session_state.session_created_in_db = True
-                
-            except Exception as e:
-                st.error(f"Error creating session in database: {str(e)}")
+            else:
                 # Generate a new session ID as fallback
                 st.session_state.current_session_id = str(uuid.uuid4())
 
 class UIRenderer:
     """Handles UI rendering components"""
     
+    @staticmethod
+    def current_emotion():
+        """Robot emotion selected for the last turn (set in ChatHandler.process_user_message)"""
+        return st.session_state.get("robot_emotion", DEFAULT_EMOTION)
+    
     def render_robot_section(self):
         """Render the robot character section"""
         st.markdown("""
@@ -292,20 +563,8 @@ class UIRenderer:
         """, unsafe_allow_html=True)
         
         try:
-            # Get the last messages for image selection if available
-            user_message = ""
-            ai_message = ""
-            
-            if (hasattr(st.session_state, 'messages') and 
-                len(st.session_state.messages) > 0):
-                # Get last user message
-                user_message = st.session_state.messages[-1]['content'] if st.session_state.messages else ""
-                ai_message = st.session_state.messages[-2]['content'] if len(st.session_state.messages) > 1 else ""
-            
-            # Select appropriate robot image based on conversation context
-            current_image_path = select_robot_image(user_message, ai_message)
-            robot_image = PIL.Image.open(current_image_path)
-            st.image(robot_image, use_container_width=True, caption="Pepper, tu asistente")
+            # Pre-built static WebP/loops: a face switch only changes the URL the browser loads
+            st.markdown(robot_image_html(self.current_emotion()), unsafe_allow_html=True)
         except Exception as e:
             st.error(f"No se pudo cargar la imagen: {e}")
             st.write("Imagen no disponible")
@@ -342,6 +601,11 @@ def get_child_page_styles():
             box-shadow: 0 4px 6px rgba(0,0,0,0.1);
             transition: transform 0.3s ease;
         }
+        .earlier-image {
+            max-width: 100%;
+            border-radius: 20px;
+            margin-bottom: 10px;
+        }
         .user-message:hover, .assistant-message:hover {
             transform: scale(1.02);
         }
@@ -357,6 +621,21 @@ def get_child_page_styles():
             flex-direction: column;
             justify-content: center;
         }
+        .robot-figure {
+            margin: 0;
+            text-align: center;
+        }
+        .robot-face {
+            width: 100%;
+            height: auto;
+        }
+        .robot-figure figcaption {
+            font-size: 0.9em;
+            color: rgba(49, 51, 63, 0.6);
+        }
+        .robot-preload {
+            display: none;
+        }
         .rainbow-title {
             text-align: center;
             font-family: 'Comic Sans MS', 'Comic Sans', cursive;
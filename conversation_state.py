@@ -0,0 +1,165 @@
+"""Conversation state shared by every app replica.
+
+The child page keeps its conversation in st.session_state, which lives in
+one server process. After each turn the conversation (session id, UI
+messages, chat history, robot face) is also written to the storage
+backend, keyed by the child's user id: the conversation_state collection
+in MongoDB, or a table of the SQLite file for local runs. A browser session that starts on another replica (after a
+reconnect, a reload or behind a load balancer) continues from there, and
+a replica that sees a newer version than its own adopts it on the next
+full run. The LLM chain is never stored; each process builds its own.
+
+States are compact JSON (short keys, role and type codes), zlib-compressed.
+Writes are optimistic: a save only succeeds if the stored version is still
+the one the writer read, otherwise the turn is merged into the newer state
+and saved again. A small in-process LRU keeps decoded states, so a replica
+that already holds the current version only reads the version number.
+"""
+import copy
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import streamlit as st
+from metrics import REGISTRY
+from storage import get_backend
+
+# Bounds the stored document; older turns stay in the messages collection
+MAX_STORED_MESSAGES = 200
+SAVE_RETRIES = 3
+
+MESSAGE_ROLES = {"user": "u", "assistant": "a"}
+MESSAGE_TYPES = {"text": "t", "image": "i"}
+HISTORY_ROLES = {"system": "s", "human": "h", "ai": "a"}
+
+state_cache_lookups = REGISTRY.counter(
+    "conversation_state_cache_total",
+    "Conversation state reads by hot cache result (hit, miss)"
+)
+state_conflicts = REGISTRY.counter(
+    "conversation_state_conflicts_total",
+    "Conversation state saves rejected because another replica wrote first"
+)
+state_size_bytes = REGISTRY.histogram(
+    "conversation_state_bytes",
+    "Compressed size of saved conversation states",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576)
+)
+
+
+def _decode_codes(codes):
+    return {code: name for name, code in codes.items()}
+
+
+def serialize_state(state):
+    """Compressed compact JSON of a conversation state"""
+    compact = {
+        "s": state["session_id"],
+        "m": [
+            [MESSAGE_ROLES[message["role"]], MESSAGE_TYPES[message.get("type", "text")], message["content"]]
+            for message in state["messages"]
+        ],
+        "h": [[HISTORY_ROLES[role], content] for role, content in state["history"]],
+        "e": state.get("robot_emotion"),
+        "c": int(bool(state.get("session_created_in_db"))),
+        "t": state.get("updated_at") or time.time()
+    }
+    return zlib.compress(json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def deserialize_state(data):
+    compact = json.loads(zlib.decompress(data).decode("utf-8"))
+    roles, types, history_roles = map(_decode_codes, (MESSAGE_ROLES, MESSAGE_TYPES, HISTORY_ROLES))
+    return {
+        "session_id": compact["s"],
+        "messages": [{"role": roles[role], "content": content, "type": types[kind]} for role, kind, content in compact["m"]],
+        "history": [(history_roles[role], content) for role, content in compact["h"]],
+        "robot_emotion": compact.get("e"),
+        "session_created_in_db": bool(compact.get("c")),
+        "updated_at": compact.get("t")
+    }
+
+
+def history_entries(chat_history):
+    """(role, content) pairs of a chat history"""
+    return [(message.type, message.content) for message in chat_history.messages if message.type in HISTORY_ROLES]
+
+
+def trim_state(state, max_messages=MAX_STORED_MESSAGES):
+    """Keep the last max_messages UI messages and history turns (history summaries are kept)"""
+    state["messages"] = state["messages"][-max_messages:]
+    summaries = [entry for entry in state["history"] if entry[0] == "system"]
+    turns = [entry for entry in state["history"] if entry[0] != "system"]
+    state["history"] = summaries + turns[-max_messages:]
+    return state
+
+
+class ConversationStore:
+    """Versioned conversation states in the storage backend, with an LRU of decoded states"""
+
+    def __init__(self, backend, cache_size=None):
+        self.backend = backend
+        # Read here rather than at import, so .env values apply
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+            return entry
+
+    def _remember(self, key, version, state):
+        with self._lock:
+            self._cache[key] = (version, copy.deepcopy(state))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def version(self, key):
+        return self.backend.get_state_version(key)
+
+    def load(self, key):
+        """(version, state) of a key, or (0, None) if nothing is stored"""
+        cached = self._cached(key)
+        if cached is not None and self.backend.get_state_version(key) == cached[0]:
+            state_cache_lookups.inc(result="hit")
+            return cached[0], copy.deepcopy(cached[1])
+        state_cache_lookups.inc(result="miss")
+        version, data = self.backend.load_state(key)
+        if data is None:
+            return 0, None
+        state = deserialize_state(data)
+        self._remember(key, version, state)
+        return version, state
+
+    def save(self, key, state, expected_version):
+        """New version after storing state, or None if the stored version is no longer expected_version"""
+        data = serialize_state(state)
+        if not self.backend.save_state(key, data, expected_version):
+            state_conflicts.inc()
+            return None
+        state_size_bytes.observe(len(data))
+        self._remember(key, expected_version + 1, state)
+        return expected_version + 1
+
+    def update(self, key, change):
+        """Save change(stored_state or None), re-reading and retrying on conflicts; returns (version, state)"""
+        for _ in range(SAVE_RETRIES):
+            expected_version, state = self.load(key)
+            new_state = trim_state(change(state))
+            new_state["updated_at"] = time.time()
+            version = self.save(key, new_state, expected_version)
+            if version is not None:
+                return version, new_state
+        raise RuntimeError(f"Conversation state of {key} kept changing while it was saved")
+
+
+@st.cache_resource
+def get_conversation_store(_db):
+    """The process-wide store (one hot cache shared by all browser sessions)"""
+    return ConversationStore(get_backend(_db))
@@ -0,0 +1,242 @@
+"""Streaming bulk export of sessions and messages for research and audits.
+
+Streams sessions and their messages through batched server-side cursors
+and writes one row per message to compressed JSONL, CSV or Parquet.
+Memory use does not depend on how much data is exported.
+
+The output is written in numbered parts. A part is only renamed into
+place and recorded in the checkpoint file once it is complete, so an
+interrupted export can be resumed with the same command without
+duplicating or losing rows.
+
+Usage:
+    python data_export.py --format jsonl --out exports/ [--child EMAIL_OR_ID ...]
+                          [--since 2025-01-01] [--until 2025-07-01]
+                          [--sessions-per-part 200] [--batch-size 500]
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from retention import read_archive
+from storage import create_backend_from_env
+
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+
+# Flat columns used by CSV and Parquet (JSONL keeps every message field)
+EXPORT_COLUMNS = [
+    "session_id", "user_id", "session_title", "session_created_at",
+    "message_id", "role", "type", "input_mode", "content", "timestamp"
+]
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def message_rows(backend, session, batch_size):
+    """Yield one export row per message of a session (archived sessions are read from their archive)"""
+    if session.get("archive"):
+        messages = read_archive(backend, session)
+    else:
+        messages = backend.iter_messages(session["session_id"], batch_size)
+    for message in messages:
+        row = {key: _isoformat(value) for key, value in message.items() if key != "_id"}
+        row.update({
+            "session_id": session["session_id"],
+            "user_id": session.get("user_id"),
+            "session_title": session.get("title"),
+            "session_created_at": _isoformat(session.get("created_at"))
+        })
+        yield row
+
+
+class JsonlWriter:
+    extension = ".jsonl.gz"
+
+    def __init__(self, path):
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False, default=str))
+            self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+
+class CsvWriter:
+    extension = ".csv.gz"
+
+    def __init__(self, path):
+        self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Columnar output written one row group per batch (requires pyarrow)"""
+
+    extension = ".parquet"
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow") from e
+        self._pa = pa
+        self._schema = pa.schema([(column, pa.string()) for column in EXPORT_COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write_rows(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        columns = {
+            column: [None if row.get(column) is None else str(row.get(column)) for row in rows]
+            for column in EXPORT_COLUMNS
+        }
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    return {"parts": [], "last_session": None, "sessions": 0, "messages": 0}
+
+
+def save_checkpoint(path, checkpoint):
+    # Write then rename so a crash never leaves a half-written checkpoint
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, indent=2)
+    os.replace(temp_path, path)
+
+
+def export_data(backend, out_dir, export_format="jsonl", user_ids=None, start=None, end=None,
+                sessions_per_part=200, batch_size=500, checkpoint_path=None, progress=print):
+    """Export sessions and messages in parts, resuming from the checkpoint if there is one"""
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint_path = checkpoint_path or os.path.join(out_dir, "checkpoint.json")
+    checkpoint = load_checkpoint(checkpoint_path)
+    writer_class = WRITERS[export_format]
+
+    after = None
+    if checkpoint["last_session"]:
+        after = (datetime.fromisoformat(checkpoint["last_session"]["created_at"]),
+                 checkpoint["last_session"]["session_id"])
+        progress(f"Resuming after {checkpoint['sessions']} sessions ({len(checkpoint['parts'])} parts)")
+
+    sessions = backend.iter_sessions(user_ids, start, end, after=after, batch_size=batch_size)
+    part_number = len(checkpoint["parts"])
+    writer = None
+    part_sessions = part_messages = 0
+    last_session = None
+
+    def finish_part():
+        """Close the current part, move it into place and record it in the checkpoint"""
+        writer.close()
+        os.replace(temp_path, final_path)
+        checkpoint["parts"].append(os.path.basename(final_path))
+        checkpoint["last_session"] = {
+            "created_at": _isoformat(last_session["created_at"]),
+            "session_id": last_session["session_id"]
+        }
+        checkpoint["sessions"] += part_sessions
+        checkpoint["messages"] += part_messages
+        save_checkpoint(checkpoint_path, checkpoint)
+        progress(f"Wrote {os.path.basename(final_path)}: {part_sessions} sessions, {part_messages} messages")
+
+    for session in sessions:
+        if writer is None:
+            final_path = os.path.join(out_dir, f"export-part-{part_number:05d}{writer_class.extension}")
+            temp_path = final_path + ".partial"
+            writer = writer_class(temp_path)
+            part_sessions = part_messages = 0
+
+        for batch in _batched(message_rows(backend, session, batch_size), batch_size):
+            writer.write_rows(batch)
+            part_messages += len(batch)
+        part_sessions += 1
+        last_session = session
+
+        if part_sessions >= sessions_per_part:
+            finish_part()
+            writer = None
+            part_number += 1
+
+    if writer is not None:
+        finish_part()
+
+    return checkpoint
+
+
+def _resolve_children(backend, identifiers):
+    """Map emails or user ids to user ids (None = all children)"""
+    if not identifiers:
+        return None
+    children = backend.list_children()
+    by_email = {child.get("email"): child["user_id"] for child in children}
+    return [by_email.get(identifier, identifier) for identifier in identifiers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export sessions and messages as JSONL, CSV or Parquet")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    parser.add_argument("--out", required=True, help="Output directory (also holds checkpoint.json)")
+    parser.add_argument("--child", action="append", help="Child email or user id (repeatable, default: all)")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Only sessions created on/after this date")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="Only sessions created before this date")
+    parser.add_argument("--sessions-per-part", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=500, help="Cursor batch size and rows per write")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: OUT/checkpoint.json)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    backend = create_backend_from_env()
+    checkpoint = export_data(
+        backend,
+        args.out,
+        export_format=args.format,
+        user_ids=_resolve_children(backend, args.child),
+        start=args.since,
+        end=args.until,
+        sessions_per_part=args.sessions_per_part,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint
+    )
+    print(f"Done: {checkpoint['sessions']} sessions, {checkpoint['messages']} messages "
+          f"in {len(checkpoint['parts'])} parts")
+
+
+if __name__ == "__main__":
+    main()
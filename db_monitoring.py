@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+from pymongo import monitoring
+from metrics import REGISTRY
+
+# Frames from these files are skipped when looking for the calling function
+_INTERNAL_FILES = ("db_monitoring.py", "storage.py")
+_INTERNAL_PACKAGES = (os.sep + "pymongo" + os.sep, os.sep + "bson" + os.sep, "threading.py")
+
+command_latency = REGISTRY.histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command latency by command, collection and calling function"
+)
+command_failures = REGISTRY.counter(
+    "mongodb_command_failures_total",
+    "MongoDB commands that returned an error"
+)
+pool_checkout_wait = REGISTRY.histogram(
+    "mongodb_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool"
+)
+pool_checkout_failures = REGISTRY.counter(
+    "mongodb_pool_checkout_failures_total",
+    "Failed connection checkouts by reason (e.g. waitQueueTimeoutMS exceeded)"
+)
+pool_connections_in_use = REGISTRY.gauge(
+    "mongodb_pool_connections_in_use",
+    "Connections currently checked out of the pool"
+)
+
+
+def _calling_function():
+    """Return "module.function" of the first frame outside pymongo and the storage layer"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.endswith(_INTERNAL_FILES) and not any(part in filename for part in _INTERNAL_PACKAGES):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+def _address(event):
+    host, port = event.address
+    return f"{host}:{port}"
+
+def _command_collection(event):
+    """Extract the target collection of a command, if any"""
+    command = event.command
+    if event.command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+
+class CommandLatencyListener(monitoring.CommandListener):
+    """Records the latency of every MongoDB command, tagged by collection and caller.
+
+    started() runs synchronously on the thread issuing the command, so the
+    calling function is taken from the stack there and matched to the
+    succeeded/failed event through the request id.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        labels = {
+            "command": event.command_name,
+            "collection": _command_collection(event),
+            "caller": _calling_function()
+        }
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = labels
+
+    def _finish(self, event):
+        with self._lock:
+            labels = self._pending.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            labels = {"command": event.command_name, "collection": "", "caller": "unknown"}
+        command_latency.observe(event.duration_micros / 1_000_000, **labels)
+        return labels
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        labels = self._finish(event)
+        command_failures.inc(**labels)
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    """Records how long threads wait for a pooled connection (maxPoolSize / waitQueueTimeoutMS)"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _wait_time(self, event):
+        # pymongo >= 4.7 reports the duration; older versions need our own timestamp
+        duration = getattr(event, "duration", None)
+        started = getattr(self._local, "checkout_started", None)
+        self._local.checkout_started = None
+        if duration is not None:
+            return duration
+        return time.perf_counter() - started if started is not None else None
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_time = self._wait_time(event)
+        if wait_time is not None:
+            pool_checkout_wait.observe(wait_time, address=_address(event))
+        pool_connections_in_use.inc(address=_address(event))
+
+    def connection_check_out_failed(self, event):
+        wait_time = self._wait_time(event)
+        if wait_time is not None:
+            pool_checkout_wait.observe(wait_time, address=_address(event))
+        pool_checkout_failures.inc(reason=str(event.reason), address=_address(event))
+
+    def connection_checked_in(self, event):
+        pool_connections_in_use.dec(address=_address(event))
+
+    # Remaining pool events are not needed for latency monitoring
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+def get_event_listeners():
+    """Return the listeners to pass to MongoClient(event_listeners=...)"""
+    return [CommandLatencyListener(), PoolWaitListener()]
@@ -1,30 +1,19 @@
 from datetime import datetime
 import uuid
 import streamlit as st
+from storage import DuplicateUserError, get_backend, normalize_email
+from retention import delete_session_archive, restore_if_archived
 
 def setup_database_indexes(db):
-    """Set up MongoDB indexes for better query performance - only run once"""
+    """Set up database indexes for better query performance - only run once"""
     # Check if indexes already exist to avoid recreating them
     if "indexes_created" not in st.session_state:
         try:
-            # Create indexes only if they don't exist
-            existing_indexes = db["sessions"].list_indexes()
-            index_names = [idx["name"] for idx in existing_indexes]
-            
-            if "user_id_1" not in index_names:
-                db["sessions"].create_index("user_id")
-            
-            existing_msg_indexes = db["messages"].list_indexes()
-            msg_index_names = [idx["name"] for idx in existing_msg_indexes]
-            
-            if "session_id_1" not in msg_index_names:
-                db["messages"].create_index("session_id")
-            if "timestamp_1" not in msg_index_names:
-                db["messages"].create_index("timestamp")
-            
+            get_backend(db).setup_indexes()
+
             # Mark as completed
             st.session_state.indexes_created = True
-            
+
         except Exception as e:
             st.error(f"Error setting up indexes: {str(e)}")
 
@@ -34,12 +23,12 @@ def save_message_batch(db, messages_list):
     """Save multiple messages in a single batch operation"""
     try:
         if messages_list:
-            db["messages"].insert_many(messages_list)
+            get_backend(db).insert_messages(messages_list)
     except Exception as e:
         st.error(f"Error saving messages: {str(e)}")
 
 def save_message(db, session_id, role, content):
-    """Save chat messages to MongoDB"""
+    """Save a single chat message"""
     try:
         message_doc = {
             "message_id": str(uuid.uuid4()),
@@ -48,66 +37,108 @@ def save_message(db, session_id, role, content):
             "content": content,
             "timestamp": datetime.now()
         }
-        db["messages"].insert_one(message_doc)
+        get_backend(db).insert_messages([message_doc])
     except Exception as e:
         st.error(f"Error saving message: {str(e)}")
 
-def load_session_messages(db, session_id):
-    """Load all messages for a specific therapy session with optimized projection"""
+def load_session_messages(db, session_id, session=None):
+    """Load all messages for a specific therapy session (session: its document, if already loaded)"""
+    try:
+        backend = get_backend(db)
+        docs = backend.load_messages(session_id)
+        if not docs and (session is None or session.get("archive")):
+            # Cold sessions are moved out of the messages collection by retention.py
+            docs = restore_if_archived(backend, session_id, session=session)
+        return [{"role": doc["role"], "content": doc["content"]} for doc in docs]
+    except Exception as e:
+        st.error(f"Error loading messages: {str(e)}")
+        return []
+
+def load_recent_session_messages(db, session_id, limit):
+    """Load the last limit messages of a session, oldest first"""
     try:
-        # Only select the fields we need to reduce data transfer
-        cursor = db["messages"].find(
-            {"session_id": session_id},
-            {"role": 1, "content": 1, "timestamp": 1, "_id": 0}  # Only get needed fields
-        ).sort("timestamp", 1)
-        
-        messages = []
-        for doc in cursor:
-            messages.append({
-                "role": doc["role"],
-                "content": doc["content"]
-            })
-        return messages
+        return get_backend(db).load_recent_messages(session_id, limit)
     except Exception as e:
         st.error(f"Error loading messages: {str(e)}")
         return []
 
+def iter_session_messages(db, session_id, batch_size=500):
+    """Stream the messages of a session from a server-side cursor, batch_size at a time"""
+    for doc in get_backend(db).iter_messages(session_id, batch_size):
+        yield {"role": doc["role"], "content": doc["content"]}
+
 def delete_session_messages(db, session_id):
     """Delete all messages for a specific session"""
     try:
-        result = db["messages"].delete_many({"session_id": session_id})
-        return result.deleted_count
+        return get_backend(db).delete_messages(session_id)
     except Exception as e:
         st.error(f"Error deleting messages: {str(e)}")
         return 0
 
+def load_turn_timings(db, session_ids):
+    """Load the per-stage timings stored on the assistant messages of some sessions"""
+    try:
+        return get_backend(db).load_turn_timings(list(session_ids))
+    except Exception as e:
+        st.error(f"Error loading turn timings: {str(e)}")
+        return []
+
+def load_child_metrics(db, user_id):
+    """Load the materialized per-session metrics of a child (see analytics.py)"""
+    try:
+        return get_backend(db).load_child_metrics(user_id)
+    except Exception as e:
+        st.error(f"Error loading metrics: {str(e)}")
+        return []
+
 # ==================== SESSION OPERATIONS ====================
 
-def create_session(db, user_id):
+def create_session(db, user_id, session_id=None):
     """Create a new therapy session in the database"""
     try:
-        session_id = str(uuid.uuid4())
+        session_id = session_id or str(uuid.uuid4())
         new_session = {
             "session_id": session_id,
             "user_id": user_id,
             "title": f"Session {datetime.now().strftime('%Y-%m-%d %H:%M')}",
             "created_at": datetime.now(),
         }
-        db["sessions"].insert_one(new_session)
+        get_backend(db).insert_session(new_session)
         return session_id
     except Exception as e:
         st.error(f"Error creating new session: {str(e)}")
         return None
 
 def load_user_sessions(db, user_id):
-    """Load user therapy sessions from MongoDB with optimized query"""
+    """Load the last 50 therapy sessions of a user"""
     try:
-        # Use projection to only get needed fields and limit results
-        user_sessions = list(db["sessions"].find(
-            {"user_id": user_id},
-            {"_id": 0, "session_id": 1, "title": 1, "created_at": 1}  # Only get needed fields
-        ).sort("created_at", -1).limit(50))  # Limit to last 50 sessions
-        return user_sessions
+        return get_backend(db).list_user_sessions(user_id, limit=50)
+    except Exception as e:
+        st.error(f"Error loading sessions: {str(e)}")
+        return []
+
+def load_latest_session(db, user_id):
+    """Load the newest session of a user, or None"""
+    try:
+        sessions = get_backend(db).list_user_sessions(user_id, limit=1)
+        return sessions[0] if sessions else None
+    except Exception as e:
+        st.error(f"Error loading sessions: {str(e)}")
+        return None
+
+def load_session(db, session_id):
+    """Load one session document, or None"""
+    try:
+        sessions = get_backend(db).find_sessions([session_id])
+        return sessions[0] if sessions else None
+    except Exception as e:
+        st.error(f"Error loading session: {str(e)}")
+        return None
+
+def load_user_sessions_in_range(db, user_id, start=None, end=None):
+    """Load every session of a user created in [start, end), newest first"""
+    try:
+        return get_backend(db).list_user_sessions(user_id, limit=None, start=start, end=end)
     except Exception as e:
         st.error(f"Error loading sessions: {str(e)}")
         return []
@@ -115,13 +146,14 @@ def load_user_sessions(db, user_id):
 def delete_session(db, session_id):
     """Delete a session and all its associated messages"""
     try:
-        # First, delete all messages for this session
+        # First, delete all messages for this session (and its archive, if it was archived)
         messages_deleted = delete_session_messages(db, session_id)
-        
+        sessions = get_backend(db).find_sessions([session_id])
+        if sessions:
+            delete_session_archive(db, sessions[0])
+
         # Then delete the session itself
-        session_result = db["sessions"].delete_one({"session_id": session_id})
-        
-        if session_result.deleted_count > 0:
+        if get_backend(db).delete_session(session_id):
             return {
                 "success": True,
                 "session_deleted": True,
@@ -132,7 +164,7 @@ def delete_session(db, session_id):
                 "success": False,
                 "error": "Session not found"
             }
-            
+
     except Exception as e:
         st.error(f"Error deleting session: {str(e)}")
         return {
@@ -143,12 +175,42 @@ def delete_session(db, session_id):
 # ==================== USER OPERATIONS ====================
 
 def get_children(db):
-    """Get all child users with optimized projection"""
+    """Get all child users"""
     try:
-        return list(db["users"].find(
-            {"user_type": "child"},
-            {"user_id": 1, "name": 1, "email": 1, "age": 1, "created_at": 1, "_id": 0}
-        ).sort("name", 1))
+        return get_backend(db).list_children()
     except Exception as e:
         st.error(f"Error loading children: {str(e)}")
         return []
+
+def find_user_by_email(db, email):
+    """Return the user registered with an email (in any casing), or None"""
+    return get_backend(db).find_user_by_email(normalize_email(email))
+
+def find_user_by_credentials(db, email, password_hash):
+    """Return the user matching an email (in any casing) and password hash, or None"""
+    backend = get_backend(db)
+    user = backend.find_user_by_credentials(normalize_email(email), password_hash)
+    if user is None and email.strip() != normalize_email(email):
+        # Accounts created before emails were normalized keep the casing they signed up with
+        user = backend.find_user_by_credentials(email.strip(), password_hash)
+    return user
+
+def find_user_by_id(db, user_id):
+    """Return the user with a user_id (without its password hash), or None"""
+    return get_backend(db).find_user_by_id(user_id)
+
+def revoke_session_token(db, signature, expires_at):
+    """Make a login token (by signature) fail verification on every replica until it expires"""
+    get_backend(db).revoke_token(signature, expires_at)
+
+def is_session_token_revoked(db, signature, now):
+    """Whether a login token was revoked by a logout"""
+    return get_backend(db).is_token_revoked(signature, now)
+
+def insert_user(db, user_document):
+    """Insert a new user; returns False if the email is already registered (in any casing)"""
+    try:
+        get_backend(db).insert_user({**user_document, "email": normalize_email(user_document["email"])})
+        return True
+    except DuplicateUserError:
+        return False
@@ -0,0 +1,49 @@
+import streamlit as st
+from metrics import REGISTRY
+from session_memory import session_tracker
+
+def display_diagnostics_panel():
+    """Staff-only panel with the in-process performance metrics"""
+    st.subheader("Diagnostics")
+    st.caption("Metrics of this server process since it started.")
+
+    metrics = REGISTRY.metrics()
+    if not metrics:
+        st.info("No metrics recorded yet")
+
+    for metric in metrics:
+        rows = metric.summary()
+        if not rows:
+            continue
+
+        st.markdown(f"**{metric.name}** — {metric.help_text}")
+        if metric.kind == "histogram":
+            # Show latencies in milliseconds, which is easier to read
+            rows = [
+                {
+                    **row,
+                    "mean": round(row["mean"] * 1000, 2),
+                    "p50": round(row["p50"] * 1000, 2),
+                    "p95": round(row["p95"] * 1000, 2),
+                    "max": round(row["max"] * 1000, 2)
+                }
+                for row in rows
+            ] if metric.name.endswith("_seconds") else rows
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    # Approximate heavy state of each child browser session (see session_memory.py)
+    sessions = session_tracker.snapshot()
+    if sessions:
+        st.markdown("**Child sessions** — approximate bytes held in memory by each open tab")
+        st.dataframe(sorted(sessions, key=lambda row: -row["total_bytes"]), use_container_width=True, hide_index=True)
+
+    # Prometheus-format dump for scraping or offline analysis
+    prometheus_text = REGISTRY.to_prometheus()
+    with st.expander("Prometheus text format"):
+        st.code(prometheus_text, language="text")
+    st.download_button(
+        label="⬇️ Download metrics",
+        data=prometheus_text,
+        file_name="metrics.prom",
+        mime="text/plain"
+    )
@@ -0,0 +1,99 @@
+"""Incremental following of an in-progress session for the staff live view.
+
+MessageTailer keeps a timestamp cursor plus the ids of the messages seen
+at that timestamp. Each poll only asks the backend for messages at or
+after the cursor, so a tick costs O(new messages) instead of reloading
+the whole transcript. On MongoDB replica sets it reads a change stream
+instead and falls back to polling if the stream is unavailable or fails.
+"""
+from metrics import REGISTRY
+from storage import get_backend
+
+live_tail_polls = REGISTRY.counter(
+    "live_tail_polls_total",
+    "Live view ticks by source (change_stream or poll)"
+)
+live_tail_messages = REGISTRY.counter(
+    "live_tail_messages_total",
+    "New messages delivered to staff live views"
+)
+
+
+def _message_key(message):
+    # Messages saved before message ids existed fall back to their content
+    return message.get("message_id") or (str(message.get("timestamp")), message.get("role"), message.get("content"))
+
+
+class MessageTailer:
+    """Follows the messages of one session, returning only new ones on each poll"""
+
+    def __init__(self, db, session_id, use_change_stream=True, batch_size=500):
+        self.backend = get_backend(db)
+        self.session_id = session_id
+        self.batch_size = batch_size
+        self.messages = []
+        self._cursor = None
+        self._keys_at_cursor = set()
+        # Open the stream before the first read so nothing inserted in between is missed
+        self._stream = self.backend.watch_messages(session_id) if use_change_stream else None
+        self._catch_up()
+
+    @property
+    def source(self):
+        return "change_stream" if self._stream is not None else "poll"
+
+    def poll(self):
+        """Fetch messages added since the last poll, append them to self.messages and return them"""
+        live_tail_polls.inc(source=self.source)
+        if self._stream is not None:
+            try:
+                new_messages = self._accept(self._drain_stream())
+            except Exception:
+                # Lost the stream (failover, permissions...): continue by polling from the cursor
+                self.close()
+                new_messages = self._catch_up()
+        else:
+            new_messages = self._catch_up()
+        live_tail_messages.inc(len(new_messages))
+        return new_messages
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _drain_stream(self):
+        docs = []
+        while True:
+            doc = self._stream.try_next()
+            if doc is None:
+                return docs
+            docs.append(doc)
+
+    def _catch_up(self):
+        """Poll the backend until everything after the cursor has been read"""
+        new_messages = []
+        while True:
+            batch = self.backend.load_messages_since(self.session_id, self._cursor, self.batch_size)
+            accepted = self._accept(batch)
+            new_messages.extend(accepted)
+            # A full batch of only already-seen messages cannot advance the cursor
+            if len(batch) < self.batch_size or not accepted:
+                return new_messages
+
+    def _accept(self, docs):
+        """Keep the docs not seen yet and move the cursor to the newest timestamp"""
+        new_messages = []
+        for doc in sorted(docs, key=lambda doc: doc["timestamp"]):
+            key = _message_key(doc)
+            if key in self._keys_at_cursor:
+                continue
+            if self._cursor is None or doc["timestamp"] > self._cursor:
+                self._cursor = doc["timestamp"]
+                self._keys_at_cursor = set()
+            # Polling re-reads the cursor timestamp (inclusive bound), so remember what is there
+            if doc["timestamp"] == self._cursor:
+                self._keys_at_cursor.add(key)
+            new_messages.append(doc)
+        self.messages.extend(new_messages)
+        return new_messages
@@ -13,11 +13,24 @@ from langchain.schema import SystemMessage, HumanMessage, AIMessage
 
 import requests  # Added for DALL-E image generation
 import re  # Added for pattern detection
+from turn_tracing import trace_stage
+from openai_scheduler import (
+    get_scheduler,
+    estimate_tokens,
+    OpenAIHTTPError,
+    INTERACTIVE,
+    NORMAL,
+    BACKGROUND,
+    request_timeout_seconds,
+    RETRYABLE_STATUS
+)
+from robot_media import DEFAULT_EMOTION, ROBOT_IMAGES
 
 # Load environment variables
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 openai.api_key = openai_api_key  # Configure API key directly
+openai.max_retries = 0  # Retries are scheduled by openai_scheduler
 
 # Verify API Key
 if not openai_api_key:
@@ -31,7 +44,9 @@ client = openai
 # NEW FUNCTION: Generate image with DALL·E 3 using requests
 def generate_dalle_image(prompt_text):
     """Generate image using DALL-E 3 API"""
-    url = "https://api.openai.com/v1/images/generations"
+    # OPENAI_BASE_URL is also honoured by the openai client (e.g. a local stand-in for benchmarks)
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    url = f"{base_url}/images/generations"
     headers = {
         "Authorization": f"Bearer {openai_api_key}",
         "Content-Type": "application/json"
@@ -42,7 +57,19 @@ def generate_dalle_image(prompt_text):
         "size": "1024x1024",
         "model": "dall-e-3"
     }
-    response = requests.post(url, headers=headers, json=data)
+    
+    def request_image(timeout):
+        response = requests.post(url, headers=headers, json=data, timeout=timeout)
+        if response.status_code in RETRYABLE_STATUS:
+            raise OpenAIHTTPError(response)
+        return response
+    
+    try:
+        # Images are background work: interactive chat and TTS go first
+        response = get_scheduler().call("images", request_image, priority=BACKGROUND)
+    except Exception as e:
+        st.error(f"Error generating image with DALL·E: {str(e)}")
+        return None
     if response.status_code == 200:
         result = response.json()
         image_url = result['data'][0]['url']
@@ -53,32 +80,21 @@ def generate_dalle_image(prompt_text):
 
 # =======================================================
 # NEW FUNCTION: Detect if image should be generated
+IMAGE_TRIGGERS = (
+    "quiero una imagen", "haz un dibujo", "puedes hacer un dibujo",
+    "dibuja", "pinta", "ilustra", "quiero ver una imagen", "haz una imagen"
+)
+
 def get_dalle_prompt(user_text, ai_text):
     """Heuristically detect if an image should be generated"""
-    triggers = [
-        "quiero una imagen", "haz un dibujo", "puedes hacer un dibujo",
-        "dibuja", "pinta", "ilustra", "quiero ver una imagen", "haz una imagen"
-    ]
     combined_text = (user_text + " " + ai_text).lower()
-    if any(trigger in combined_text for trigger in triggers):
+    if any(trigger in combined_text for trigger in IMAGE_TRIGGERS):
         return user_text if len(user_text) > 10 else "dibujo sugerido basado en el elemento clave mencionado en la conversación (animal, lugar, situación...)"
     return None
 
-# UPDATED FUNCTION: Robot image selection (simplified, removed llm parameter)
-def select_robot_image(user_message, ai_response):
-    """Select robot image based on conversation context"""
-    base_path = "Multimedia"
-    images = {
-        'defecto': os.path.join(base_path, 'cara_robot.jpg'),
-        'saludo': os.path.join(base_path, 'saludo_robot.jpg'),
-        'correcto': os.path.join(base_path, 'correcto_robot.jpg'),
-        'risa': os.path.join(base_path, 'risa_robot.jpg'),
-        'sorprendido': os.path.join(base_path, 'sorprendido_robot.jpg'),
-        'deporte': os.path.join(base_path, 'deporte_robot.jpg'),
-        'bailar': os.path.join(base_path, 'bailar_robot.jpg'),
-        'pensar': os.path.join(base_path, 'pensar_robot.jpg')
-    }
-    
+# UPDATED FUNCTION: Robot emotion selection (the face itself is served by robot_media)
+def select_robot_emotion(user_message, ai_response):
+    """Select the robot emotion (a key of robot_media.ROBOT_IMAGES) based on conversation context"""
     priority_order = [
         'saludo', 'bailar', 'deporte', 'pensar', 
         'sorprendido', 'risa', 'correcto'
@@ -109,23 +125,38 @@ Instrucciones:
 - Responde SOLO con el nombre de la imagen (ej. 'correcto', 'saludo', etc.).
 """
     try:
-        # Create a temporary LLM instance for image selection
-        temp_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, openai_api_key=openai_api_key)
-        context_evaluation = temp_llm.invoke(context_prompt).content.strip().lower()
+        # Shared classifier client; yields to the chat turns under load and gives up quickly
+        context_evaluation = get_scheduler().call(
+            "chat",
+            lambda timeout: _classifier_llm().invoke(context_prompt, timeout=timeout),
+            priority=NORMAL,
+            tokens=estimate_tokens([context_prompt], completion_tokens=10)
+        ).content.strip().lower()
         
-        if context_evaluation in images:
-            return images[context_evaluation]
+        if context_evaluation in ROBOT_IMAGES:
+            return context_evaluation
         
         for priority_image in priority_order:
             if priority_image in context_evaluation:
-                return images[priority_image]
+                return priority_image
         
-        return images['defecto']
+        return DEFAULT_EMOTION
     
     except Exception as e:
         st.error(f"Error selecting image: {e}")
-        return images['defecto']
+        return DEFAULT_EMOTION
     
+@st.cache_resource
+def _classifier_llm():
+    """Client of the robot emotion classifier (shared by all sessions)"""
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0.2,
+        openai_api_key=openai_api_key,
+        request_timeout=request_timeout_seconds(),
+        max_retries=0
+    )
+
 # Initialize Whisper model (cache to prevent reloading)
 @st.cache_resource
 def load_whisper_model():
@@ -134,10 +165,15 @@ def load_whisper_model():
 # Function to generate audio with TTS
 def generate_speech(text):
     try:
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice="fable",
-            input=text
+        response = get_scheduler().call(
+            "tts",
+            lambda timeout: client.audio.speech.create(
+                model="tts-1",
+                voice="fable",
+                input=text,
+                timeout=timeout
+            ),
+            priority=INTERACTIVE
         )
         
         temp_dir = tempfile.mkdtemp()
@@ -177,9 +213,17 @@ def create_audio_player(audio_bytes):
     return ""
 
 # Initialize the LLM model and chain
-def initialize_llm_chain(system_prompt):
+def initialize_llm_chain(system_prompt, model="gpt-4o-mini", temperature=0.2, max_tokens=None):
     # Configure the model
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, openai_api_key=openai_api_key)
+    # Timeouts and retries are handled around each request by openai_scheduler
+    llm = ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        openai_api_key=openai_api_key,
+        request_timeout=request_timeout_seconds(),
+        max_retries=0
+    )
     
     # Define the prompt template
     prompt = ChatPromptTemplate.from_messages([
@@ -194,23 +238,35 @@ def initialize_llm_chain(system_prompt):
     return llm, agent_chain
 
 # UPDATED FUNCTION: Process message with DALL-E image generation capability
-def process_message(agent_chain, user_input, chat_history):
+def process_message(agent_chain, user_input, chat_history, trace=None):
     # Create the message for LLM
     human_message = HumanMessage(content=user_input)
     
     # Generate response from LLM
-    response = agent_chain.invoke({
+    inputs = {
         "input": [human_message],
         "history": chat_history.messages
-    })
+    }
+    # Estimated from the prompt as it is sent, system prompt included
+    prompt_tokens = estimate_tokens(message.content for message in agent_chain.first.format_messages(**inputs))
+    with trace_stage(trace, "llm"):
+        response = get_scheduler().call(
+            "chat",
+            # Each attempt gets the time left before the scheduler's deadline
+            lambda timeout: (agent_chain.first | agent_chain.last.bind(timeout=timeout)).invoke(inputs),
+            priority=INTERACTIVE,
+            tokens=prompt_tokens
+        )
     
     # Create AI message from response
     ai_message = AIMessage(content=response.content)
     
     # Check if image should be generated
-    dalle_prompt = get_dalle_prompt(user_input, response.content)
+    with trace_stage(trace, "image_trigger"):
+        dalle_prompt = get_dalle_prompt(user_input, response.content)
     image_url = None
     if dalle_prompt:
-        image_url = generate_dalle_image(dalle_prompt)
+        with trace_stage(trace, "image_generation"):
+            image_url = generate_dalle_image(dalle_prompt)
     
     return human_message, ai_message, response.content, image_url
\ No newline at end of file
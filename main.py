@@ -5,6 +5,9 @@ from dotenv import load_dotenv
 from auth import display_auth_page
 from staff_page import display_staff_page
 from child_page import display_child_page
+from storage import MongoBackend, create_local_backend
+from db_monitoring import get_event_listeners
+from session_tokens import check_token_secret, restore_login, sync_session_cookie
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,7 +23,12 @@ st.set_page_config(
 # Optimized MongoDB connection with caching
 @st.cache_resource
 def initialize_db():
-    """Initialize MongoDB connection with Atlas-optimized settings"""
+    """Initialize the storage backend (MongoDB with Atlas-optimized settings by default)"""
+    # Embedded backends let the app and benchmarks run without an Atlas cluster
+    storage_backend = os.getenv("STORAGE_BACKEND", "mongodb").strip().lower()
+    if storage_backend in ("sqlite", "memory", "mongomock"):
+        return _with_indexes(create_local_backend(storage_backend))
+    
     # Get MongoDB URI from environment variable
     MONGODB_URI = os.getenv("MONGODB_URI")
     
@@ -31,33 +39,30 @@ def initialize_db():
 
     client = pymongo.MongoClient(
         MONGODB_URI,
-        # Atlas-optimized connection settings
-        maxPoolSize=10,        # Limit concurrent connections
+        # Atlas-optimized connection settings (pool limits tunable from .env)
+        maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "10")),  # Limit concurrent connections
         minPoolSize=1,         # Keep minimum connections alive
         maxIdleTimeMS=30000,   # Close idle connections after 30s
-        waitQueueTimeoutMS=5000,  # Wait max 5s for connection
+        waitQueueTimeoutMS=int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000")),  # Wait max 5s for connection
         serverSelectionTimeoutMS=5000,  # Server selection timeout
         socketTimeoutMS=20000,  # Socket timeout
         connectTimeoutMS=20000, # Connection timeout
         retryWrites=True,      # Retry failed writes
-        w="majority"           # Write concern for data safety
+        w="majority",          # Write concern for data safety
+        event_listeners=get_event_listeners()  # Per-command latency and pool wait metrics
     )
     
-    db = client["asd-therapy"]
-    
-    # Get users collection
-    users_collection = db["users"]
+    db = client[os.getenv("MONGODB_DATABASE", "asd-therapy")]
     
-    # Create unique index on email field only if it doesn't exist
+    return _with_indexes(MongoBackend(db))
+
+def _with_indexes(backend):
+    """Create the backend's indexes once per process; signup relies on its unique email index"""
     try:
-        existing_indexes = users_collection.list_indexes()
-        index_names = [idx["name"] for idx in existing_indexes]
-        if "email_1" not in index_names:
-            users_collection.create_index([("email", pymongo.ASCENDING)], unique=True)
+        backend.setup_indexes()
     except Exception as e:
         print(f"Index creation warning: {e}")
-    
-    return db
+    return backend
 
 # Function to initialize session state variables
 def init_session_state():
@@ -67,9 +72,15 @@ def init_session_state():
         st.session_state.user_info = {}
     if 'auth_status' not in st.session_state:
         st.session_state.auth_status = {"message": "", "type": ""}
+    # A refresh or reconnect starts a new session: log it back in from the signed cookie (once)
+    if 'token_login_checked' not in st.session_state:
+        st.session_state.token_login_checked = True
+        if not st.session_state.logged_in:
+            restore_login(db)
 
 # Function for main app flow
 def main():
+    sync_session_cookie()
     if st.session_state.logged_in:
         # Display different pages based on user type
         if st.session_state.user_info["user_type"] == "child":
@@ -83,6 +94,13 @@ def main():
 # Initialize MongoDB (cached)
 db = initialize_db()
 
+# Login tokens must verify on every replica, so a shared secret is required
+try:
+    check_token_secret()
+except RuntimeError as e:
+    st.error(str(e))
+    st.stop()
+
 # Initialize session state variables
 init_session_state()
 
@@ -0,0 +1,213 @@
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond local calls to slow network calls
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _label_key(labels):
+    """Return a hashable, ordered key for a label dict"""
+    return tuple(sorted((str(key), str(value)) for key, value in labels.items()))
+
+def _escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(label_key, extra=()):
+    """Format labels in the Prometheus text exposition format"""
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in pairs) + "}"
+
+def _format_value(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class _HistogramSeries:
+    """Bucket counts, sum and count for one label combination"""
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+
+class Histogram:
+    """Cumulative histogram with labels, compatible with Prometheus histograms"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(self.buckets)
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series.bucket_counts[index] += 1
+                    break
+            series.count += 1
+            series.total += value
+            series.maximum = max(series.maximum, value)
+
+    def time(self, **labels):
+        """Context manager observing the elapsed wall time of a block"""
+        return _Timer(self, labels)
+
+    def quantile(self, series, q):
+        """Estimate a quantile from bucket counts by linear interpolation"""
+        if series.count == 0:
+            return 0.0
+        rank = q * series.count
+        cumulative = 0
+        lower_bound = 0.0
+        for upper_bound, bucket_count in zip(self.buckets, series.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                fraction = (rank - cumulative) / bucket_count
+                return min(series.maximum, lower_bound + (upper_bound - lower_bound) * fraction)
+            cumulative += bucket_count
+            lower_bound = upper_bound
+        # Rank falls in the +Inf bucket; the maximum is the best estimate
+        return series.maximum
+
+    def summary(self):
+        """Return one row per label combination with count, mean, p50, p95 and max"""
+        with self._lock:
+            items = [(key, series) for key, series in self._series.items()]
+            rows = []
+            for key, series in items:
+                row = dict(key)
+                row.update({
+                    "count": series.count,
+                    "mean": series.total / series.count if series.count else 0.0,
+                    "p50": self.quantile(series, 0.50),
+                    "p95": self.quantile(series, 0.95),
+                    "max": series.maximum
+                })
+                rows.append(row)
+        return sorted(rows, key=lambda row: row["count"] * row["mean"], reverse=True)
+
+    def to_prometheus(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for upper_bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(upper_bound))])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series.count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series.total!r}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Counter:
+    """Monotonically increasing counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def summary(self):
+        with self._lock:
+            return [{**dict(key), "value": value} for key, value in sorted(self._values.items())]
+
+    def to_prometheus(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Value that can go up and down, with labels"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def to_prometheus(self):
+        lines = super().to_prometheus()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics, shared by all Streamlit sessions"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args)
+            return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def metrics(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+
+# Global registry used by the app (module state survives Streamlit reruns)
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,108 @@
+"""Migrate chat messages between the per-document and bucketed storage layouts.
+
+Usage:
+    python migrate_message_layout.py --to buckets [--bucket-size 50] [--delete-source] [--dry-run]
+    python migrate_message_layout.py --to documents [--delete-source] [--dry-run]
+
+Sessions that already have data in the target layout are skipped, so the
+migration can be re-run safely after an interruption. Remember to set
+MESSAGE_LAYOUT in the .env file to the new layout once the migration is done.
+"""
+import argparse
+import os
+import pymongo
+from dotenv import load_dotenv
+from storage import (
+    MESSAGE_LAYOUT_BUCKETS,
+    MESSAGE_LAYOUT_DOCUMENTS,
+    build_buckets,
+    get_message_bucket_size,
+    setup_bucket_indexes
+)
+
+
+def migrate_to_buckets(db, bucket_size, delete_source=False, dry_run=False):
+    """Copy every session from "messages" into "message_buckets" """
+    setup_bucket_indexes(db)
+    stats = {"sessions": 0, "skipped": 0, "messages": 0, "buckets": 0}
+
+    for session_id in db["messages"].distinct("session_id"):
+        if db["message_buckets"].find_one({"session_id": session_id}, {"_id": 1}):
+            stats["skipped"] += 1
+            continue
+
+        messages = list(db["messages"].find({"session_id": session_id}, {"_id": 0, "session_id": 0}).sort("timestamp", 1))
+        buckets = build_buckets(session_id, messages, bucket_size)
+
+        if not dry_run and buckets:
+            db["message_buckets"].insert_many(buckets, ordered=True)
+            if delete_source:
+                db["messages"].delete_many({"session_id": session_id})
+
+        stats["sessions"] += 1
+        stats["messages"] += len(messages)
+        stats["buckets"] += len(buckets)
+
+    return stats
+
+
+def migrate_to_documents(db, delete_source=False, dry_run=False):
+    """Copy every session from "message_buckets" back into "messages" """
+    stats = {"sessions": 0, "skipped": 0, "messages": 0, "buckets": 0}
+
+    for session_id in db["message_buckets"].distinct("session_id"):
+        if db["messages"].find_one({"session_id": session_id}, {"_id": 1}):
+            stats["skipped"] += 1
+            continue
+
+        buckets = list(db["message_buckets"].find({"session_id": session_id}).sort("first_timestamp", 1))
+        messages = [
+            {**message, "session_id": session_id}
+            for bucket in buckets
+            for message in bucket.get("messages", [])
+        ]
+
+        if not dry_run and messages:
+            db["messages"].insert_many(messages, ordered=True)
+            if delete_source:
+                db["message_buckets"].delete_many({"session_id": session_id})
+
+        stats["sessions"] += 1
+        stats["messages"] += len(messages)
+        stats["buckets"] += len(buckets)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate chat messages between storage layouts")
+    parser.add_argument("--to", required=True, choices=[MESSAGE_LAYOUT_BUCKETS, MESSAGE_LAYOUT_DOCUMENTS],
+                        help="Target message layout")
+    parser.add_argument("--bucket-size", type=int, default=None,
+                        help="Messages per bucket (defaults to MESSAGE_BUCKET_SIZE)")
+    parser.add_argument("--database", help="Database name (defaults to MONGODB_DATABASE)")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="Delete the source documents of each migrated session")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        parser.error("MongoDB URI not found. Please check your .env file.")
+
+    db = pymongo.MongoClient(mongodb_uri)[args.database or os.getenv("MONGODB_DATABASE", "asd-therapy")]
+
+    if args.to == MESSAGE_LAYOUT_BUCKETS:
+        stats = migrate_to_buckets(db, args.bucket_size or get_message_bucket_size(),
+                                   args.delete_source, args.dry_run)
+    else:
+        stats = migrate_to_documents(db, args.delete_source, args.dry_run)
+
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Migrated {stats['sessions']} sessions ({stats['messages']} messages, "
+          f"{stats['buckets']} buckets), skipped {stats['skipped']} already migrated")
+
+
+if __name__ == "__main__":
+    main()
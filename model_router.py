@@ -0,0 +1,147 @@
+"""Routing of child turns to a model tier by how much the turn needs.
+
+Most turns of a young child are "sí", "vale" or one word. They do not need
+the full model:
+
+- template: a plain acknowledgement after an assistant turn that asked
+  nothing gets a templated PRT reinforcement (praise plus an invitation
+  to go on) and the "correcto" robot face, with no model call at all.
+- fast: short answers (up to FAST_MAX_WORDS words), including
+  acknowledgements that answer a question, go to ROUTER_FAST_MODEL with a
+  short completion.
+- full: everything else, including questions and image requests, goes
+  to ROUTER_FULL_MODEL.
+
+Each decision is counted by tier and reason, the response time is recorded
+per tier, and the tier is stored with the turn timings, so the staff
+Analytics view shows p50/p95 per tier. ROUTER_ENABLED=0 sends every turn
+to the full tier to get the baseline to compare against.
+"""
+import os
+import re
+import time
+from langchain.schema import AIMessage, HumanMessage
+from llm_therapist import IMAGE_TRIGGERS, process_message
+from metrics import REGISTRY
+from search import fold_accents
+
+TIER_TEMPLATE = "template"
+TIER_FAST = "fast"
+TIER_FULL = "full"
+
+FAST_MAX_WORDS = 3
+
+# Compared after lowercasing, removing accents and punctuation
+ACKNOWLEDGEMENTS = {
+    "si", "sip", "vale", "ok", "okay", "bueno", "bien", "muy bien", "genial", "guay",
+    "claro", "ya", "vale vale", "si si", "de acuerdo", "gracias", "aja", "mmm", "hmm"
+}
+LAUGHTER = re.compile(r"^(ja|je|ji)+$")
+
+# Natural reinforcement of the child's attempt, then an open invitation to continue
+PRT_REINFORCEMENTS = (
+    "¡Muy bien! 😊 Me encanta hablar contigo. ¿Qué más te gustaría contarme?",
+    "¡Genial! Lo estás haciendo fenomenal. ¿Seguimos jugando?",
+    "¡Estupendo! Gracias por contármelo. ¿Qué quieres hacer ahora?",
+    "¡Qué bien! 🌟 Me lo paso genial contigo. ¿Me cuentas algo más?"
+)
+
+# Robot face shown with a templated reinforcement (a key of robot_media.ROBOT_IMAGES)
+TEMPLATE_EMOTION = "correcto"
+
+route_decisions = REGISTRY.counter(
+    "model_route_total",
+    "Child turns by model tier and routing reason"
+)
+route_latency = REGISTRY.histogram(
+    "model_route_response_seconds",
+    "Time to produce the assistant reply of a turn, by model tier"
+)
+
+
+def router_enabled():
+    """Whether turns are routed by tier (read when used, so .env values apply)"""
+    return os.getenv("ROUTER_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def fast_model():
+    """Model of the fast tier"""
+    return os.getenv("ROUTER_FAST_MODEL", "gpt-4.1-nano")
+
+
+def full_model():
+    """Model of the full tier"""
+    return os.getenv("ROUTER_FULL_MODEL", "gpt-4o-mini")
+
+
+def fast_max_tokens():
+    """Completion limit of the fast tier"""
+    return int(os.getenv("ROUTER_FAST_MAX_TOKENS", "150"))
+
+
+class Route:
+    """Tier chosen for a turn and why"""
+
+    def __init__(self, tier, reason):
+        self.tier = tier
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Route({self.tier!r}, {self.reason!r})"
+
+
+def normalize(text):
+    """Lowercase words without accents or punctuation"""
+    return " ".join(re.findall(r"[a-zñ]+", fold_accents((text or "").lower())))
+
+
+def route_turn(user_input, last_assistant_message=None, enabled=None):
+    """Route for a child message, given the assistant message it answers (enabled: default ROUTER_ENABLED)"""
+    if enabled is None:
+        enabled = router_enabled()
+    if not enabled:
+        return Route(TIER_FULL, "disabled")
+    text = (user_input or "").lower()
+    # Image requests are detected by llm_therapist.get_dalle_prompt on the same phrases
+    if any(trigger in text for trigger in IMAGE_TRIGGERS):
+        return Route(TIER_FULL, "image_request")
+    if "?" in text or "¿" in text:
+        return Route(TIER_FULL, "question")
+
+    words = normalize(user_input)
+    if not words:
+        return Route(TIER_FAST, "no_words")
+    asked = (last_assistant_message or "").rstrip().endswith("?")
+    if words in ACKNOWLEDGEMENTS or LAUGHTER.match(words.replace(" ", "")):
+        # An answer to a question needs the context of the conversation
+        return Route(TIER_FAST, "answer") if asked else Route(TIER_TEMPLATE, "acknowledgement")
+    if len(words.split()) <= FAST_MAX_WORDS:
+        return Route(TIER_FAST, "short_answer")
+    return Route(TIER_FULL, "default")
+
+
+def reinforcement(turn_number):
+    """Templated PRT reinforcement, rotating so consecutive turns do not repeat it"""
+    return PRT_REINFORCEMENTS[turn_number % len(PRT_REINFORCEMENTS)]
+
+
+def routed_process_message(chains, user_input, chat_history, trace=None):
+    """process_message on the chain of the turn's tier, or a templated reply.
+
+    chains maps TIER_FAST and TIER_FULL to LLM chains. Returns the result of
+    process_message (human and AI messages, reply text, image URL) and the Route.
+    """
+    last_assistant = next((message.content for message in reversed(chat_history.messages) if message.type == "ai"), None)
+    route = route_turn(user_input, last_assistant)
+    route_decisions.inc(tier=route.tier, reason=route.reason)
+    if trace is not None:
+        trace.label("route", route.tier)
+
+    started = time.perf_counter()
+    if route.tier == TIER_TEMPLATE:
+        reply = reinforcement(len(chat_history.messages) // 2)
+        result = HumanMessage(content=user_input), AIMessage(content=reply), reply, None
+    else:
+        result = process_message(chains[route.tier], user_input, chat_history, trace=trace)
+    route_latency.observe(time.perf_counter() - started, tier=route.tier)
+    return result, route
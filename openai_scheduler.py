@@ -0,0 +1,338 @@
+"""Process-wide scheduler for every OpenAI request.
+
+Chat turns, the robot face classifier, TTS, DALL·E and the summaries all go
+through one OpenAIScheduler per process, so a classroom of sessions shares
+the account's rate limits instead of each session finding them with 429s.
+
+- Each endpoint (chat, tts, images) has token buckets for requests per
+  minute and, for chat, estimated tokens per minute (OPENAI_<ENDPOINT>_RPM,
+  OPENAI_CHAT_TPM).
+- Waiting requests are served by priority: interactive chat and TTS first,
+  then the robot classifier, then background work (summaries, images),
+  which also has to leave BACKGROUND_RESERVE of each bucket free.
+- Every request has a deadline that covers queueing and retries. Each
+  attempt gets the remaining time as its timeout.
+- Rate limits, timeouts and 5xx answers are retried with jittered
+  exponential backoff, honouring Retry-After. A 429 also empties the
+  endpoint's buckets, so the other waiting requests slow down too.
+- After OPENAI_BREAKER_THRESHOLD consecutive failures an endpoint's circuit
+  opens and requests fail fast (without using rate limit capacity) for
+  OPENAI_BREAKER_COOLDOWN_SECONDS. Then one probe request is let through.
+
+Queue depth, queue wait, call latency and outcomes are exported as metrics.
+The process-wide scheduler is built on first use (get_scheduler), after the
+app has loaded .env, so the limits above can be set there.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+import openai
+import requests
+from metrics import REGISTRY
+
+# Priorities (lower is served first)
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BACKGROUND: "background"}
+
+# Seconds from the call until the request must have an answer, by priority
+DEFAULT_DEADLINES = {INTERACTIVE: 30.0, NORMAL: 10.0, BACKGROUND: 120.0}
+
+# Share of each bucket that background requests leave for interactive ones
+BACKGROUND_RESERVE = 0.2
+
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+# An attempt with less time than this left is not started
+MIN_ATTEMPT_SECONDS = 0.5
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN_SECONDS = 30.0
+
+# Tokens reserved for the completion of a chat request
+COMPLETION_TOKENS = 400
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+openai_queue_depth = REGISTRY.gauge(
+    "openai_queue_depth",
+    "OpenAI requests waiting for the scheduler, by endpoint"
+)
+openai_queue_wait = REGISTRY.histogram(
+    "openai_queue_wait_seconds",
+    "Time OpenAI requests waited for a rate limit slot, by endpoint and priority"
+)
+openai_call_latency = REGISTRY.histogram(
+    "openai_call_seconds",
+    "Duration of OpenAI request attempts, by endpoint"
+)
+openai_calls = REGISTRY.counter(
+    "openai_calls_total",
+    "OpenAI request attempts by endpoint and outcome (ok, retry, error, deadline, circuit_open)"
+)
+openai_circuit_open = REGISTRY.gauge(
+    "openai_circuit_open",
+    "1 while an endpoint's circuit breaker is open"
+)
+
+
+class SchedulerError(Exception):
+    """A request the scheduler gave up on without an answer from OpenAI"""
+
+
+class DeadlineExceeded(SchedulerError):
+    pass
+
+
+class CircuitOpenError(SchedulerError):
+    pass
+
+
+class OpenAIHTTPError(Exception):
+    """Error answer of a raw HTTP request (DALL·E goes through requests, not the openai client)"""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}: {response.text[:200]}")
+        self.status_code = response.status_code
+        self.response = response
+
+
+def estimate_tokens(texts, completion_tokens=COMPLETION_TOKENS):
+    """Rough token count of a chat request (about 4 characters per token) plus its completion"""
+    return sum(len(text or "") for text in texts) // 4 + completion_tokens
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(exc):
+    """Whether a failed request may succeed if it is sent again"""
+    if isinstance(exc, (TimeoutError, ConnectionError, openai.APIConnectionError,
+                        requests.ConnectionError, requests.Timeout)):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS
+
+
+def retry_after(exc):
+    """Seconds asked for by a Retry-After header, or None"""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, exc=None):
+    """Full-jitter exponential backoff, at least the server's Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    return max(delay, retry_after(exc) or 0)
+
+
+class TokenBucket:
+    """Refills per_minute units evenly over a minute, holding at most one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now, reserve=0.0):
+        """Seconds until amount can be taken with reserve * capacity left over"""
+        self._refill(now)
+        # A request bigger than the bucket still goes through once it is full
+        needed = min(amount, self.capacity * (1 - reserve)) + reserve * self.capacity - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+
+class _Endpoint:
+    def __init__(self, name, rpm, tpm=None):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.queue = []
+        self.condition = threading.Condition()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def wait_time(self, tokens, now, reserve):
+        wait = self.requests.wait_time(1, now, reserve)
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now, reserve))
+        return wait
+
+    def take(self, tokens):
+        self.requests.take(1)
+        if self.tokens is not None and tokens:
+            self.tokens.take(tokens)
+
+    def drain(self):
+        self.requests.drain()
+        if self.tokens is not None:
+            self.tokens.drain()
+
+
+def request_timeout_seconds():
+    """Default timeout of the langchain clients; each scheduled request passes its own, shorter one"""
+    return float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+
+
+class OpenAIScheduler:
+    """Rate limits, priorities, deadlines, retries and circuit breakers for OpenAI endpoints"""
+
+    def __init__(self, limits, breaker_threshold=BREAKER_THRESHOLD, breaker_cooldown=BREAKER_COOLDOWN_SECONDS):
+        """limits: {endpoint: (requests_per_minute, tokens_per_minute or None)}"""
+        self.endpoints = {name: _Endpoint(name, rpm, tpm) for name, (rpm, tpm) in limits.items()}
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            {
+                "chat": (int(os.getenv("OPENAI_CHAT_RPM", "500")), int(os.getenv("OPENAI_CHAT_TPM", "200000"))),
+                "tts": (int(os.getenv("OPENAI_TTS_RPM", "50")), None),
+                "images": (int(os.getenv("OPENAI_IMAGES_RPM", "5")), None)
+            },
+            breaker_threshold=int(os.getenv("OPENAI_BREAKER_THRESHOLD", str(BREAKER_THRESHOLD))),
+            breaker_cooldown=float(os.getenv("OPENAI_BREAKER_COOLDOWN_SECONDS", str(BREAKER_COOLDOWN_SECONDS)))
+        )
+
+    def call(self, endpoint, func, priority=INTERACTIVE, tokens=0, deadline=None, retries=MAX_RETRIES):
+        """Run func(timeout) when endpoint has capacity, retrying transient failures.
+
+        timeout is the time left until the deadline (seconds). Raises
+        DeadlineExceeded or CircuitOpenError without a result, or the last
+        error of func.
+        """
+        state = self.endpoints[endpoint]
+        deadline_at = time.monotonic() + (deadline or DEFAULT_DEADLINES[priority])
+        for attempt in itertools.count():
+            # An open circuit rejects the call before it takes any rate limit capacity
+            probe = self._enter_circuit(state)
+            try:
+                self._acquire(state, priority, tokens, deadline_at)
+            except DeadlineExceeded:
+                if probe:
+                    # Let another request probe the endpoint
+                    with state.condition:
+                        state.probing = False
+                raise
+            started = time.monotonic()
+            try:
+                result = func(max(deadline_at - started, MIN_ATTEMPT_SECONDS))
+            except Exception as e:
+                openai_call_latency.observe(time.monotonic() - started, endpoint=endpoint)
+                if not is_retryable(e):
+                    # The endpoint answered: the request itself is wrong
+                    self._record_success(state)
+                    openai_calls.inc(endpoint=endpoint, outcome="error")
+                    raise
+                self._record_failure(state, e)
+                delay = backoff_delay(attempt, e)
+                if attempt >= retries or time.monotonic() + delay + MIN_ATTEMPT_SECONDS > deadline_at:
+                    openai_calls.inc(endpoint=endpoint, outcome="error")
+                    raise
+                openai_calls.inc(endpoint=endpoint, outcome="retry")
+                time.sleep(delay)
+                continue
+            openai_call_latency.observe(time.monotonic() - started, endpoint=endpoint)
+            self._record_success(state)
+            openai_calls.inc(endpoint=endpoint, outcome="ok")
+            return result
+
+    def _acquire(self, state, priority, tokens, deadline_at):
+        """Wait for this request's turn and capacity, in (priority, arrival) order"""
+        entry = (priority, next(self._sequence))
+        enqueued = time.monotonic()
+        reserve = BACKGROUND_RESERVE if priority == BACKGROUND else 0.0
+        with state.condition:
+            heapq.heappush(state.queue, entry)
+            openai_queue_depth.set(len(state.queue), endpoint=state.name)
+            state.condition.notify_all()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if state.queue[0] == entry:
+                        wait = state.wait_time(tokens, now, reserve)
+                        if wait == 0:
+                            state.take(tokens)
+                            break
+                    remaining = deadline_at - now
+                    if remaining <= 0:
+                        openai_calls.inc(endpoint=state.name, outcome="deadline")
+                        raise DeadlineExceeded(f"No {state.name} capacity before the deadline")
+                    state.condition.wait(min(wait, remaining) if wait is not None else remaining)
+            finally:
+                state.queue.remove(entry)
+                heapq.heapify(state.queue)
+                openai_queue_depth.set(len(state.queue), endpoint=state.name)
+                state.condition.notify_all()
+        openai_queue_wait.observe(time.monotonic() - enqueued, endpoint=state.name, priority=PRIORITY_NAMES[priority])
+
+    def _enter_circuit(self, state):
+        """Fail fast while the circuit is open; after the cooldown let a single probe through.
+
+        Returns True if this request is the probe.
+        """
+        with state.condition:
+            if state.opened_at is None:
+                return False
+            if time.monotonic() - state.opened_at < self.breaker_cooldown or state.probing:
+                openai_calls.inc(endpoint=state.name, outcome="circuit_open")
+                raise CircuitOpenError(f"OpenAI {state.name} requests are failing; retry later")
+            state.probing = True
+            return True
+
+    def _record_success(self, state):
+        with state.condition:
+            state.failures = 0
+            state.opened_at = None
+            state.probing = False
+        openai_circuit_open.set(0, endpoint=state.name)
+
+    def _record_failure(self, state, exc):
+        with state.condition:
+            if _status_code(exc) == 429:
+                # The account limit is lower than configured or shared: slow everyone down
+                state.drain()
+            state.failures += 1
+            if state.probing or state.failures >= self.breaker_threshold:
+                state.opened_at = time.monotonic()
+                state.probing = False
+                openai_circuit_open.set(1, endpoint=state.name)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, built from the environment on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = OpenAIScheduler.from_env()
+        return _scheduler
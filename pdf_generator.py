@@ -3,57 +3,145 @@ from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from functools import lru_cache
+import hashlib
 import io
+import itertools
+import json
+import os
+import tempfile
+import zipfile
+
+
+@lru_cache(maxsize=1)
+def _build_styles():
+    """Build the style sheet once per process (getSampleStyleSheet is not cheap)"""
+    styles = getSampleStyleSheet()
+    
+    title_style = ParagraphStyle(
+        'Title',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=20,
+        alignment=1,
+        textColor=colors.blue
+    )
+    
+    client_style = ParagraphStyle(
+        'Client',
+        parent=styles['Normal'],
+        fontSize=11,
+        spaceAfter=12,
+        leftIndent=10,
+        backColor=colors.lightgrey
+    )
+    
+    therapist_style = ParagraphStyle(
+        'Therapist',
+        parent=styles['Normal'],
+        fontSize=11,
+        spaceAfter=12,
+        leftIndent=10,
+        backColor=colors.lightblue
+    )
+    
+    return styles, title_style, client_style, therapist_style
+
+
+def _escape(text):
+    """Escape HTML and turn line breaks into ReportLab breaks"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br/>')
+
+
+class _StreamingStory(list):
+    """Flowable list that refills itself from an iterator as ReportLab consumes it.
+    
+    doc.build() only looks at the front of the list (len, [0], del [0] and
+    re-inserting split parts), so keeping a small window of upcoming
+    flowables is enough.
+    """
+    
+    def __init__(self, flowables, window=64):
+        super().__init__()
+        self._source = iter(flowables)
+        self._window = window
+    
+    def _refill(self):
+        if self._source is not None and list.__len__(self) < self._window // 2:
+            chunk = list(itertools.islice(self._source, self._window))
+            if not chunk:
+                self._source = None
+            self.extend(chunk)
+    
+    def __len__(self):
+        self._refill()
+        return list.__len__(self)
+    
+    def __bool__(self):
+        return len(self) > 0
+    
+    def __getitem__(self, index):
+        self._refill()
+        return list.__getitem__(self, index)
 
 
 class PDFGenerator:
     """Handles PDF generation for therapy session conversations"""
     
     def __init__(self):
-        self.styles = getSampleStyleSheet()
         self._setup_styles()
     
     def _setup_styles(self):
-        """Setup basic PDF styles"""
-        self.title_style = ParagraphStyle(
-            'Title',
-            parent=self.styles['Heading1'],
-            fontSize=18,
-            spaceAfter=20,
-            alignment=1,
-            textColor=colors.blue
-        )
-        
-        self.client_style = ParagraphStyle(
-            'Client',
-            parent=self.styles['Normal'],
-            fontSize=11,
-            spaceAfter=12,
-            leftIndent=10,
-            backColor=colors.lightgrey
-        )
-        
-        self.therapist_style = ParagraphStyle(
-            'Therapist',
-            parent=self.styles['Normal'],
-            fontSize=11,
-            spaceAfter=12,
-            leftIndent=10,
-            backColor=colors.lightblue
-        )
-    
-    def create_pdf(self, messages, client_name, session_title="Therapy Session"):
+        """Setup basic PDF styles (shared by all generators in the process)"""
+        self.styles, self.title_style, self.client_style, self.therapist_style = _build_styles()
+    
+    def create_pdf(self, messages, client_name, session_title="Therapy Session", summary=None):
         """Create PDF from conversation messages"""
         buffer = io.BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4)
-        story = []
+        story = list(self._iter_story(messages, client_name, session_title, summary))
+        
+        doc.build(story)
+        buffer.seek(0)
+        return buffer
+    
+    def stream_pdf(self, messages, client_name, session_title, output, summary=None):
+        """Render messages from any iterable (e.g. a DB cursor) straight into a file object.
+        
+        Flowables are created a few at a time while ReportLab lays out pages,
+        so the full story never exists in memory at once.
+        """
+        doc = SimpleDocTemplate(output, pagesize=A4)
+        doc.build(_StreamingStory(self._iter_story(messages, client_name, session_title, summary)))
+        return output
+    
+    def create_pdf_file(self, messages, client_name, session_title="Therapy Session", max_memory=8 * 1024 * 1024,
+                        summary=None):
+        """Render a PDF into a spooled temporary file that spills to disk past max_memory bytes while it is built"""
+        output = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.stream_pdf(messages, client_name, session_title, output, summary)
+        output.seek(0)
+        return output
+    
+    def _iter_story(self, messages, client_name, session_title, summary=None):
+        """Yield the flowables of the header, the session summary (if any) and each message.
         
+        summary is the session's {"summary", "topics"} written by summarizer.py.
+        """
         # Header
-        story.append(Paragraph(f"Therapy Session Conversation", self.title_style))
-        story.append(Paragraph(f"<b>Client:</b> {client_name}", self.styles['Normal']))
-        story.append(Paragraph(f"<b>Session:</b> {session_title}", self.styles['Normal']))
-        story.append(Paragraph(f"<b>Generated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M')}", self.styles['Normal']))
-        story.append(Spacer(1, 20))
+        yield Paragraph(f"Therapy Session Conversation", self.title_style)
+        yield Paragraph(f"<b>Client:</b> {client_name}", self.styles['Normal'])
+        yield Paragraph(f"<b>Session:</b> {session_title}", self.styles['Normal'])
+        yield Paragraph(f"<b>Generated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M')}", self.styles['Normal'])
+        yield Spacer(1, 20)
+        
+        if summary and summary.get("summary"):
+            yield Paragraph("Summary", self.styles['Heading2'])
+            yield Paragraph(_escape(summary["summary"]), self.styles['Normal'])
+            if summary.get("topics"):
+                yield Paragraph(f"<b>Topics:</b> {_escape(', '.join(summary['topics']))}", self.styles['Normal'])
+            yield Spacer(1, 20)
         
         # Messages
         for message in messages:
@@ -64,23 +152,84 @@ class PDFGenerator:
                 continue
                 
             # Escape HTML and handle line breaks
-            content = content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br/>')
+            content = _escape(content)
             
             if role == "user":
-                story.append(Paragraph(f"<b>{client_name}:</b>", self.styles['Heading3']))
-                story.append(Paragraph(content, self.client_style))
+                yield Paragraph(f"<b>{client_name}:</b>", self.styles['Heading3'])
+                yield Paragraph(content, self.client_style)
             elif role == "assistant":
-                story.append(Paragraph("<b>Therapist:</b>", self.styles['Heading3']))
-                story.append(Paragraph(content, self.therapist_style))
+                yield Paragraph("<b>Therapist:</b>", self.styles['Heading3'])
+                yield Paragraph(content, self.therapist_style)
             
-            story.append(Spacer(1, 10))
-        
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
+            yield Spacer(1, 10)
     
     def create_filename(self, client_name, session_title):
         """Create safe filename"""
         safe_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '-', '_')).strip()
         safe_title = "".join(c for c in session_title if c.isalnum() or c in (' ', '-', '_')).strip()
-        return f"{safe_name}_{safe_title}_{datetime.now().strftime('%Y%m%d')}.pdf"
\ No newline at end of file
+        return f"{safe_name}_{safe_title}_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+
+def session_content_hash(messages, client_name, session_title, summary=None):
+    """Hash of everything that ends up in a session PDF, used as its cache key"""
+    summary = summary or {}
+    payload = json.dumps(
+        [client_name, session_title, summary.get("summary"), summary.get("topics"),
+         [[m.get("role", ""), m.get("content", "")] for m in messages]],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_session_pdf(messages, client_name, session_title, summary=None):
+    """Render one session to PDF bytes (top-level so it can run in a process pool)"""
+    return PDFGenerator().create_pdf(messages, client_name, session_title, summary).getvalue()
+
+
+def _render_zip_entry(job):
+    """Worker entry point: stream one session PDF to a temporary file and return its path"""
+    file_name, messages, client_name, session_title, summary = job
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as output:
+        PDFGenerator().stream_pdf(messages, client_name, session_title, output, summary)
+    return file_name, output.name
+
+
+def create_sessions_zip(executor, sessions, client_name, max_in_flight=8):
+    """Render several sessions in a process pool and write them into one ZIP file.
+    
+    sessions is an iterable of (session_id, session_title, messages, summary); it is
+    consumed lazily so at most max_in_flight transcripts are held at once.
+    Workers write each PDF to disk and the archive is built in a spooled
+    temporary file. Serving it with st.download_button still reads it into
+    memory whole, so the staff page caps its size (BULK_EXPORT_MAX_MB).
+    """
+    generator = PDFGenerator()
+    
+    def jobs():
+        for session_id, session_title, messages, summary in sessions:
+            # Session titles are minute-resolution, so add the id to keep names unique
+            base_name = generator.create_filename(client_name, session_title)[:-len(".pdf")]
+            yield (f"{base_name}_{session_id[:8]}.pdf", messages, client_name, session_title, summary)
+    
+    archive = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        pending = set()
+        for job in jobs():
+            pending.add(executor.submit(_render_zip_entry, job))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _add_rendered_files(zip_file, done)
+        _add_rendered_files(zip_file, pending)
+    
+    archive.seek(0)
+    return archive
+
+
+def _add_rendered_files(zip_file, futures):
+    """Copy finished worker PDFs into the archive and remove the temporary files"""
+    for future in as_completed(futures):
+        file_name, path = future.result()
+        try:
+            zip_file.write(path, arcname=file_name)
+        finally:
+            os.remove(path)
@@ -0,0 +1,314 @@
+"""Retention of cold sessions: archive old transcripts, purge expired ones.
+
+Sessions created more than RETENTION_ARCHIVE_DAYS ago have their messages
+written to a compressed JSONL archive and removed from the hot messages
+collection in one bulk delete per batch. The session document stays, with
+its title and summary (summarizer.py), plus an "archive" field. The
+archive is either a file per session under RETENTION_ARCHIVE_DIR
+(RETENTION_TARGET=file) or a document in the archive collection/table
+(RETENTION_TARGET=collection, the default). File archives live on the disk
+of the host that ran the job, so with several app replicas
+RETENTION_ARCHIVE_DIR must be shared storage that every replica mounts.
+Transcripts are zstd-compressed when the zstandard package is installed
+and gzip-compressed otherwise.
+
+Opening an archived session restores its messages transparently (see
+load_session_messages in db_operations.py). Exports and transcript search
+read archives in place (read_archive) without restoring them. A restored session is not
+archived again for RETENTION_RESTORE_GRACE_DAYS. With RETENTION_PURGE_DAYS
+set, sessions older than that are deleted together with their archive.
+
+Usage (e.g. from cron at night):
+    python retention.py [--archive-days 180] [--purge-days 730] [--target file|collection] [--dry-run]
+"""
+import argparse
+import gzip
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from storage import create_backend_from_env, get_backend, _decode_doc, _encode_doc
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TARGET_FILE = "file"
+TARGET_COLLECTION = "collection"
+
+
+class RetentionPolicy:
+    """When sessions are archived or purged, and where their archives go"""
+
+    def __init__(self, archive_after_days=180, purge_after_days=None, target=TARGET_COLLECTION,
+                 archive_dir="archive", batch_size=200, restore_grace_days=7):
+        if target not in (TARGET_FILE, TARGET_COLLECTION):
+            raise ValueError(f"Unknown retention target '{target}' (expected '{TARGET_FILE}' or '{TARGET_COLLECTION}')")
+        if purge_after_days is not None and purge_after_days < archive_after_days:
+            raise ValueError("Sessions cannot be purged before they are archived")
+        self.archive_after_days = archive_after_days
+        self.purge_after_days = purge_after_days
+        self.target = target
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.restore_grace_days = restore_grace_days
+
+    @classmethod
+    def from_env(cls):
+        purge_days = os.getenv("RETENTION_PURGE_DAYS")
+        return cls(
+            archive_after_days=int(os.getenv("RETENTION_ARCHIVE_DAYS", "180")),
+            purge_after_days=int(purge_days) if purge_days else None,
+            target=os.getenv("RETENTION_TARGET", TARGET_COLLECTION).strip().lower(),
+            archive_dir=os.getenv("RETENTION_ARCHIVE_DIR", "archive"),
+            batch_size=int(os.getenv("RETENTION_BATCH_SIZE", "200")),
+            restore_grace_days=int(os.getenv("RETENTION_RESTORE_GRACE_DAYS", "7"))
+        )
+
+
+def compress(data):
+    """(codec, bytes) with zstd when available, else gzip"""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=9)
+
+
+def decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This archive is zstd-compressed: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"Unknown archive codec '{codec}'")
+
+
+def encode_messages(messages):
+    return "".join(_encode_doc(message) + "\n" for message in messages).encode("utf-8")
+
+
+def decode_messages(data):
+    return [_decode_doc(line) for line in data.decode("utf-8").splitlines() if line]
+
+
+class FileArchiveStore:
+    """One compressed JSONL file per session"""
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    def _path(self, session_id, codec):
+        extension = "zst" if codec == "zstd" else "gz"
+        return os.path.join(self.archive_dir, f"{session_id}.jsonl.{extension}")
+
+    def put(self, session_id, codec, data):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._path(session_id, codec)
+        # Write then rename so a crash never leaves a truncated archive behind
+        with open(path + ".partial", "wb") as archive_file:
+            archive_file.write(data)
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+        os.replace(path + ".partial", path)
+
+    def get(self, session_id, codec):
+        path = self._path(session_id, codec)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as archive_file:
+            return archive_file.read()
+
+    def delete(self, session_ids, codec):
+        for session_id in session_ids:
+            try:
+                os.remove(self._path(session_id, codec))
+            except FileNotFoundError:
+                pass
+
+
+class CollectionArchiveStore:
+    """Archives kept by the storage backend (archive collection or table)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def put(self, session_id, codec, data):
+        self.backend.save_archive(session_id, codec, data)
+
+    def get(self, session_id, codec):
+        archive = self.backend.load_archive(session_id)
+        return archive[1] if archive else None
+
+    def delete(self, session_ids, codec):
+        self.backend.delete_archives(session_ids)
+
+
+def archive_store(backend, target, archive_dir="archive"):
+    if target == TARGET_COLLECTION:
+        return CollectionArchiveStore(backend)
+    return FileArchiveStore(archive_dir)
+
+
+def _sessions_before(backend, cutoff, batch_size, archived):
+    """Sessions created before cutoff with or without an archive, in chunks each read completely before it is modified"""
+    after = None
+    while True:
+        chunk = []
+        for session in backend.iter_sessions(end=cutoff, after=after, batch_size=batch_size, archived=archived):
+            chunk.append(session)
+            if len(chunk) >= batch_size:
+                break
+        if not chunk:
+            return
+        yield chunk
+        after = (chunk[-1]["created_at"], chunk[-1]["session_id"])
+
+
+def _archive_batch(backend, store, policy, sessions, now):
+    """Archive the transcripts of some sessions, then delete their messages in one bulk operation"""
+    archived_ids = []
+    for session in sessions:
+        session_id = session["session_id"]
+        messages = list(backend.iter_messages(session_id))
+        codec, data = compress(encode_messages(messages))
+        if messages:
+            store.put(session_id, codec, data)
+        # Marked before the delete: a crash in between leaves a stale copy, never a lost one
+        backend.update_session(session_id, {"archive": {
+            "target": policy.target,
+            "codec": codec,
+            "message_count": len(messages),
+            "archived_at": now
+        }})
+        archived_ids.append(session_id)
+    return backend.delete_messages_many(archived_ids)
+
+
+def _purge_batch(backend, policy, sessions):
+    """Delete archived sessions together with their archives and any leftover messages"""
+    by_archive = {}
+    for session in sessions:
+        archive = session["archive"]
+        by_archive.setdefault((archive["target"], archive["codec"]), []).append(session["session_id"])
+    for (target, codec), session_ids in by_archive.items():
+        archive_store(backend, target, policy.archive_dir).delete(session_ids, codec)
+    session_ids = [session["session_id"] for session in sessions]
+    backend.delete_messages_many(session_ids)
+    return backend.delete_sessions(session_ids)
+
+
+def run_retention(db, policy=None, now=None, dry_run=False, progress=None):
+    """Archive and purge the sessions past the policy's ages; returns a dict of counts"""
+    backend = get_backend(db)
+    policy = policy or RetentionPolicy.from_env()
+    now = now or datetime.now()
+    store = archive_store(backend, policy.target, policy.archive_dir)
+    counts = {"archived": 0, "messages_removed": 0, "purged": 0}
+    restore_grace = timedelta(days=policy.restore_grace_days)
+
+    if policy.purge_after_days is not None:
+        purge_cutoff = now - timedelta(days=policy.purge_after_days)
+        for expired in _sessions_before(backend, purge_cutoff, policy.batch_size, archived=True):
+            counts["purged"] += len(expired) if dry_run else _purge_batch(backend, policy, expired)
+
+    archive_cutoff = now - timedelta(days=policy.archive_after_days)
+    for chunk in _sessions_before(backend, archive_cutoff, policy.batch_size, archived=False):
+        cold = [
+            session for session in chunk
+            if session.get("restored_at") is None or now - session["restored_at"] >= restore_grace
+        ]
+        if not cold:
+            continue
+        if not dry_run:
+            counts["messages_removed"] += _archive_batch(backend, store, policy, cold, now)
+        counts["archived"] += len(cold)
+        if progress:
+            progress(f"Archived {counts['archived']} sessions")
+    return counts
+
+
+def read_archive(db, session, policy=None):
+    """Messages of an archived session, decoded without restoring them ([] if it is not archived)"""
+    archive = session.get("archive")
+    if not archive or not archive.get("message_count"):
+        return []
+    policy = policy or RetentionPolicy.from_env()
+    store = archive_store(get_backend(db), archive["target"], policy.archive_dir)
+    session_id = session["session_id"]
+    data = store.get(session_id, archive["codec"])
+    if data is None:
+        raise RuntimeError(f"Archive of session {session_id} not found")
+    messages = decode_messages(decompress(archive["codec"], data))
+    for message in messages:
+        message["session_id"] = session_id
+    return messages
+
+
+def restore_session(db, session, policy=None):
+    """Bring the messages of an archived session back into hot storage and return them"""
+    backend = get_backend(db)
+    archive = session.get("archive")
+    if not archive:
+        return []
+    policy = policy or RetentionPolicy.from_env()
+    session_id = session["session_id"]
+
+    messages = read_archive(backend, session, policy)
+    if messages:
+        # Leftovers of an interrupted archive run would be duplicated otherwise
+        backend.delete_messages(session_id)
+        backend.insert_messages(messages)
+    backend.update_session(session_id, {"archive": None, "restored_at": datetime.now()})
+    archive_store(backend, archive["target"], policy.archive_dir).delete([session_id], archive["codec"])
+    return messages
+
+
+def delete_session_archive(db, session, policy=None):
+    """Remove the archive of a session that is being deleted"""
+    archive = session.get("archive")
+    if archive:
+        policy = policy or RetentionPolicy.from_env()
+        archive_store(get_backend(db), archive["target"], policy.archive_dir).delete([session["session_id"]], archive["codec"])
+
+
+def restore_if_archived(db, session_id, policy=None, session=None):
+    """Messages of a session restored from its archive, or [] if it is not archived.
+
+    Pass the session document if the caller has it, to skip looking it up.
+    """
+    backend = get_backend(db)
+    if session is None:
+        sessions = backend.find_sessions([session_id])
+        session = sessions[0] if sessions else None
+    if not session or not session.get("archive"):
+        return []
+    return restore_session(backend, session, policy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and purge cold sessions")
+    parser.add_argument("--archive-days", type=int, help="Archive sessions older than this (default RETENTION_ARCHIVE_DAYS)")
+    parser.add_argument("--purge-days", type=int, help="Delete archived sessions older than this (default RETENTION_PURGE_DAYS)")
+    parser.add_argument("--target", choices=[TARGET_FILE, TARGET_COLLECTION], help="Where archives are written")
+    parser.add_argument("--archive-dir", help="Directory for file archives")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the sessions that would be affected")
+    args = parser.parse_args()
+
+    load_dotenv()
+    defaults = RetentionPolicy.from_env()
+    policy = RetentionPolicy(
+        archive_after_days=args.archive_days if args.archive_days is not None else defaults.archive_after_days,
+        purge_after_days=args.purge_days if args.purge_days is not None else defaults.purge_after_days,
+        target=args.target or defaults.target,
+        archive_dir=args.archive_dir or defaults.archive_dir,
+        batch_size=defaults.batch_size,
+        restore_grace_days=defaults.restore_grace_days
+    )
+    backend = create_backend_from_env()
+    backend.setup_indexes()
+    counts = run_retention(backend, policy, dry_run=args.dry_run, progress=print)
+    print(", ".join(f"{name}: {count}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
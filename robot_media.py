@@ -0,0 +1,240 @@
+"""Display-ready robot face assets served through Streamlit static file serving.
+
+The full-size JPEGs in Multimedia/ are decoded and downscaled once into
+small WebP files under static/robot/. Streamlit serves them at
+app/static/robot/<emotion>.webp (server.enableStaticServing in
+.streamlit/config.toml). The browser caches each face, so switching faces
+only changes an <img> URL instead of re-encoding and re-sending the image.
+
+The reaction clips in Multimedia/videos/ are transcoded with ffmpeg into
+short, silent, looping WebM (VP9) and MP4 (H.264) variants next to the
+faces. Emotions with a clip play it in a <video> loop, with the still face
+as the poster. Transcoding is slow, so the app never runs ffmpeg itself: it
+only uses loops that are already built and otherwise shows the still faces.
+
+Build the assets ahead of time (e.g. in the deploy step; ffmpeg is listed
+in packages.txt) with:
+    python robot_media.py [--width 480] [--video-width 360] [--force]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import streamlit as st
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BASE_DIR, "Multimedia")
+STATIC_DIR = os.path.join(BASE_DIR, "static", "robot")
+STATIC_URL = "app/static/robot"
+
+DEFAULT_EMOTION = "defecto"
+ROBOT_IMAGES = {
+    'defecto': 'cara_robot.jpg',
+    'saludo': 'saludo_robot.jpg',
+    'correcto': 'correcto_robot.jpg',
+    'risa': 'risa_robot.jpg',
+    'sorprendido': 'sorprendido_robot.jpg',
+    'deporte': 'deporte_robot.jpg',
+    'bailar': 'bailar_robot.jpg',
+    'pensar': 'pensar_robot.jpg'
+}
+
+# Reaction clips per emotion, matched by a keyword of the clip's file name
+VIDEO_SOURCE_DIR = os.path.join(SOURCE_DIR, "videos")
+ROBOT_VIDEOS = {
+    'correcto': 'pulgares',  # thumbs-up
+    'saludo': 'salude',      # waves and laughs
+    'risa': 'salude'
+}
+
+# The robot column is about a third of the page; 480px stays sharp on most screens
+DISPLAY_WIDTH = 480
+WEBP_QUALITY = 80
+
+# Loops are small on purpose: they replay forever and every child downloads them
+VIDEO_WIDTH = 360
+VIDEO_FPS = 15
+VIDEO_MAX_SECONDS = 5
+VIDEO_FORMATS = {
+    "webm": ["-c:v", "libvpx-vp9", "-b:v", "0", "-crf", "42", "-row-mt", "1", "-deadline", "good"],
+    "mp4": ["-c:v", "libx264", "-preset", "slow", "-crf", "30", "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+}
+
+
+def robot_image_source(emotion):
+    """Path of the original full-size JPEG for an emotion"""
+    return os.path.join(SOURCE_DIR, ROBOT_IMAGES.get(emotion, ROBOT_IMAGES[DEFAULT_EMOTION]))
+
+
+def robot_image_target(emotion):
+    return os.path.join(STATIC_DIR, f"{emotion}.webp")
+
+
+def build_robot_images(width=DISPLAY_WIDTH, force=False):
+    """Downscale every robot face to WebP (skipping up-to-date files) and return {emotion: version}"""
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    versions = {}
+    for emotion in ROBOT_IMAGES:
+        source = robot_image_source(emotion)
+        target = robot_image_target(emotion)
+        if force or not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+            with Image.open(source) as image:
+                image = image.convert("RGB")
+                image.thumbnail((width, width * 4), Image.LANCZOS)
+                # Write then rename so a concurrent request never sees a partial file
+                image.save(target + ".tmp", format="WEBP", quality=WEBP_QUALITY, method=6)
+            os.replace(target + ".tmp", target)
+        # The version changes whenever the file is rebuilt, busting browser caches
+        versions[emotion] = int(os.path.getmtime(target))
+    return versions
+
+
+@st.cache_resource
+def ensure_robot_images():
+    """Build the robot assets once per server process"""
+    return build_robot_images()
+
+
+def robot_video_source(emotion):
+    """Path of the original clip for an emotion, or None if it has no clip"""
+    keyword = ROBOT_VIDEOS.get(emotion)
+    if not keyword or not os.path.isdir(VIDEO_SOURCE_DIR):
+        return None
+    for name in sorted(os.listdir(VIDEO_SOURCE_DIR)):
+        if keyword in name and name.lower().endswith(".mp4"):
+            return os.path.join(VIDEO_SOURCE_DIR, name)
+    return None
+
+
+def robot_video_target(emotion, extension):
+    return os.path.join(STATIC_DIR, f"{emotion}.{extension}")
+
+
+def find_ffmpeg():
+    """ffmpeg executable from FFMPEG_BINARY or the PATH, or None"""
+    return os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+
+def build_robot_videos(width=VIDEO_WIDTH, force=False):
+    """Transcode the reaction clips to looping WebM/MP4 and return {emotion: version}"""
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        return {}
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    versions = {}
+    for emotion in ROBOT_VIDEOS:
+        source = robot_video_source(emotion)
+        if source is None:
+            continue
+        for extension, codec_args in VIDEO_FORMATS.items():
+            target = robot_video_target(emotion, extension)
+            if force or not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+                temp_target = f"{target}.tmp.{extension}"
+                subprocess.run(
+                    [ffmpeg, "-y", "-loglevel", "error", "-i", source, "-t", str(VIDEO_MAX_SECONDS),
+                     "-an", "-vf", f"scale={width}:-2,fps={VIDEO_FPS}", *codec_args, temp_target],
+                    check=True
+                )
+                os.replace(temp_target, target)
+        versions[emotion] = int(max(
+            os.path.getmtime(robot_video_target(emotion, extension)) for extension in VIDEO_FORMATS
+        ))
+    return versions
+
+
+def built_robot_videos():
+    """{emotion: version} of the reaction loops already built in every format"""
+    versions = {}
+    for emotion in ROBOT_VIDEOS:
+        targets = [robot_video_target(emotion, extension) for extension in VIDEO_FORMATS]
+        if all(os.path.exists(target) for target in targets):
+            versions[emotion] = int(max(os.path.getmtime(target) for target in targets))
+    return versions
+
+
+@st.cache_resource
+def ensure_robot_videos():
+    """Reaction loops built by the deploy step, found once per server process ({} shows the still faces)"""
+    return built_robot_videos()
+
+
+def robot_image_url(emotion):
+    """Browser-cacheable URL of the display-sized face for an emotion"""
+    versions = ensure_robot_images()
+    emotion = emotion if emotion in versions else DEFAULT_EMOTION
+    return f"{STATIC_URL}/{emotion}.webp?v={versions[emotion]}"
+
+
+def robot_video_urls(emotion):
+    """{extension: URL} of the reaction loop for an emotion ({} if it has none)"""
+    versions = ensure_robot_videos()
+    if emotion not in versions:
+        return {}
+    return {
+        extension: f"{STATIC_URL}/{emotion}.{extension}?v={versions[emotion]}"
+        for extension in VIDEO_FORMATS
+    }
+
+
+def _preload_html(emotion):
+    """Hidden copies of the other faces and loops so the browser has them cached before a switch"""
+    # Markdown sanitization drops <link rel="prefetch">, hidden media elements survive it
+    faces = "".join(
+        f'<img src="{robot_image_url(other)}" alt="">' for other in ROBOT_IMAGES if other != emotion
+    )
+    # WebM is the variant most browsers pick from the <source> list
+    loops = "".join(
+        f'<video src="{robot_video_urls(other)["webm"]}" preload="auto" muted></video>'
+        for other in ensure_robot_videos() if other != emotion
+    )
+    return f'<div class="robot-preload" aria-hidden="true">{faces}{loops}</div>'
+
+
+def robot_image_html(emotion, caption="Pepper, tu asistente"):
+    """Reaction loop (or still face) for an emotion, followed by the preloaded other assets"""
+    video_urls = robot_video_urls(emotion)
+    if video_urls:
+        sources = "".join(
+            f'<source src="{video_urls[extension]}" type="video/{extension}">' for extension in VIDEO_FORMATS
+        )
+        media = (
+            f'<video class="robot-face" autoplay loop muted playsinline preload="auto" '
+            f'poster="{robot_image_url(emotion)}" aria-label="{caption}">{sources}</video>'
+        )
+    else:
+        media = f'<img class="robot-face" src="{robot_image_url(emotion)}" alt="{caption}">'
+    return (
+        f'<figure class="robot-figure">{media}<figcaption>{caption}</figcaption></figure>'
+        f'{_preload_html(emotion)}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the display-sized robot assets under static/")
+    parser.add_argument("--width", type=int, default=DISPLAY_WIDTH)
+    parser.add_argument("--video-width", type=int, default=VIDEO_WIDTH)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the assets are up to date")
+    args = parser.parse_args()
+
+    versions = build_robot_images(args.width, args.force)
+    for emotion in versions:
+        source_kb = os.path.getsize(robot_image_source(emotion)) / 1024
+        target_kb = os.path.getsize(robot_image_target(emotion)) / 1024
+        print(f"{emotion:<12} {source_kb:>8.0f} KB -> {target_kb:>6.0f} KB")
+
+    if not find_ffmpeg():
+        print("ffmpeg not found (set FFMPEG_BINARY or install it): skipping the reaction loops")
+        return
+    for emotion in build_robot_videos(args.video_width, args.force):
+        source_kb = os.path.getsize(robot_video_source(emotion)) / 1024
+        sizes = ", ".join(
+            f"{extension} {os.path.getsize(robot_video_target(emotion, extension)) / 1024:.0f} KB"
+            for extension in VIDEO_FORMATS
+        )
+        print(f"{emotion:<12} {source_kb:>8.0f} KB -> {sizes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Bulk provisioning of child and staff accounts from a CSV or JSON roster.
+
+Rows are validated column-wise with pandas, then the valid ones are
+inserted in batches with one unordered bulk insert each. Emails that are
+already registered are detected by the unique email index, not by looking
+them up first. The result is a report with one line per input row.
+
+Roster columns: name, email, user_type (child or staff, default child),
+age (required for children, 3-18) and optionally password. Rows without a
+password get a random temporary one, returned in the report.
+"""
+import io
+import secrets
+from datetime import datetime
+import pandas as pd
+from auth import EMAIL_PATTERN, hash_password
+from storage import get_backend, normalize_email
+
+ROSTER_COLUMNS = ["name", "email", "user_type", "age", "password"]
+USER_TYPES = ("child", "staff")
+MIN_AGE, MAX_AGE = 3, 18
+MIN_PASSWORD_LENGTH = 6
+
+STATUS_CREATED = "created"
+STATUS_DUPLICATE = "duplicate"
+STATUS_INVALID = "invalid"
+
+
+def read_roster(data, file_name):
+    """DataFrame of a .csv or .json roster (bytes or file object)"""
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    if file_name.lower().endswith(".json"):
+        frame = pd.read_json(data, dtype=False)
+    else:
+        frame = pd.read_csv(data, dtype=str, keep_default_na=False)
+    frame.columns = [str(column).strip().lower() for column in frame.columns]
+    missing = {"name", "email"} - set(frame.columns)
+    if missing:
+        raise ValueError(f"Missing roster columns: {', '.join(sorted(missing))}")
+    return frame
+
+
+def validate_roster(frame):
+    """Normalized copy of the roster with an "error" column (empty for valid rows)"""
+    roster = pd.DataFrame(index=frame.index)
+    for column in ROSTER_COLUMNS:
+        values = frame[column] if column in frame.columns else pd.Series("", index=frame.index)
+        roster[column] = values.fillna("").astype(str).str.strip()
+    roster["email"] = roster["email"].map(normalize_email)
+    roster["user_type"] = roster["user_type"].str.lower().replace("", "child")
+    roster["age"] = pd.to_numeric(roster["age"], errors="coerce")
+    # Spreadsheet line of each row (header is line 1)
+    roster.insert(0, "row", range(2, len(roster) + 2))
+
+    is_child = roster["user_type"] == "child"
+    checks = [
+        (roster["name"] == "", "missing name"),
+        (~roster["email"].str.match(EMAIL_PATTERN), "invalid email"),
+        (~roster["user_type"].isin(USER_TYPES), "user_type must be child or staff"),
+        (is_child & ~roster["age"].between(MIN_AGE, MAX_AGE), f"children need an age between {MIN_AGE} and {MAX_AGE}"),
+        ((roster["password"] != "") & (roster["password"].str.len() < MIN_PASSWORD_LENGTH),
+         f"password shorter than {MIN_PASSWORD_LENGTH} characters"),
+        (roster["email"].duplicated(keep="first") & (roster["email"] != ""), "email repeated in this file")
+    ]
+    errors = pd.Series("", index=roster.index)
+    for failed, message in checks:
+        errors = errors.where(~failed, errors + "; " + message)
+    roster["error"] = errors.str.lstrip("; ")
+    return roster
+
+
+def _user_documents(valid, created_at):
+    """User documents for the valid rows, plus the temporary passwords that were generated"""
+    documents, temporary_passwords = [], []
+    for row in valid.itertuples(index=False):
+        password = row.password or secrets.token_urlsafe(9)
+        temporary_passwords.append("" if row.password else password)
+        document = {
+            "user_id": secrets.token_hex(16),
+            "name": row.name,
+            "email": row.email,
+            "password_hash": hash_password(password),
+            "user_type": row.user_type,
+            "created_at": created_at
+        }
+        if row.user_type == "child":
+            document["age"] = int(row.age)
+        documents.append(document)
+    return documents, temporary_passwords
+
+
+def import_roster(db, frame, batch_size=500, progress=None):
+    """Create the accounts of a roster; returns the per-row report as a DataFrame"""
+    backend = get_backend(db)
+    roster = validate_roster(frame)
+    roster["status"] = STATUS_INVALID
+    roster["temporary_password"] = ""
+
+    valid = roster[roster["error"] == ""]
+    created_at = datetime.now()
+    for start in range(0, len(valid), batch_size):
+        batch = valid.iloc[start:start + batch_size]
+        documents, temporary_passwords = _user_documents(batch, created_at)
+        skipped = set(backend.insert_users(documents))
+        for position, index in enumerate(batch.index):
+            if position in skipped:
+                roster.at[index, "status"] = STATUS_DUPLICATE
+                roster.at[index, "error"] = "email already registered"
+            else:
+                roster.at[index, "status"] = STATUS_CREATED
+                roster.at[index, "temporary_password"] = temporary_passwords[position]
+        if progress:
+            progress(min(start + batch_size, len(valid)) / len(valid))
+
+    return roster[["row", "name", "email", "user_type", "status", "error", "temporary_password"]]
@@ -0,0 +1,273 @@
+"""Full-text search over all transcripts for the staff dashboard.
+
+On MongoDB the search runs on the server against the Spanish text index of
+the messages (stemming, case and diacritic folding), grouped into one hit
+per session. Backends without a text index (SQLite, mongomock), or
+SEARCH_INDEX=memory, use TranscriptIndex: an in-process inverted index
+with accent folding, a light Spanish stemmer and BM25 ranking. The index
+is refreshed incrementally from the sessions whose messages changed since
+its watermark.
+
+Archived sessions (see retention.py) have no rows in the messages
+collection, so their transcripts are read from the archive: the first
+refresh of TranscriptIndex indexes them, and server search scans at most
+ARCHIVED_SEARCH_LIMIT archived sessions of the requested scope, newest first.
+"""
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from retention import read_archive
+from storage import get_backend
+
+STOPWORDS = {
+    "a", "al", "algo", "como", "con", "de", "del", "el", "ella", "en", "es", "esa", "ese", "eso", "esta",
+    "este", "esto", "fue", "ha", "hay", "la", "las", "le", "les", "lo", "los", "me", "mi", "mas", "muy",
+    "no", "nos", "o", "para", "pero", "por", "que", "se", "si", "sin", "su", "sus", "te", "tu", "un",
+    "una", "uno", "unos", "unas", "y", "ya", "yo"
+}
+
+# Longest first; diminutives matter in children's speech (perrito -> perr)
+SUFFIXES = (
+    "amente", "mente", "aciones", "acion", "iciones", "icion", "iones", "ion", "idades", "idad",
+    "ismos", "ismo", "istas", "ista", "illas", "illos", "illa", "illo", "itas", "itos", "ita", "ito",
+    "osas", "osos", "osa", "oso"
+)
+
+WORD_PATTERN = re.compile(r"[a-z0-9ñ]+")
+
+# Messages are timestamped before they are written; re-reading this window is harmless
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Archived sessions scanned per server search (each one is decompressed)
+ARCHIVED_SEARCH_LIMIT = 500
+
+
+def fold_accents(text):
+    """Lowercase and strip diacritics (canción -> cancion, pingüino -> pinguino), keeping ñ"""
+    text = text.lower().replace("ñ", "\0")
+    folded = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return folded.replace("\0", "ñ")
+
+
+def stem(word):
+    """Light Spanish stemmer: drops common derivational suffixes, plurals and gender vowels"""
+    if len(word) <= 3:
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if word.endswith("es") and len(word) > 4 and word[-3] not in "aeiou":
+        word = word[:-2]
+    elif word.endswith("s") and len(word) > 3:
+        word = word[:-1]
+    if word[-1] in "aeo" and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def analyze(text):
+    """Text -> list of search terms"""
+    return [stem(word) for word in WORD_PATTERN.findall(fold_accents(text or "")) if word not in STOPWORDS]
+
+
+class TranscriptIndex:
+    """Incrementally built inverted index of sessions, ranked with BM25"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, min_refresh_interval=5.0):
+        self.postings = defaultdict(dict)  # term -> {session_id: term frequency}
+        self.session_terms = {}            # session_id -> set of terms (to remove a session)
+        self.session_length = {}           # session_id -> number of terms
+        self.session_info = {}             # session_id -> (user_id, created_at)
+        self.total_length = 0
+        self.watermark = None
+        self.min_refresh_interval = min_refresh_interval
+        self._last_refresh = 0.0
+        self._lock = threading.RLock()
+
+    def refresh(self, db, force=False, chunk_size=200):
+        """Index the sessions whose messages changed since the last refresh"""
+        if not force and time.monotonic() - self._last_refresh < self.min_refresh_interval:
+            return 0
+        backend = get_backend(db)
+        started = datetime.now()
+        with self._lock:
+            session_ids = backend.changed_session_ids(self.watermark)
+            for start in range(0, len(session_ids), chunk_size):
+                chunk = session_ids[start:start + chunk_size]
+                sessions = {session["session_id"]: session for session in backend.find_sessions(chunk)}
+                for session_id in chunk:
+                    session = sessions.get(session_id)
+                    if session is None:
+                        self._remove(session_id)
+                        continue
+                    self._add_session(session, backend.iter_messages(session_id))
+            if self.watermark is None:
+                # Archived sessions have no messages left to show up in changed_session_ids
+                for session in backend.iter_sessions(archived=True):
+                    self._add_session(session, read_archive(backend, session))
+            self.watermark = started - WATERMARK_OVERLAP
+            self._last_refresh = time.monotonic()
+            return len(session_ids)
+
+    def _add_session(self, session, messages):
+        text = " ".join(message.get("content") or "" for message in messages)
+        self._add(session["session_id"], session.get("user_id"), session.get("created_at"), analyze(text))
+
+    def _add(self, session_id, user_id, created_at, terms):
+        self._remove(session_id)
+        counts = Counter(terms)
+        for term, count in counts.items():
+            self.postings[term][session_id] = count
+        self.session_terms[session_id] = set(counts)
+        self.session_length[session_id] = len(terms)
+        self.session_info[session_id] = (user_id, created_at)
+        self.total_length += len(terms)
+
+    def _remove(self, session_id):
+        for term in self.session_terms.pop(session_id, ()):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(session_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.session_length.pop(session_id, 0)
+        self.session_info.pop(session_id, None)
+
+    def search(self, query, user_ids=None, start=None, end=None, limit=20):
+        """[{"session_id", "score", "matches"}] best first, filtered by child and session date"""
+        terms = set(analyze(query))
+        user_ids = set(user_ids) if user_ids is not None else None
+        with self._lock:
+            document_count = len(self.session_length)
+            if not terms or not document_count:
+                return []
+            average_length = self.total_length / document_count
+            scores = defaultdict(float)
+            matches = defaultdict(int)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for session_id, frequency in postings.items():
+                    user_id, created_at = self.session_info[session_id]
+                    if user_ids is not None and user_id not in user_ids:
+                        continue
+                    if (start is not None or end is not None) and created_at is None:
+                        continue
+                    if (start is not None and created_at < start) or (end is not None and created_at >= end):
+                        continue
+                    length_norm = 1 - self.B + self.B * self.session_length[session_id] / average_length
+                    scores[session_id] += idf * frequency * (self.K1 + 1) / (frequency + self.K1 * length_norm)
+                    matches[session_id] += frequency
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [
+            {"session_id": session_id, "score": score, "matches": matches[session_id], "content": None}
+            for session_id, score in ranked
+        ]
+
+
+def make_snippet(content, query, width=12):
+    """A window of about 2*width words around the first query match, matches in bold"""
+    query_terms = set(analyze(query))
+    words = (content or "").split()
+    hits = [index for index, word in enumerate(words) if query_terms & set(analyze(word))]
+    if not hits:
+        return " ".join(words[:2 * width]) + (" …" if len(words) > 2 * width else "")
+    first = max(0, hits[0] - width)
+    last = min(len(words), hits[0] + width)
+    shown = [f"**{word}**" if index in hits else word for index, word in enumerate(words[first:last], first)]
+    return ("… " if first else "") + " ".join(shown) + (" …" if last < len(words) else "")
+
+
+def _best_message(backend, session, query):
+    """Content of the message with the most query terms (used when the index has no snippet)"""
+    query_terms = set(analyze(query))
+    best, best_count = None, 0
+    if session.get("archive"):
+        messages = read_archive(backend, session)
+    else:
+        messages = backend.iter_messages(session["session_id"])
+    for message in messages:
+        count = len(query_terms & set(analyze(message.get("content"))))
+        if count > best_count:
+            best, best_count = message.get("content"), count
+    return best
+
+
+def _archived_hits(backend, query, user_ids=None, start=None, end=None):
+    """Hits from the archived sessions in scope, scored like the text index (matching terms per message)"""
+    query_terms = set(analyze(query))
+    sessions = list(backend.iter_sessions(user_ids, start, end, archived=True))[-ARCHIVED_SEARCH_LIMIT:]
+    hits = []
+    for session in sessions:
+        score, matches, best, best_count = 0, 0, None, 0
+        for message in read_archive(backend, session):
+            count = len(query_terms & set(analyze(message.get("content"))))
+            if count:
+                score += count
+                matches += 1
+                if count > best_count:
+                    best, best_count = message.get("content"), count
+        if matches:
+            hits.append({"session_id": session["session_id"], "score": score, "matches": matches, "content": best})
+    return hits
+
+
+def use_server_search():
+    return os.getenv("SEARCH_INDEX", "server").strip().lower() != "memory"
+
+
+def search_transcripts(db, query, user_ids=None, start=None, end=None, limit=20, index=None):
+    """Ranked session hits with child, date and snippet.
+
+    Uses the server text index when available, otherwise (or with
+    SEARCH_INDEX=memory) the given in-process TranscriptIndex. Server hits
+    are merged with matches from archived sessions.
+    """
+    backend = get_backend(db)
+    hits = None
+    if use_server_search():
+        session_ids = None
+        if user_ids is not None or start is not None or end is not None:
+            session_ids = [session["session_id"] for session in backend.iter_sessions(user_ids, start, end)]
+        try:
+            hits = backend.text_search(query, session_ids, limit)
+        except NotImplementedError:
+            hits = None
+        if hits is not None:
+            hits = sorted(hits + _archived_hits(backend, query, user_ids, start, end),
+                          key=lambda hit: hit["score"], reverse=True)[:limit]
+    if hits is None:
+        if index is None:
+            raise RuntimeError("No text index on this backend and no in-process index given")
+        index.refresh(backend)
+        hits = index.search(query, user_ids, start, end, limit)
+
+    # Sessions deleted since they were indexed are dropped here
+    sessions = {session["session_id"]: session for session in backend.find_sessions([hit["session_id"] for hit in hits])}
+    results = []
+    for hit in hits:
+        session = sessions.get(hit["session_id"])
+        if session is None:
+            continue
+        content = hit["content"] or _best_message(backend, session, query)
+        results.append({
+            **hit,
+            "user_id": session.get("user_id"),
+            "title": session.get("title", "Untitled Session"),
+            "created_at": session.get("created_at"),
+            "summary": session.get("summary"),
+            "topics": session.get("topics"),
+            "snippet": make_snippet(content, query)
+        })
+    return results
@@ -0,0 +1,250 @@
+"""Approximate memory held by each child browser session, and eviction of idle ones.
+
+Every run, fragment rerun and callback of the child page records the
+session's activity in a process-wide tracker; that is a dict update. The
+approximate size of the session's heavy state (UI messages, chat history,
+pending reply audio, cached transcript HTML) walks all of it, so it is only
+measured after each turn and on the SWEEP_INTERVAL_SECONDS tick of the
+session's own fragment. Totals and per-session sizes are exported as
+metrics, and the staff Diagnostics view lists the sessions.
+
+Streamlit keeps a session's state for as long as its tab stays open, so
+sessions idle for SESSION_EVICT_IDLE_MINUTES lose their heavy state. Sweeps
+(at most once every SWEEP_INTERVAL_SECONDS) only flag idle sessions; each
+session drops its own state in its own script thread, from a small
+fragment that reruns every SWEEP_INTERVAL_SECONDS (evict_if_requested).
+The conversation is already in the shared store (conversation_state.py)
+and the messages collection, and the next run, fragment rerun or callback
+of that tab rehydrates it from there (SessionHandler.ensure_resident).
+"""
+import os
+import sys
+import threading
+import time
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from metrics import REGISTRY
+
+SWEEP_INTERVAL_SECONDS = 60
+# Evicted sessions only keep small state; their entries are dropped after this long
+FORGET_AFTER_SECONDS = 24 * 3600
+
+# Session state keys measured, by component
+SESSION_COMPONENTS = {
+    "messages": "messages",
+    "chat_history": "chat_history",
+    "audio": "audio_response",
+    "html_cache": "transcript_html_cache"
+}
+# Keys removed from idle sessions; all of them are rebuilt by SessionHandler.ensure_resident
+EVICTED_KEYS = (
+    "messages",
+    "chat_history",
+    "transcript_html_cache",
+    "user_sessions"
+)
+# Keys read by every run, reset instead of removed
+CLEARED_KEYS = ("audio_response", "current_audio_container")
+
+session_state_bytes = REGISTRY.gauge(
+    "session_state_bytes",
+    "Approximate bytes of heavy state held by the tracked child sessions, by component"
+)
+tracked_sessions = REGISTRY.gauge(
+    "session_state_sessions",
+    "Tracked child browser sessions by status (resident, evicted)"
+)
+session_size_bytes = REGISTRY.histogram(
+    "session_state_session_bytes",
+    "Approximate heavy state of one child session, measured after each turn and on each sweep tick",
+    buckets=(16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+session_evictions = REGISTRY.counter(
+    "session_state_evictions_total",
+    "Idle child sessions whose heavy state was dropped"
+)
+session_rehydrations = REGISTRY.counter(
+    "session_state_rehydrations_total",
+    "Evicted child sessions rebuilt when their tab came back"
+)
+
+
+def idle_evict_seconds():
+    """Idle time before a session is evicted (read when used, so .env values apply)"""
+    return float(os.getenv("SESSION_EVICT_IDLE_MINUTES", "30")) * 60
+
+
+def approximate_size(value, _seen=None):
+    """Approximate bytes held by a value: containers, strings and chat messages, followed recursively"""
+    seen = _seen if _seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key, seen) + approximate_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(approximate_size(item, seen) for item in value)
+    elif hasattr(value, "content"):
+        # langchain messages
+        size += approximate_size(value.content, seen)
+    elif hasattr(value, "messages"):
+        # ChatMessageHistory
+        size += approximate_size(value.messages, seen)
+    return size
+
+
+def measure_session(state):
+    """Approximate bytes of each heavy component of a session state"""
+    return {
+        component: approximate_size(state[key]) if key in state and state[key] is not None else 0
+        for component, key in SESSION_COMPONENTS.items()
+    }
+
+
+def evict_session_state(state):
+    """Drop the heavy state of a session (only from its own script thread)"""
+    state["evicted_session_id"] = state["current_session_id"] if "current_session_id" in state else None
+    for key in EVICTED_KEYS:
+        if key in state:
+            del state[key]
+    for key in CLEARED_KEYS:
+        state[key] = None
+
+
+class SessionMemoryTracker:
+    """Sizes and last activity of the child sessions of this process"""
+
+    def __init__(self, idle_after=None, sweep_interval=SWEEP_INTERVAL_SECONDS):
+        # None: idle_evict_seconds() at each sweep
+        self.idle_after = idle_after
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def touch(self, session_key, user_id, now=None):
+        """Record activity of a session (a run, fragment rerun or callback), then sweep if it is time"""
+        now = now or time.time()
+        with self._lock:
+            entry = self._sessions.get(session_key)
+            # Activity cancels a pending eviction request; sizes stay as last measured
+            self._sessions[session_key] = {
+                "user_id": user_id,
+                "sizes": entry["sizes"] if entry else dict.fromkeys(SESSION_COMPONENTS, 0),
+                "last_active": now,
+                "evict_requested": False,
+                "evicted": False
+            }
+        self.maybe_sweep(now)
+
+    def record_sizes(self, session_key, sizes):
+        """Store a new measurement of a tracked session (not activity)"""
+        with self._lock:
+            entry = self._sessions.get(session_key)
+            if entry is None:
+                return
+            entry["sizes"] = sizes
+        session_size_bytes.observe(sum(sizes.values()))
+
+    def maybe_sweep(self, now=None):
+        now = now or time.time()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        else:
+            self._update_gauges()
+
+    def sweep(self, now=None):
+        """Flag the sessions idle for longer than idle_after for eviction; returns how many were flagged"""
+        now = now or time.time()
+        idle_after = self.idle_after if self.idle_after is not None else idle_evict_seconds()
+        flagged = 0
+        with self._lock:
+            self._last_sweep = now
+            for session_key, entry in list(self._sessions.items()):
+                idle = now - entry["last_active"]
+                if entry["evicted"]:
+                    if idle >= FORGET_AFTER_SECONDS:
+                        del self._sessions[session_key]
+                    continue
+                if entry["evict_requested"] or idle < idle_after or not any(entry["sizes"].values()):
+                    continue
+                entry["evict_requested"] = True
+                flagged += 1
+        self._update_gauges()
+        return flagged
+
+    def eviction_requested(self, session_key):
+        with self._lock:
+            entry = self._sessions.get(session_key)
+            return bool(entry and entry["evict_requested"])
+
+    def mark_evicted(self, session_key, sizes):
+        with self._lock:
+            entry = self._sessions.get(session_key)
+            if entry is not None:
+                entry.update(sizes=sizes, evict_requested=False, evicted=True)
+        session_evictions.inc()
+        self._update_gauges()
+
+    def snapshot(self, now=None):
+        """One row per tracked session, for the Diagnostics view"""
+        now = now or time.time()
+        with self._lock:
+            entries = list(self._sessions.items())
+        return [
+            {
+                "session": session_key[:8],
+                "user_id": entry["user_id"],
+                **entry["sizes"],
+                "total_bytes": sum(entry["sizes"].values()),
+                "idle_seconds": round(now - entry["last_active"]),
+                "evicted": entry["evicted"]
+            }
+            for session_key, entry in entries
+        ]
+
+    def _update_gauges(self):
+        with self._lock:
+            entries = list(self._sessions.values())
+        for component in SESSION_COMPONENTS:
+            session_state_bytes.set(sum(entry["sizes"][component] for entry in entries), component=component)
+        evicted = sum(1 for entry in entries if entry["evicted"])
+        tracked_sessions.set(len(entries) - evicted, status="resident")
+        tracked_sessions.set(evicted, status="evicted")
+
+
+session_tracker = SessionMemoryTracker()
+
+
+def track_session(user_id):
+    """Record activity of the current browser session in the process-wide tracker (constant cost)"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    session_tracker.touch(ctx.session_id, user_id)
+
+
+def measure_current_session():
+    """Measure the heavy state of the current browser session (walks all of it: once per turn or tick)"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    session_tracker.record_sizes(ctx.session_id, measure_session(st.session_state))
+
+
+def evict_if_requested():
+    """Sample this session's size, then drop its heavy state if a sweep flagged it.
+
+    Runs in the session's own script thread, on the _memory_watch tick.
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return False
+    measure_current_session()
+    session_tracker.maybe_sweep()
+    if not session_tracker.eviction_requested(ctx.session_id):
+        return False
+    evict_session_state(st.session_state)
+    session_tracker.mark_evicted(ctx.session_id, measure_session(st.session_state))
+    return True
@@ -0,0 +1,200 @@
+"""Signed, expiring login tokens kept in a browser cookie.
+
+After a login the browser gets a cookie holding the user id, user type and
+expiry, signed with HMAC-SHA256 (SESSION_TOKEN_SECRET). When a refresh or
+reconnect starts a new Streamlit session, the token is read from the
+request cookies and its signature and expiry are checked locally. user_info
+comes from a small in-process cache filled at login, and only a cache miss
+(e.g. after a server restart) reads the user by id.
+
+Every replica must verify the tokens of the others, so SESSION_TOKEN_SECRET
+is required: without it the app refuses to start. Only the in-process
+backends (STORAGE_BACKEND=memory or mongomock), whose data cannot be shared
+anyway, fall back to a random per-process secret. The secret and the TTL
+are read on first use, after main.py has loaded .env.
+
+Logging out clears the cookie and revokes the token: the signature is stored
+in the storage backend until the token would have expired (a TTL index on
+MongoDB), so restore_login refuses it on every replica.
+
+The cookie is written from JavaScript (Streamlit cannot set response
+headers), so it cannot be HttpOnly: a script injected into the page could
+read it. It is SameSite=Strict, Secure over HTTPS and short-lived.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+import streamlit as st
+from db_operations import find_user_by_id, is_session_token_revoked, revoke_session_token
+
+COOKIE_NAME = "asd_session"
+USER_CACHE_SIZE = 1024
+
+# Backends that live inside one process, where a per-process secret is enough
+IN_PROCESS_BACKENDS = ("memory", "mongomock")
+
+# The fields of user_info kept in session state (see auth.login)
+USER_INFO_FIELDS = ("user_id", "name", "email", "user_type", "age")
+
+_secret = None
+_secret_lock = threading.Lock()
+
+
+def token_ttl_seconds():
+    """Lifetime of new tokens (read when used, so .env values apply)"""
+    return int(float(os.getenv("SESSION_TOKEN_TTL_HOURS", "12")) * 3600)
+
+
+def _get_secret():
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            secret = os.getenv("SESSION_TOKEN_SECRET")
+            if secret:
+                _secret = secret.encode()
+            elif os.getenv("STORAGE_BACKEND", "mongodb").strip().lower() in IN_PROCESS_BACKENDS:
+                _secret = secrets.token_bytes(32)
+            else:
+                raise RuntimeError(
+                    "SESSION_TOKEN_SECRET is not set. Every server must share it to accept the others' "
+                    "login tokens. Please check your .env file."
+                )
+        return _secret
+
+
+def check_token_secret():
+    """Raise RuntimeError if no token secret is configured (called at startup)"""
+    _get_secret()
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return _b64encode(hmac.new(_get_secret(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_info, ttl=None, now=None):
+    """Signed token for a logged-in user"""
+    now = int(now or time.time())
+    ttl = ttl or token_ttl_seconds()
+    payload = _b64encode(json.dumps(
+        {"uid": user_info["user_id"], "typ": user_info["user_type"], "iat": now, "exp": now + ttl},
+        separators=(",", ":")
+    ).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token, now=None):
+    """Claims of a valid, unexpired token, or None"""
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (AttributeError, ValueError):
+        return None
+    if claims.get("exp", 0) <= (now or time.time()):
+        return None
+    return claims
+
+
+class UserCache:
+    """Thread-safe LRU of user_info dicts by user id, shared by all browser sessions"""
+
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            user_info = self._users.get(user_id)
+            if user_info is not None:
+                self._users.move_to_end(user_id)
+            return user_info
+
+    def put(self, user_info):
+        with self._lock:
+            self._users[user_info["user_id"]] = dict(user_info)
+            self._users.move_to_end(user_info["user_id"])
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+
+user_cache = UserCache()
+
+
+def revoke_token(db, token):
+    """Make a token fail restore_login on every replica from now on"""
+    claims = verify_token(token)
+    if claims is not None:
+        revoke_session_token(db, token.split(".")[1], claims["exp"])
+
+
+def remember_login(user_info):
+    """Cache the user and queue the token cookie to be written on the next render"""
+    user_cache.put(user_info)
+    token = issue_token(user_info)
+    st.session_state.session_token = token
+    st.session_state.pending_session_token = token
+
+
+def forget_login(db):
+    """Revoke the session's token and queue the cookie to be cleared on the next render"""
+    # A session restored from the cookie may not have the token in its state yet
+    revoke_token(db, st.session_state.pop("session_token", None) or st.context.cookies.get(COOKIE_NAME))
+    st.session_state.pop("pending_session_token", None)
+    st.session_state.clear_session_cookie = True
+
+
+def restore_login(db):
+    """Log the browser session back in from its token cookie; returns True if it did"""
+    token = st.context.cookies.get(COOKIE_NAME)
+    claims = verify_token(token)
+    if claims is None or is_session_token_revoked(db, token.split(".")[1], time.time()):
+        return False
+
+    user_info = user_cache.get(claims["uid"])
+    if user_info is None:
+        user = find_user_by_id(db, claims["uid"])
+        if user is None:
+            return False
+        user_info = {field: user.get(field) for field in USER_INFO_FIELDS}
+        user_cache.put(user_info)
+    if user_info["user_type"] != claims["typ"]:
+        return False
+
+    st.session_state.logged_in = True
+    st.session_state.user_info = dict(user_info)
+    st.session_state.session_token = token
+    return True
+
+
+def _cookie_script(value, max_age):
+    return f"""
+        <script>
+            document.cookie = "{COOKIE_NAME}={value}; Max-Age={max_age}; Path=/; SameSite=Strict"
+                + (location.protocol === "https:" ? "; Secure" : "");
+        </script>
+    """
+
+
+def sync_session_cookie():
+    """Write or clear the token cookie if a login or logout asked for it"""
+    token = st.session_state.pop("pending_session_token", None)
+    if token:
+        st.html(_cookie_script(token, token_ttl_seconds()), unsafe_allow_javascript=True)
+    elif st.session_state.pop("clear_session_cookie", False):
+        st.html(_cookie_script("", 0), unsafe_allow_javascript=True)
@@ -1,23 +1,72 @@
 import streamlit as st
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
 from auth import logout
 from db_operations import (
     get_children, 
     load_user_sessions, 
+    load_user_sessions_in_range,
     load_session_messages,
+    iter_session_messages,
+    load_turn_timings,
+    load_child_metrics,
     delete_session
 )
-from pdf_generator import PDFGenerator
+from pdf_generator import PDFGenerator, create_sessions_zip, render_session_pdf, session_content_hash
+from diagnostics import display_diagnostics_panel
+from turn_tracing import summarize_turn_timings
+from live_tail import MessageTailer
+from analytics import run_metrics_job, vocabulary_growth
+from search import TranscriptIndex, search_transcripts
+from roster import read_roster, import_roster, validate_roster
+
+# Messages per unchanging transcript block of the live view
+LIVE_BLOCK_SIZE = 40
+
+def bulk_export_max_bytes():
+    """Largest ZIP the bulk export serves: Streamlit holds a download in memory (read when used, so .env values apply)"""
+    return int(float(os.getenv("BULK_EXPORT_MAX_MB", "200")) * 1024 * 1024)
+
+def live_tail_interval():
+    """Seconds between live view refreshes (read when used, so .env values apply)"""
+    return float(os.getenv("STAFF_LIVE_INTERVAL_SECONDS", "2"))
 
 def display_staff_page(db):
     """Main staff page with conversation viewing and PDF download"""
     # Sidebar
     st.sidebar.title(f"Welcome, {st.session_state.user_info.get('name', 'User')}")
+    # Only the selected view is rendered on each rerun
+    view = st.sidebar.radio("View", ["Conversations", "Search", "Analytics", "Roster", "Diagnostics"], key="staff_view")
     if st.sidebar.button("Logout"):
-        logout()
+        _close_tailers()
+        logout(db)
         st.rerun()
     
     # Main content
     st.title("Staff Dashboard")
+    
+    if view != "Conversations":
+        # Live views only exist in the Conversations view
+        _close_tailers()
+    
+    if view == "Diagnostics":
+        display_diagnostics_panel()
+        return
+    
+    if view == "Search":
+        display_search(db)
+        return
+    
+    if view == "Analytics":
+        display_analytics(db)
+        return
+    
+    if view == "Roster":
+        display_roster_import(db)
+        return
+    
     st.write("View client conversations, download as PDF, and manage sessions")
     
     # Fix: Pass the db parameter instead of undefined db_ops
@@ -59,94 +108,346 @@ def display_conversations(db):
         # Display sessions count
         st.write(f"Total sessions: {len(sessions)}")
         
-        for session in sessions:
-            if not session.get("session_id"):
-                continue
-                
-            session_id = session["session_id"]
-            session_title = session.get("title", "Untitled Session")
-            session_date = session.get("created_at", "Unknown Date")
+        # Bulk export of all sessions in a date range as one ZIP of PDFs
+        with st.expander("📦 Export sessions as PDF (ZIP)"):
+            display_bulk_export(db, client_id, selected_client)
+        
+        # Summaries come with the session list (summarizer.py), no transcript is loaded
+        summarized = [session for session in sessions if session.get("summary")]
+        if summarized:
+            with st.expander(f"📝 Session summaries ({len(summarized)}/{len(sessions)})"):
+                st.markdown("\n\n".join(_summary_markdown(session) for session in summarized))
+        
+        # Latency summary is only queried when requested
+        if st.checkbox("⏱️ Show turn latency (p50/p95)", key=f"latency_{client_id}"):
+            display_turn_latency(db, sessions)
+        
+        # Only the picked session is loaded and rendered, whatever the history size
+        sessions_by_id = {session["session_id"]: session for session in sessions if session.get("session_id")}
+        if st.session_state.get(f"selected_session_{client_id}") not in sessions_by_id:
+            # The picked session was deleted or fell out of the list
+            st.session_state.pop(f"selected_session_{client_id}", None)
+        selected_session_id = st.selectbox(
+            "Open a session:",
+            list(sessions_by_id),
+            index=None,
+            format_func=lambda session_id: _session_label(sessions_by_id[session_id]),
+            placeholder="Choose a session to read its transcript",
+            key=f"selected_session_{client_id}"
+        )
+        # Another session or client was picked: stop following the previous one
+        _close_tailers(keep=selected_session_id)
+        if selected_session_id:
+            display_session_detail(db, sessions_by_id[selected_session_id], selected_client)
+                    
+    except Exception as e:
+        st.error(f"Error: {str(e)}")
+
+def _session_label(session):
+    return f"{session.get('title', 'Untitled Session')} ({session.get('created_at', 'Unknown Date')})"
+
+def _summary_markdown(session):
+    text = f"**{_session_label(session)}**  \n{session['summary']}"
+    if session.get("topics"):
+        text += f"  \n*Topics: {', '.join(session['topics'])}*"
+    return text
+
+def _transcript_markdown(messages, client_name):
+    lines = []
+    for message in messages:
+        role = message.get("role", "")
+        content = message.get("content", "")
+        
+        if role == "user":
+            lines.append(f"**{client_name}:** {content}")
+        elif role == "assistant":
+            lines.append(f"**Therapist:** {content}")
+    return "\n\n".join(lines)
+
+def display_live_session(db, session_id, client_name):
+    """Follow a session: finished blocks render once, a fragment reruns every live_tail_interval() seconds for the rest"""
+    tailer = st.session_state.get(f"tailer_{session_id}")
+    if tailer is None:
+        tailer = st.session_state[f"tailer_{session_id}"] = MessageTailer(db, session_id)
+    else:
+        tailer.poll()
+    
+    finished = len(tailer.messages) // LIVE_BLOCK_SIZE * LIVE_BLOCK_SIZE
+    for block_start in range(0, finished, LIVE_BLOCK_SIZE):
+        st.markdown(_transcript_markdown(tailer.messages[block_start:block_start + LIVE_BLOCK_SIZE], client_name))
+    interval = live_tail_interval()
+    st.fragment(_live_session_tick, run_every=interval)(tailer, finished, client_name, interval)
+
+def _live_session_tick(tailer, finished, client_name, interval):
+    """Render the messages after the finished blocks (only this fragment reruns)"""
+    tailer.poll()
+    messages = tailer.messages
+    if len(messages) - finished >= LIVE_BLOCK_SIZE:
+        # Another block is finished: move it out of the fragment with one full rerun
+        st.rerun()
+    if not messages:
+        st.info("Waiting for the first message...")
+    elif len(messages) > finished:
+        st.markdown(_transcript_markdown(messages[finished:], client_name))
+    st.caption(f"Live · {len(messages)} messages · refreshing every {interval:g}s via {tailer.source}")
+
+def _close_tailer(session_id):
+    """Stop following a session: close its change stream before dropping the tailer"""
+    tailer = st.session_state.pop(f"tailer_{session_id}", None)
+    if tailer is not None:
+        tailer.close()
+
+def _close_tailers(keep=None):
+    """Close the tailers of every followed session except keep (on logout, view, client or session change)"""
+    for key in [key for key in st.session_state if key.startswith("tailer_")]:
+        if key != f"tailer_{keep}":
+            _close_tailer(key[len("tailer_"):])
+
+def _set_delete_confirmation(session_id, pending):
+    """Button callback: show or hide the delete confirmation of a session"""
+    if pending:
+        st.session_state[f"confirm_delete_{session_id}"] = True
+    else:
+        st.session_state.pop(f"confirm_delete_{session_id}", None)
+
+@st.fragment
+def display_session_detail(db, session, selected_client):
+    """Transcript and actions of one session (its buttons rerun only this pane)"""
+    session_id = session["session_id"]
+    session_title = session.get("title", "Untitled Session")
+    
+    with st.container(border=True):
+        st.subheader(_session_label(session))
+        if session.get("summary"):
+            st.info(session["summary"] + (f"\n\n**Topics:** {', '.join(session['topics'])}" if session.get("topics") else ""))
+        
+        # Follow a session that is still in progress without reloading it
+        if st.toggle("🔴 Follow live", key=f"live_{session_id}"):
+            display_live_session(db, session_id, selected_client)
+            return
+        _close_tailer(session_id)
+        
+        # Get and display messages
+        messages = load_session_messages(db, session_id, session)
+        
+        if messages:
+            # Display conversation as a single markdown block instead of one element per message
+            st.markdown(_transcript_markdown(messages, selected_client))
             
-            with st.expander(f"{session_title} ({session_date})"):
-                # Get and display messages - Fix: Use db parameter directly
-                messages = load_session_messages(db, session_id)
+            # Action buttons in columns
+            st.markdown("---")
+            col1, col2, col3 = st.columns([1, 1, 2])
+            
+            with col1:
+                # PDF download button
+                if st.button(f"📄 Download PDF", key=f"pdf_{session_id}"):
+                    generate_pdf(messages, selected_client, session_title, db=db, session_id=session_id,
+                                 summary=session)
+            
+            with col2:
+                # Delete button with confirmation
+                # Store the session to delete in session state for confirmation
+                st.button(f"🗑️ Delete Session", key=f"delete_{session_id}", type="secondary",
+                          on_click=_set_delete_confirmation, args=(session_id, True))
+            
+            # Confirmation dialog
+            if st.session_state.get(f"confirm_delete_{session_id}", False):
+                st.warning("⚠️ **Are you sure you want to delete this session?**")
+                st.write("This action will permanently delete:")
+                st.write(f"- Session: {session_title}")
+                st.write(f"- All {len(messages)} messages in this session")
+                st.write("**This action cannot be undone!**")
                 
-                if messages:
-                    # Display conversation
-                    for message in messages:
-                        role = message.get("role", "")
-                        content = message.get("content", "")
-                        
-                        if role == "system":
-                            continue
-                        elif role == "user":
-                            st.markdown(f"**{selected_client}:** {content}")
-                        elif role == "assistant":
-                            st.markdown(f"**Therapist:** {content}")
-                    
-                    # Action buttons in columns
-                    st.markdown("---")
-                    col1, col2, col3 = st.columns([1, 1, 2])
-                    
-                    with col1:
-                        # PDF download button
-                        if st.button(f"📄 Download PDF", key=f"pdf_{session_id}"):
-                            generate_pdf(messages, selected_client, session_title)
-                    
-                    with col2:
-                        # Delete button with confirmation
-                        if st.button(f"🗑️ Delete Session", key=f"delete_{session_id}", type="secondary"):
-                            # Store the session to delete in session state for confirmation
-                            st.session_state[f"confirm_delete_{session_id}"] = True
-                            st.rerun()
-                    
-                    # Confirmation dialog
-                    if st.session_state.get(f"confirm_delete_{session_id}", False):
-                        st.warning("⚠️ **Are you sure you want to delete this session?**")
-                        st.write("This action will permanently delete:")
-                        st.write(f"- Session: {session_title}")
-                        st.write(f"- All {len(messages)} messages in this session")
-                        st.write("**This action cannot be undone!**")
-                        
-                        col_confirm, col_cancel = st.columns([1, 1])
-                        
-                        with col_confirm:
-                            if st.button("✅ Yes, Delete", key=f"confirm_yes_{session_id}", type="primary"):
-                                handle_session_deletion(db, session_id, session_title)
-                                
-                        with col_cancel:
-                            if st.button("❌ Cancel", key=f"confirm_no_{session_id}"):
-                                # Remove confirmation state
-                                if f"confirm_delete_{session_id}" in st.session_state:
-                                    del st.session_state[f"confirm_delete_{session_id}"]
-                                st.rerun()
-                else:
-                    st.info("No messages found")
-                    
-                    # Even empty sessions can be deleted
-                    st.markdown("---")
-                    if st.button(f"🗑️ Delete Empty Session", key=f"delete_empty_{session_id}", type="secondary"):
-                        st.session_state[f"confirm_delete_{session_id}"] = True
-                        st.rerun()
-                    
-                    # Confirmation for empty sessions
-                    if st.session_state.get(f"confirm_delete_{session_id}", False):
-                        st.warning("⚠️ **Delete this empty session?**")
+                col_confirm, col_cancel = st.columns([1, 1])
+                
+                with col_confirm:
+                    if st.button("✅ Yes, Delete", key=f"confirm_yes_{session_id}", type="primary"):
+                        handle_session_deletion(db, session_id, session_title)
                         
-                        col_confirm, col_cancel = st.columns([1, 1])
+                with col_cancel:
+                    # Remove confirmation state
+                    st.button("❌ Cancel", key=f"confirm_no_{session_id}",
+                              on_click=_set_delete_confirmation, args=(session_id, False))
+        else:
+            st.info("No messages found")
+            
+            # Even empty sessions can be deleted
+            st.markdown("---")
+            st.button(f"🗑️ Delete Empty Session", key=f"delete_empty_{session_id}", type="secondary",
+                      on_click=_set_delete_confirmation, args=(session_id, True))
+            
+            # Confirmation for empty sessions
+            if st.session_state.get(f"confirm_delete_{session_id}", False):
+                st.warning("⚠️ **Delete this empty session?**")
+                
+                col_confirm, col_cancel = st.columns([1, 1])
+                
+                with col_confirm:
+                    if st.button("✅ Yes, Delete", key=f"confirm_yes_empty_{session_id}", type="primary"):
+                        handle_session_deletion(db, session_id, session_title)
                         
-                        with col_confirm:
-                            if st.button("✅ Yes, Delete", key=f"confirm_yes_empty_{session_id}", type="primary"):
-                                handle_session_deletion(db, session_id, session_title)
-                                
-                        with col_cancel:
-                            if st.button("❌ Cancel", key=f"confirm_no_empty_{session_id}"):
-                                if f"confirm_delete_{session_id}" in st.session_state:
-                                    del st.session_state[f"confirm_delete_{session_id}"]
-                                st.rerun()
-                    
+                with col_cancel:
+                    st.button("❌ Cancel", key=f"confirm_no_empty_{session_id}",
+                              on_click=_set_delete_confirmation, args=(session_id, False))
+
+@st.cache_resource
+def _get_transcript_index():
+    """In-process index for backends without a server-side text index, shared by all staff"""
+    return TranscriptIndex()
+
+def _open_search_result(session_id):
+    st.session_state.search_open_session = session_id
+
+def display_search(db):
+    """Find sessions by what was said in them, across all children"""
+    st.subheader("Search transcripts")
+    children = [child for child in get_children(db) if child.get("name")]
+    names = {child["user_id"]: child["name"] for child in children if child.get("user_id")}
+    
+    query = st.text_input("Words to find", placeholder="e.g. dinosaurio, canción, colegio", key="search_query")
+    col1, col2 = st.columns(2)
+    with col1:
+        child_ids = st.multiselect("Children", list(names), format_func=names.get, key="search_children",
+                                   placeholder="All children")
+    with col2:
+        date_range = st.date_input("Session dates", value=(), key="search_range")
+    
+    if not query.strip():
+        st.session_state.pop("search_open_session", None)
+        return
+    
+    start = end = None
+    if isinstance(date_range, tuple) and len(date_range) == 2:
+        start = datetime.combine(date_range[0], time.min)
+        end = datetime.combine(date_range[1] + timedelta(days=1), time.min)
+    
+    try:
+        results = search_transcripts(db, query, child_ids or None, start, end, index=_get_transcript_index())
     except Exception as e:
-        st.error(f"Error: {str(e)}")
+        st.error(f"Search failed: {str(e)}")
+        return
+    
+    if not results:
+        st.info("No sessions match these words")
+        return
+    
+    st.write(f"**{len(results)} sessions found**")
+    for result in results:
+        with st.container(border=True):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.markdown(
+                    f"**{result['title']}** · {names.get(result['user_id'], 'Unknown')} · "
+                    f"{result['created_at'] or 'Unknown Date'} · score {result['score']:.2f}"
+                )
+                st.markdown(result["snippet"])
+            with col2:
+                st.button("Open", key=f"search_open_{result['session_id']}",
+                          on_click=_open_search_result, args=(result["session_id"],))
+    
+    # The opened session keeps its transcript and actions below the results
+    opened = next((r for r in results if r["session_id"] == st.session_state.get("search_open_session")), None)
+    if opened:
+        session = {key: opened[key] for key in ("session_id", "user_id", "title", "created_at", "summary", "topics")}
+        display_session_detail(db, session, names.get(opened["user_id"], "Client"))
+
+def display_analytics(db):
+    """Per-child progress over time, read from the precomputed child_metrics"""
+    st.subheader("Progress analytics")
+    children = [child for child in get_children(db) if child.get("name")]
+    if not children:
+        st.info("No children registered")
+        return
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        child = st.selectbox("Select a client:", children, format_func=lambda child: child["name"], key="analytics_client")
+    with col2:
+        # The job normally runs on a schedule (python analytics.py); this catches up on demand
+        if st.button("🔄 Update metrics", key="analytics_refresh"):
+            try:
+                with st.spinner("Updating metrics..."):
+                    updated = run_metrics_job(db)
+                st.success(f"Updated {updated} sessions")
+            except Exception as e:
+                st.error(f"Error updating metrics: {str(e)}")
+    
+    metrics = vocabulary_growth(load_child_metrics(db, child["user_id"]))
+    if metrics.empty:
+        st.info("No metrics yet for this client. Run the metrics job to compute them.")
+        return
+    
+    metrics = metrics.set_index("session_date")
+    latest = metrics.iloc[-1]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Sessions", len(metrics))
+    col2.metric("Vocabulary", int(latest["cumulative_vocabulary"]), int(latest["new_words"]))
+    col3.metric("Words per turn (last)", round(latest["mlu_words"] or 0, 2))
+    col4.metric("Voice turns", f"{metrics['voice_share'].mean():.0%}")
+    
+    st.markdown("**Turns per session**")
+    st.line_chart(metrics["turns"])
+    st.markdown("**Mean length of utterance (words)**")
+    st.line_chart(metrics["mlu_words"])
+    st.markdown("**Vocabulary: cumulative and new words**")
+    st.line_chart(metrics[["cumulative_vocabulary", "new_words"]])
+    st.markdown("**Response latency (ms)**")
+    st.line_chart(metrics[["latency_ms_mean", "latency_ms_p95"]])
+    st.markdown("**Voice turns and generated images**")
+    st.bar_chart(metrics[["voice_turns", "images"]])
+
+def display_roster_import(db):
+    """Create many child/staff accounts from a CSV or JSON file"""
+    st.subheader("Import accounts")
+    st.caption("Columns: name, email, user_type (child/staff), age (children), password (optional)")
+    uploaded = st.file_uploader("Roster file", type=["csv", "json"], key="roster_file")
+    if uploaded is None:
+        return
+    
+    try:
+        frame = read_roster(uploaded.getvalue(), uploaded.name)
+    except Exception as e:
+        st.error(f"Could not read the roster: {str(e)}")
+        return
+    
+    checked = validate_roster(frame)
+    invalid = checked[checked["error"] != ""]
+    st.write(f"{len(checked)} rows, {len(checked) - len(invalid)} valid")
+    if not invalid.empty:
+        st.dataframe(invalid[["row", "name", "email", "error"]], use_container_width=True, hide_index=True)
+    
+    if st.button("Create accounts", key="roster_import", disabled=len(invalid) == len(checked)):
+        try:
+            progress = st.progress(0.0)
+            report = import_roster(db, frame, progress=progress.progress)
+        except Exception as e:
+            st.error(f"Import failed: {str(e)}")
+            return
+        counts = report["status"].value_counts()
+        st.success(
+            f"Created {counts.get('created', 0)} accounts · "
+            f"{counts.get('duplicate', 0)} already registered · {counts.get('invalid', 0)} invalid"
+        )
+        st.dataframe(report, use_container_width=True, hide_index=True)
+        # Includes the temporary passwords, so it is only offered as a download right after the import
+        st.download_button(
+            "⬇️ Download report",
+            data=report.to_csv(index=False).encode("utf-8"),
+            file_name=f"roster_report_{datetime.now():%Y%m%d_%H%M}.csv",
+            mime="text/csv",
+            key="roster_report"
+        )
+
+def display_turn_latency(db, sessions):
+    """Summarize the per-stage turn timings of a client's sessions as p50/p95"""
+    timings = load_turn_timings(db, [session["session_id"] for session in sessions if session.get("session_id")])
+    rows = summarize_turn_timings(timings)
+    
+    if not rows:
+        st.info("No timing data recorded for these sessions yet")
+        return
+    
+    st.dataframe(rows, use_container_width=True, hide_index=True)
 
 def handle_session_deletion(db, session_id, session_title):
     """Handle the session deletion process"""
@@ -162,8 +463,8 @@ def handle_session_deletion(db, session_id, session_title):
             if f"confirm_delete_{session_id}" in st.session_state:
                 del st.session_state[f"confirm_delete_{session_id}"]
             
-            # Refresh the page to show updated session list
-            st.rerun()
+            # Refresh the whole page to show updated session list
+            st.rerun(scope="app")
             
         else:
             st.error(f"❌ Failed to delete session: {result.get('error', 'Unknown error')}")
@@ -171,20 +472,45 @@ def handle_session_deletion(db, session_id, session_title):
     except Exception as e:
         st.error(f"❌ Error during deletion: {str(e)}")
 
-def generate_pdf(messages, client_name, session_title):
+@st.cache_data(max_entries=64, show_spinner=False)
+def _render_pdf_cached(content_hash, _messages, client_name, session_title, _summary=None):
+    """Render a session PDF once per content hash (_messages and _summary are not hashed by Streamlit)"""
+    return render_session_pdf(_messages, client_name, session_title, _summary)
+
+@st.cache_resource
+def _get_pdf_executor():
+    """Process pool shared by all staff sessions for bulk PDF rendering"""
+    # spawn avoids forking the multi-threaded Streamlit server process
+    return ProcessPoolExecutor(max_workers=max(1, min(4, multiprocessing.cpu_count() - 1)),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+def _pdf_summary(session):
+    """The summary fields of a session document, or None if it has not been summarized"""
+    if not session or not session.get("summary"):
+        return None
+    return {"summary": session["summary"], "topics": session.get("topics") or []}
+
+# Sessions at least this long are rendered from a DB cursor only when the download is clicked
+STREAMING_PDF_MIN_MESSAGES = 500
+
+def generate_pdf(messages, client_name, session_title, db=None, session_id=None, summary=None):
     """Generate and provide PDF download"""
+    summary = _pdf_summary(summary)
+    if db is not None and session_id and len(messages) >= STREAMING_PDF_MIN_MESSAGES:
+        generate_pdf_streaming(db, session_id, client_name, session_title, summary)
+        return
+    
     try:
-        pdf_generator = PDFGenerator()
-        
         with st.spinner("Generating PDF..."):
-            # Create PDF
-            pdf_buffer = pdf_generator.create_pdf(messages, client_name, session_title)
-            filename = pdf_generator.create_filename(client_name, session_title)
+            # Create PDF (re-clicks and unchanged sessions are served from the cache)
+            content_hash = session_content_hash(messages, client_name, session_title, summary)
+            pdf_bytes = _render_pdf_cached(content_hash, messages, client_name, session_title, summary)
+            filename = PDFGenerator().create_filename(client_name, session_title)
             
             # Download button
             st.download_button(
                 label="⬇️ Download PDF",
-                data=pdf_buffer.getvalue(),
+                data=pdf_bytes,
                 file_name=filename,
                 mime="application/pdf"
             )
@@ -192,4 +518,100 @@ def generate_pdf(messages, client_name, session_title):
         st.success("PDF ready for download!")
         
     except Exception as e:
-        st.error(f"PDF generation failed: {str(e)}")
\ No newline at end of file
+        st.error(f"PDF generation failed: {str(e)}")
+
+def _read_and_close(file):
+    """Contents of a temporary file, which is closed (and deleted) afterwards"""
+    with file:
+        return file.read()
+
+def generate_pdf_streaming(db, session_id, client_name, session_title, summary=None):
+    """Offer a long session as a PDF rendered from a DB cursor when the download is clicked"""
+    pdf_generator = PDFGenerator()
+    
+    def render_pdf():
+        # Runs on click: the page run never holds the PDF, and the temp file is removed once read
+        return _read_and_close(pdf_generator.create_pdf_file(
+            iter_session_messages(db, session_id),
+            client_name,
+            session_title,
+            summary=summary
+        ))
+    
+    st.download_button(
+        label="⬇️ Download PDF",
+        data=render_pdf,
+        file_name=pdf_generator.create_filename(client_name, session_title),
+        mime="application/pdf"
+    )
+    st.caption("Long session: the PDF is generated when you click download.")
+
+def display_bulk_export(db, client_id, client_name):
+    """Render every session of a client in a date range into one ZIP of PDFs"""
+    today = datetime.now().date()
+    date_range = st.date_input(
+        "Date range",
+        value=(today - timedelta(days=30), today),
+        key=f"export_range_{client_id}"
+    )
+    if not isinstance(date_range, tuple) or len(date_range) != 2:
+        st.info("Select a start and an end date")
+        return
+    
+    summaries_only = st.checkbox(
+        "Summaries only (skip transcripts)",
+        key=f"export_summaries_{client_id}",
+        help="Much faster: only the summaries stored on the sessions are rendered"
+    )
+    
+    if st.button("Build ZIP", key=f"export_zip_{client_id}"):
+        start = datetime.combine(date_range[0], time.min)
+        end = datetime.combine(date_range[1] + timedelta(days=1), time.min)
+        sessions = load_user_sessions_in_range(db, client_id, start, end)
+        
+        if not sessions:
+            st.info("No sessions in this date range")
+            return
+        
+        # Transcripts are loaded one session at a time as the pool has room for them
+        if summaries_only:
+            jobs = (
+                (session["session_id"], session.get("title", "Untitled Session"), [], _pdf_summary(session))
+                for session in sessions
+                if session.get("summary")
+            )
+        else:
+            jobs = (
+                (session["session_id"], session.get("title", "Untitled Session"), messages, _pdf_summary(session))
+                for session in sessions
+                for messages in [load_session_messages(db, session["session_id"], session)]
+                if messages
+            )
+        
+        try:
+            with st.spinner(f"Rendering up to {len(sessions)} PDFs..."):
+                archive_file = create_sessions_zip(_get_pdf_executor(), jobs, client_name)
+            
+            # The download is held in server memory, so oversized archives are refused
+            archive_size = archive_file.seek(0, os.SEEK_END)
+            if archive_size > bulk_export_max_bytes():
+                archive_file.close()
+                st.error(
+                    f"The ZIP would be {archive_size / 1024 / 1024:.1f} MB, over the "
+                    f"{bulk_export_max_bytes() / 1024 / 1024:.1f} MB limit (BULK_EXPORT_MAX_MB). "
+                    "Choose a shorter date range, export summaries only, or use data_export.py for large exports."
+                )
+                return
+            archive_file.seek(0)
+            archive = _read_and_close(archive_file)
+            
+            safe_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '-', '_')).strip()
+            st.download_button(
+                label="⬇️ Download ZIP",
+                data=archive,
+                file_name=f"{safe_name}_{date_range[0]:%Y%m%d}-{date_range[1]:%Y%m%d}.zip",
+                mime="application/zip",
+                key=f"export_download_{client_id}"
+            )
+        except Exception as e:
+            st.error(f"ZIP export failed: {str(e)}")
@@ -0,0 +1,1156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Message storage layouts (MongoDB only):
+# - "documents": one document per chat line in the "messages" collection
+# - "buckets": up to MESSAGE_BUCKET_SIZE chat lines per document in "message_buckets"
+MESSAGE_LAYOUT_DOCUMENTS = "documents"
+MESSAGE_LAYOUT_BUCKETS = "buckets"
+DEFAULT_MESSAGE_BUCKET_SIZE = 50
+
+def get_message_layout():
+    """Return the configured message storage layout (read at call time so .env is loaded)"""
+    layout = os.getenv("MESSAGE_LAYOUT", MESSAGE_LAYOUT_DOCUMENTS).strip().lower()
+    if layout not in (MESSAGE_LAYOUT_DOCUMENTS, MESSAGE_LAYOUT_BUCKETS):
+        return MESSAGE_LAYOUT_DOCUMENTS
+    return layout
+
+def get_message_bucket_size():
+    """Return the maximum number of messages stored in a single bucket document"""
+    try:
+        return max(1, int(os.getenv("MESSAGE_BUCKET_SIZE", DEFAULT_MESSAGE_BUCKET_SIZE)))
+    except ValueError:
+        return DEFAULT_MESSAGE_BUCKET_SIZE
+
+def build_buckets(session_id, messages_list, bucket_size=None):
+    """Group a session's ordered messages into bucket documents (used for migrations)"""
+    bucket_size = bucket_size or get_message_bucket_size()
+    buckets = []
+
+    for start in range(0, len(messages_list), bucket_size):
+        chunk = messages_list[start:start + bucket_size]
+        timestamps = [msg["timestamp"] for msg in chunk]
+        buckets.append({
+            "bucket_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "count": len(chunk),
+            "first_timestamp": min(timestamps),
+            "last_timestamp": max(timestamps),
+            "messages": chunk,
+            "open": False
+        })
+    if buckets:
+        # Later appends only go to the newest bucket (see MongoBackend.append_to_buckets)
+        buckets[-1]["open"] = True
+    return buckets
+
+def setup_bucket_indexes(db):
+    """Create the index used to read a session's buckets in order"""
+    existing_bucket_indexes = db["message_buckets"].list_indexes()
+    bucket_index_names = [idx["name"] for idx in existing_bucket_indexes]
+
+    if "session_id_1_first_timestamp_1" not in bucket_index_names:
+        db["message_buckets"].create_index([("session_id", 1), ("first_timestamp", 1)])
+    if "messages_content_text" not in bucket_index_names:
+        db["message_buckets"].create_index(
+            [("messages.content", "text")], name="messages_content_text", default_language="spanish"
+        )
+
+
+class DuplicateUserError(Exception):
+    """Raised when a user with the same email already exists"""
+
+
+def normalize_email(email):
+    """Form in which emails are stored and looked up, so the unique index ignores case"""
+    return (email or "").strip().lower()
+
+
+class StorageBackend:
+    """Repository interface for users, sessions and messages.
+
+    All application data access goes through db_operations, which delegates
+    to one of these backends. Documents are plain dicts shaped like the
+    MongoDB documents the app has always stored.
+    """
+
+    name = "base"
+
+    def setup_indexes(self):
+        """Create any indexes or tables the backend needs"""
+
+    # ---------- users ----------
+
+    def find_user_by_email(self, email):
+        raise NotImplementedError
+
+    def find_user_by_credentials(self, email, password_hash):
+        raise NotImplementedError
+
+    def find_user_by_id(self, user_id):
+        raise NotImplementedError
+
+    def insert_user(self, user_doc):
+        """Insert a user, raising DuplicateUserError if the email is taken"""
+        raise NotImplementedError
+
+    def insert_users(self, user_docs):
+        """Insert many users, skipping taken emails; returns the positions of the skipped docs"""
+        raise NotImplementedError
+
+    def list_children(self):
+        raise NotImplementedError
+
+    # ---------- sessions ----------
+
+    def insert_session(self, session_doc):
+        raise NotImplementedError
+
+    def list_user_sessions(self, user_id, limit=50, start=None, end=None):
+        """Return the newest sessions of a user, newest first.
+
+        start/end optionally bound created_at (inclusive start, exclusive end);
+        limit=None returns every matching session.
+        """
+        raise NotImplementedError
+
+    def iter_sessions(self, user_ids=None, start=None, end=None, after=None, batch_size=500, archived=None):
+        """Yield full session documents oldest first, ordered by (created_at, session_id).
+
+        user_ids restricts to some users (None = all), start/end bound
+        created_at and after=(created_at, session_id) resumes after a session.
+        archived=True/False keeps only sessions with/without an archive (None = all).
+        """
+        raise NotImplementedError
+
+    def update_session(self, session_id, fields):
+        """Set some fields of a session document (e.g. its summary)"""
+        raise NotImplementedError
+
+    def delete_session(self, session_id):
+        """Delete a session document and return True if it existed"""
+        raise NotImplementedError
+
+    def delete_sessions(self, session_ids):
+        """Delete several session documents at once and return how many existed"""
+        raise NotImplementedError
+
+    # ---------- messages ----------
+
+    def insert_messages(self, messages_list):
+        raise NotImplementedError
+
+    def load_messages(self, session_id):
+        """Return all messages of a session in chronological order"""
+        raise NotImplementedError
+
+    def iter_messages(self, session_id, batch_size=500):
+        """Yield the messages of a session in chronological order, fetching batch_size at a time"""
+        raise NotImplementedError
+
+    def load_messages_since(self, session_id, after=None, limit=500):
+        """Messages of a session with timestamp >= after (all if None), oldest first.
+
+        The bound is inclusive so messages sharing the last seen timestamp are
+        not lost; callers drop the ones they already have by message_id.
+        """
+        raise NotImplementedError
+
+    def load_recent_messages(self, session_id, limit):
+        """The last limit messages of a session, oldest first (one indexed query from the end)"""
+        raise NotImplementedError
+
+    def watch_messages(self, session_id):
+        """Change stream of newly inserted messages of a session, or None if unsupported.
+
+        The returned object has try_next() (next message or None without
+        blocking) and close().
+        """
+        return None
+
+    def delete_messages(self, session_id):
+        """Delete all messages of a session and return how many were deleted"""
+        raise NotImplementedError
+
+    def delete_messages_many(self, session_ids):
+        """Delete the messages of several sessions in one bulk operation and return how many were deleted"""
+        raise NotImplementedError
+
+    def load_turn_timings(self, session_ids):
+        """Return the stage timings stored on assistant messages of the given sessions"""
+        raise NotImplementedError
+
+
+    def text_search(self, query, session_ids=None, limit=20):
+        """Rank sessions by a server-side full-text search of their messages.
+
+        Returns [{"session_id", "score", "matches", "content"}] best first,
+        where content is the best matching message. Raises
+        NotImplementedError when the backend has no text index.
+        """
+        raise NotImplementedError
+
+    # ---------- analytics ----------
+
+    def changed_session_ids(self, since=None):
+        """Ids of the sessions with messages timestamped after since (all sessions if None)"""
+        raise NotImplementedError
+
+    def find_sessions(self, session_ids):
+        """Session documents for some session ids"""
+        raise NotImplementedError
+
+    def get_job_state(self, job_name):
+        """State document of a batch job (e.g. its watermark), or {}"""
+        raise NotImplementedError
+
+    def set_job_state(self, job_name, fields):
+        """Update fields of a batch job's state document"""
+        raise NotImplementedError
+
+    def merge_child_metrics(self, rows):
+        """Insert or replace per-session metric rows in child_metrics, keyed by session_id"""
+        raise NotImplementedError
+
+    def load_child_metrics(self, user_id):
+        """Per-session metric rows of a child, oldest session first"""
+        raise NotImplementedError
+
+    # ---------- archive ----------
+
+    def save_archive(self, session_id, codec, data):
+        """Store the compressed transcript of an archived session (replacing any previous one)"""
+        raise NotImplementedError
+
+    def load_archive(self, session_id):
+        """(codec, data) of an archived session, or None"""
+        raise NotImplementedError
+
+    def delete_archives(self, session_ids):
+        """Delete the stored archives of some sessions"""
+        raise NotImplementedError
+
+    # ---------- conversation state ----------
+
+    def get_state_version(self, key):
+        """Version of a stored conversation state (0 if there is none)"""
+        raise NotImplementedError
+
+    def load_state(self, key):
+        """(version, data) of a stored conversation state, or (0, None)"""
+        raise NotImplementedError
+
+    def save_state(self, key, data, expected_version):
+        """Store data as version expected_version + 1 if the stored version is still expected_version.
+
+        Returns False, without writing, when another writer got there first.
+        """
+        raise NotImplementedError
+
+    # ---------- login tokens ----------
+
+    def revoke_token(self, signature, expires_at):
+        """Record a logged-out token (by signature) until expires_at (Unix time)"""
+        raise NotImplementedError
+
+    def is_token_revoked(self, signature, now):
+        """Whether a token signature was revoked and has not expired at now (Unix time)"""
+        raise NotImplementedError
+
+
+class MongoBackend(StorageBackend):
+    """MongoDB implementation supporting both message layouts"""
+
+    name = "mongodb"
+
+    def __init__(self, db):
+        self.db = db
+
+    def setup_indexes(self):
+        # Signup and roster imports rely on this index to reject taken emails without a lookup
+        user_index_names = [idx["name"] for idx in self.db["users"].list_indexes()]
+        if "email_1" not in user_index_names:
+            self.db["users"].create_index("email", unique=True)
+        # Restoring a login from a session token looks the user up by id
+        if "user_id_1" not in user_index_names:
+            self.db["users"].create_index("user_id")
+
+        existing_indexes = self.db["sessions"].list_indexes()
+        index_names = [idx["name"] for idx in existing_indexes]
+
+        if "user_id_1" not in index_names:
+            self.db["sessions"].create_index("user_id")
+        # A child's newest sessions (session lists, resuming the latest one)
+        if "user_id_1_created_at_-1" not in index_names:
+            self.db["sessions"].create_index([("user_id", 1), ("created_at", -1)])
+        # Ordered scans by age (exports, retention)
+        if "created_at_1_session_id_1" not in index_names:
+            self.db["sessions"].create_index([("created_at", 1), ("session_id", 1)])
+
+        existing_msg_indexes = self.db["messages"].list_indexes()
+        msg_index_names = [idx["name"] for idx in existing_msg_indexes]
+
+        if "session_id_1" not in msg_index_names:
+            self.db["messages"].create_index("session_id")
+        if "timestamp_1" not in msg_index_names:
+            self.db["messages"].create_index("timestamp")
+        # Serves load_messages_since (and ordered loads) from a single index range
+        if "session_id_1_timestamp_1" not in msg_index_names:
+            self.db["messages"].create_index([("session_id", 1), ("timestamp", 1)])
+        # Spanish stemming, case and diacritic folding for the staff transcript search
+        if "content_text" not in msg_index_names:
+            self.db["messages"].create_index(
+                [("content", "text")], name="content_text", default_language="spanish"
+            )
+
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            setup_bucket_indexes(self.db)
+
+        # $merge on session_id requires a unique index on it
+        metric_index_names = [idx["name"] for idx in self.db["child_metrics"].list_indexes()]
+        if "session_id_1" not in metric_index_names:
+            self.db["child_metrics"].create_index("session_id", unique=True)
+        if "user_id_1_session_date_1" not in metric_index_names:
+            self.db["child_metrics"].create_index([("user_id", 1), ("session_date", 1)])
+
+        # Revoked tokens are dropped by MongoDB once they would have expired anyway
+        if "expires_at_1" not in [idx["name"] for idx in self.db["revoked_tokens"].list_indexes()]:
+            self.db["revoked_tokens"].create_index("expires_at", expireAfterSeconds=0)
+
+    # ---------- users ----------
+
+    def find_user_by_email(self, email):
+        return self.db["users"].find_one({"email": email})
+
+    def find_user_by_credentials(self, email, password_hash):
+        return self.db["users"].find_one({"email": email, "password_hash": password_hash})
+
+    def find_user_by_id(self, user_id):
+        return self.db["users"].find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
+
+    def insert_user(self, user_doc):
+        from pymongo.errors import DuplicateKeyError
+        try:
+            self.db["users"].insert_one(user_doc)
+        except DuplicateKeyError as e:
+            raise DuplicateUserError(user_doc.get("email")) from e
+
+    def insert_users(self, user_docs):
+        from pymongo.errors import BulkWriteError
+        if not user_docs:
+            return []
+        try:
+            # Unordered: one round trip per batch, and a taken email does not stop the rest
+            self.db["users"].insert_many([dict(doc) for doc in user_docs], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            other = [error for error in errors if error.get("code") != 11000]
+            if other:
+                raise
+            return sorted(error["index"] for error in errors)
+        return []
+
+    def list_children(self):
+        return list(self.db["users"].find(
+            {"user_type": "child"},
+            {"user_id": 1, "name": 1, "email": 1, "age": 1, "created_at": 1, "_id": 0}
+        ).sort("name", 1))
+
+    # ---------- sessions ----------
+
+    def insert_session(self, session_doc):
+        self.db["sessions"].insert_one(session_doc)
+
+    def list_user_sessions(self, user_id, limit=50, start=None, end=None):
+        query = {"user_id": user_id}
+        if start is not None or end is not None:
+            query["created_at"] = {}
+            if start is not None:
+                query["created_at"]["$gte"] = start
+            if end is not None:
+                query["created_at"]["$lt"] = end
+        return list(self.db["sessions"].find(
+            query,
+            # Only get needed fields; summaries are short and let staff skip the transcript
+            {"_id": 0, "session_id": 1, "title": 1, "created_at": 1, "summary": 1, "topics": 1}
+        ).sort("created_at", -1).limit(limit or 0))
+
+    def iter_sessions(self, user_ids=None, start=None, end=None, after=None, batch_size=500, archived=None):
+        query = {}
+        if user_ids is not None:
+            query["user_id"] = {"$in": list(user_ids)}
+        if archived is not None:
+            # A null archive matches sessions that were never archived or were restored
+            query["archive"] = {"$ne": None} if archived else None
+        if start is not None or end is not None:
+            query["created_at"] = {}
+            if start is not None:
+                query["created_at"]["$gte"] = start
+            if end is not None:
+                query["created_at"]["$lt"] = end
+        if after is not None:
+            after_created_at, after_session_id = after
+            query["$or"] = [
+                {"created_at": {"$gt": after_created_at}},
+                {"created_at": after_created_at, "session_id": {"$gt": after_session_id}}
+            ]
+        yield from self.db["sessions"].find(query, {"_id": 0}).sort(
+            [("created_at", 1), ("session_id", 1)]
+        ).batch_size(batch_size)
+
+    def update_session(self, session_id, fields):
+        self.db["sessions"].update_one({"session_id": session_id}, {"$set": fields})
+
+    def delete_session(self, session_id):
+        return self.db["sessions"].delete_one({"session_id": session_id}).deleted_count > 0
+
+    def delete_sessions(self, session_ids):
+        return self.db["sessions"].delete_many({"session_id": {"$in": list(session_ids)}}).deleted_count
+
+    # ---------- messages ----------
+
+    def insert_messages(self, messages_list):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            # Group by session so each session gets a single bucket update
+            by_session = {}
+            for msg in messages_list:
+                by_session.setdefault(msg["session_id"], []).append(self._strip_message_for_bucket(msg))
+            for session_id, session_messages in by_session.items():
+                self.append_to_buckets(session_id, session_messages)
+        else:
+            self.db["messages"].insert_many(messages_list)
+
+    def load_messages(self, session_id):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            # One document per bucket instead of one per message
+            bucket_cursor = self.db["message_buckets"].find(
+                {"session_id": session_id},
+                {"messages": 1, "_id": 0}
+            ).sort("first_timestamp", 1)
+
+            return [doc for bucket in bucket_cursor for doc in bucket.get("messages", [])]
+
+        return list(self.db["messages"].find(
+            {"session_id": session_id},
+            {"_id": 0, "session_id": 0}
+        ).sort("timestamp", 1))
+
+    def iter_messages(self, session_id, batch_size=500):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            # Each bucket already holds many messages, so fetch fewer documents per batch
+            bucket_cursor = self.db["message_buckets"].find(
+                {"session_id": session_id},
+                {"messages": 1, "_id": 0}
+            ).sort("first_timestamp", 1).batch_size(max(1, batch_size // get_message_bucket_size()))
+            for bucket in bucket_cursor:
+                yield from bucket.get("messages", [])
+            return
+
+        yield from self.db["messages"].find(
+            {"session_id": session_id},
+            {"_id": 0, "session_id": 0}
+        ).sort("timestamp", 1).batch_size(batch_size)
+
+    def load_messages_since(self, session_id, after=None, limit=500):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            # Only the buckets still receiving messages after the cursor are read
+            query = {"session_id": session_id}
+            if after is not None:
+                query["last_timestamp"] = {"$gte": after}
+            buckets = self.db["message_buckets"].find(query, {"messages": 1, "_id": 0}).sort("first_timestamp", 1)
+            messages = [
+                doc for bucket in buckets for doc in bucket.get("messages", [])
+                if after is None or doc["timestamp"] >= after
+            ]
+            return sorted(messages, key=lambda doc: doc["timestamp"])[:limit]
+
+        query = {"session_id": session_id}
+        if after is not None:
+            query["timestamp"] = {"$gte": after}
+        return list(self.db["messages"].find(query, {"_id": 0, "session_id": 0}).sort("timestamp", 1).limit(limit))
+
+    def load_recent_messages(self, session_id, limit):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            # Newest buckets first; one more than needed in case the newest is nearly empty
+            bucket_count = limit // get_message_bucket_size() + 2
+            buckets = list(self.db["message_buckets"].find(
+                {"session_id": session_id}, {"messages": 1, "_id": 0}
+            ).sort("first_timestamp", -1).limit(bucket_count))
+            messages = [doc for bucket in reversed(buckets) for doc in bucket.get("messages", [])]
+            return messages[-limit:]
+
+        # Walks the session_id+timestamp index backwards from the newest message
+        recent = self.db["messages"].find(
+            {"session_id": session_id}, {"_id": 0, "session_id": 0}
+        ).sort("timestamp", -1).limit(limit)
+        return list(recent)[::-1]
+
+    def watch_messages(self, session_id):
+        # Bucket updates are not message inserts, so that layout relies on polling
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            return None
+        from pymongo.errors import PyMongoError
+        try:
+            stream = self.db["messages"].watch(
+                [{"$match": {"operationType": "insert", "fullDocument.session_id": session_id}}]
+            )
+        except (PyMongoError, NotImplementedError, TypeError):
+            # Standalone servers have no change streams and mongomock has no watch()
+            return None
+        return _MessageChangeStream(stream)
+
+    def delete_messages(self, session_id):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            # Report deleted chat lines, not deleted bucket documents
+            buckets = self.db["message_buckets"].find({"session_id": session_id}, {"count": 1, "_id": 0})
+            message_count = sum(bucket.get("count", 0) for bucket in buckets)
+            self.db["message_buckets"].delete_many({"session_id": session_id})
+            return message_count
+
+        return self.db["messages"].delete_many({"session_id": session_id}).deleted_count
+
+    def delete_messages_many(self, session_ids):
+        query = {"session_id": {"$in": list(session_ids)}}
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            buckets = self.db["message_buckets"].find(query, {"count": 1, "_id": 0})
+            message_count = sum(bucket.get("count", 0) for bucket in buckets)
+            self.db["message_buckets"].delete_many(query)
+            return message_count
+        return self.db["messages"].delete_many(query).deleted_count
+
+    def load_turn_timings(self, session_ids):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            buckets = self.db["message_buckets"].find(
+                {"session_id": {"$in": session_ids}},
+                {"messages.timings": 1, "_id": 0}
+            )
+            return [doc["timings"] for bucket in buckets for doc in bucket.get("messages", []) if doc.get("timings")]
+
+        return [
+            doc["timings"]
+            for doc in self.db["messages"].find(
+                {"session_id": {"$in": session_ids}, "role": "assistant", "timings": {"$exists": True}},
+                {"timings": 1, "_id": 0}
+            )
+        ]
+
+    def text_search(self, query, session_ids=None, limit=20):
+        from pymongo.errors import OperationFailure
+        buckets = get_message_layout() == MESSAGE_LAYOUT_BUCKETS
+        match = {"$text": {"$search": query, "$language": "spanish", "$diacriticSensitive": False}}
+        if session_ids is not None:
+            match["session_id"] = {"$in": list(session_ids)}
+        content_field = "$messages.content" if buckets else "$content"
+        pipeline = [
+            {"$match": match},
+            {"$project": {"session_id": 1, "content": content_field, "score": {"$meta": "textScore"}}},
+            {"$sort": {"score": -1}},
+            # One hit per session; the first document after the sort is the best match
+            {"$group": {
+                "_id": "$session_id",
+                "score": {"$sum": "$score"},
+                "matches": {"$sum": 1},
+                "content": {"$first": "$content"}
+            }},
+            {"$sort": {"score": -1}},
+            {"$limit": limit}
+        ]
+        try:
+            results = list(self.db["message_buckets" if buckets else "messages"].aggregate(pipeline))
+        except (OperationFailure, NotImplementedError) as e:
+            # No text index (or mongomock): let the caller use the in-process index
+            raise NotImplementedError(str(e)) from e
+        return [
+            {
+                "session_id": result["_id"],
+                "score": result["score"],
+                "matches": result["matches"],
+                # Buckets return all their messages; the caller picks the snippet
+                "content": None if buckets else result["content"]
+            }
+            for result in results
+        ]
+
+    # ---------- analytics ----------
+
+    def changed_session_ids(self, since=None):
+        if get_message_layout() == MESSAGE_LAYOUT_BUCKETS:
+            query = {"last_timestamp": {"$gt": since}} if since is not None else {}
+            return self.db["message_buckets"].distinct("session_id", query)
+        query = {"timestamp": {"$gt": since}} if since is not None else {}
+        return self.db["messages"].distinct("session_id", query)
+
+    def find_sessions(self, session_ids):
+        return list(self.db["sessions"].find({"session_id": {"$in": list(session_ids)}}, {"_id": 0}))
+
+    def get_job_state(self, job_name):
+        return self.db["job_state"].find_one({"_id": job_name}, {"_id": 0}) or {}
+
+    def set_job_state(self, job_name, fields):
+        self.db["job_state"].update_one({"_id": job_name}, {"$set": fields}, upsert=True)
+
+    def merge_child_metrics(self, rows):
+        if not rows:
+            return
+        from pymongo.errors import OperationFailure
+        try:
+            # Server-side upsert of the whole batch in one round trip (MongoDB 5.1+)
+            self.db.aggregate([
+                {"$documents": rows},
+                {"$merge": {"into": "child_metrics", "on": "session_id",
+                            "whenMatched": "replace", "whenNotMatched": "insert"}}
+            ])
+        except (OperationFailure, TypeError):
+            # Older servers (and mongomock) have no $documents stage
+            for row in rows:
+                self.db["child_metrics"].replace_one({"session_id": row["session_id"]}, row, upsert=True)
+
+    def load_child_metrics(self, user_id):
+        return list(self.db["child_metrics"].find({"user_id": user_id}, {"_id": 0}).sort("session_date", 1))
+
+    def save_archive(self, session_id, codec, data):
+        self.db["archive"].replace_one(
+            {"_id": session_id},
+            {"_id": session_id, "codec": codec, "data": data, "archived_at": datetime.now()},
+            upsert=True
+        )
+
+    def load_archive(self, session_id):
+        doc = self.db["archive"].find_one({"_id": session_id})
+        return (doc["codec"], bytes(doc["data"])) if doc else None
+
+    def delete_archives(self, session_ids):
+        self.db["archive"].delete_many({"_id": {"$in": list(session_ids)}})
+
+    def get_state_version(self, key):
+        doc = self.db["conversation_state"].find_one({"_id": key}, {"version": 1})
+        return doc["version"] if doc else 0
+
+    def load_state(self, key):
+        doc = self.db["conversation_state"].find_one({"_id": key})
+        return (doc["version"], bytes(doc["data"])) if doc else (0, None)
+
+    def save_state(self, key, data, expected_version):
+        from pymongo.errors import DuplicateKeyError
+        state = {"data": data, "version": expected_version + 1, "updated_at": datetime.now()}
+        if expected_version == 0:
+            try:
+                self.db["conversation_state"].insert_one({"_id": key, **state})
+                return True
+            except DuplicateKeyError:
+                return False
+        result = self.db["conversation_state"].update_one({"_id": key, "version": expected_version}, {"$set": state})
+        return result.modified_count == 1
+
+    def revoke_token(self, signature, expires_at):
+        self.db["revoked_tokens"].replace_one(
+            {"_id": signature},
+            {"expires_at": datetime.fromtimestamp(expires_at, timezone.utc)},
+            upsert=True
+        )
+
+    def is_token_revoked(self, signature, now):
+        # The TTL monitor only runs once a minute, so expiry is checked here too
+        return self.db["revoked_tokens"].find_one(
+            {"_id": signature, "expires_at": {"$gt": datetime.fromtimestamp(now, timezone.utc)}}, {"_id": 1}
+        ) is not None
+
+    # ---------- bucket layout ----------
+
+    def append_to_buckets(self, session_id, messages_list, bucket_size=None):
+        """Append messages to the open bucket of a session, opening new buckets when full.
+
+        Only the newest bucket of a session is open: appending to an older bucket
+        with room left would put messages out of order for readers that sort
+        buckets by first_timestamp.
+        """
+        bucket_size = bucket_size or get_message_bucket_size()
+
+        for start in range(0, len(messages_list), bucket_size):
+            chunk = messages_list[start:start + bucket_size]
+            timestamps = [msg["timestamp"] for msg in chunk]
+            update = {
+                "$push": {"messages": {"$each": chunk}},
+                "$inc": {"count": len(chunk)},
+                "$min": {"first_timestamp": min(timestamps)},
+                "$max": {"last_timestamp": max(timestamps)},
+                "$setOnInsert": {"bucket_id": str(uuid.uuid4())}
+            }
+            room_filter = {"session_id": session_id, "open": True, "count": {"$lte": bucket_size - len(chunk)}}
+
+            if self.db["message_buckets"].update_one(room_filter, update).matched_count:
+                continue
+            # The open bucket has no room for the chunk: close it and open a new one
+            self.db["message_buckets"].update_many({"session_id": session_id, "open": True}, {"$set": {"open": False}})
+            self.db["message_buckets"].update_one(room_filter, update, upsert=True)
+
+    @staticmethod
+    def _strip_message_for_bucket(message):
+        """Drop fields that the bucket document already stores once"""
+        return {key: value for key, value in message.items() if key not in ("_id", "session_id")}
+
+
+class _MessageChangeStream:
+    """Adapts a pymongo change stream to yield message documents"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def try_next(self):
+        change = self._stream.try_next()
+        if change is None:
+            return None
+        doc = dict(change["fullDocument"])
+        doc.pop("_id", None)
+        doc.pop("session_id", None)
+        return doc
+
+    def close(self):
+        self._stream.close()
+
+
+def _encode_doc(doc):
+    """Serialize a document to JSON, keeping datetimes round-trippable"""
+    def default(value):
+        if isinstance(value, datetime):
+            return {"$date": value.isoformat(timespec="microseconds")}
+        return str(value)
+    return json.dumps({key: value for key, value in doc.items() if key != "_id"}, default=default)
+
+def _decode_doc(text):
+    """Deserialize a document written by _encode_doc"""
+    def object_hook(value):
+        if len(value) == 1 and "$date" in value:
+            return datetime.fromisoformat(value["$date"])
+        return value
+    return json.loads(text, object_hook=object_hook)
+
+def _sortable_time(value):
+    """Return a lexicographically sortable representation of a datetime"""
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="microseconds")
+    return str(value or "")
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite implementation; use path=":memory:" for a throwaway in-memory store.
+
+    Each row keeps the full document as JSON next to the few columns that are
+    filtered or sorted on, so documents keep the same shape as in MongoDB.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        # Streamlit runs every browser session on its own thread
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self.setup_indexes()
+
+    def setup_indexes(self):
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    email TEXT NOT NULL UNIQUE,
+                    password_hash TEXT,
+                    user_type TEXT,
+                    name TEXT,
+                    doc TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    created_at TEXT,
+                    doc TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_user_created ON sessions (user_id, created_at);
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    timestamp TEXT,
+                    doc TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_session_timestamp ON messages (session_id, timestamp);
+                CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+                CREATE TABLE IF NOT EXISTS child_metrics (
+                    session_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    session_date TEXT,
+                    doc TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS child_metrics_user_date ON child_metrics (user_id, session_date);
+                CREATE TABLE IF NOT EXISTS job_state (
+                    name TEXT PRIMARY KEY,
+                    doc TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS archive (
+                    session_id TEXT PRIMARY KEY,
+                    codec TEXT NOT NULL,
+                    data BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS conversation_state (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    signature TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                );
+            """)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ---------- users ----------
+
+    def find_user_by_email(self, email):
+        rows = self._query("SELECT doc FROM users WHERE email = ?", (email,))
+        return _decode_doc(rows[0][0]) if rows else None
+
+    def find_user_by_credentials(self, email, password_hash):
+        rows = self._query("SELECT doc FROM users WHERE email = ? AND password_hash = ?", (email, password_hash))
+        return _decode_doc(rows[0][0]) if rows else None
+
+    def find_user_by_id(self, user_id):
+        rows = self._query("SELECT doc FROM users WHERE user_id = ?", (user_id,))
+        if not rows:
+            return None
+        doc = _decode_doc(rows[0][0])
+        doc.pop("password_hash", None)
+        return doc
+
+    def insert_user(self, user_doc):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO users (user_id, email, password_hash, user_type, name, doc) VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_doc["user_id"], user_doc["email"], user_doc.get("password_hash"),
+                     user_doc.get("user_type"), user_doc.get("name"), _encode_doc(user_doc))
+                )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateUserError(user_doc.get("email")) from e
+
+    def insert_users(self, user_docs):
+        skipped = []
+        with self._lock, self._conn:
+            for position, user_doc in enumerate(user_docs):
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO users (user_id, email, password_hash, user_type, name, doc) VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_doc["user_id"], user_doc["email"], user_doc.get("password_hash"),
+                     user_doc.get("user_type"), user_doc.get("name"), _encode_doc(user_doc))
+                )
+                if cursor.rowcount == 0:
+                    skipped.append(position)
+        return skipped
+
+    def list_children(self):
+        fields = ("user_id", "name", "email", "age", "created_at")
+        rows = self._query("SELECT doc FROM users WHERE user_type = 'child' ORDER BY name")
+        return [{key: doc[key] for key in fields if key in doc} for doc in map(_decode_doc, (row[0] for row in rows))]
+
+    # ---------- sessions ----------
+
+    def insert_session(self, session_doc):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, user_id, created_at, doc) VALUES (?, ?, ?, ?)",
+                (session_doc["session_id"], session_doc.get("user_id"),
+                 _sortable_time(session_doc.get("created_at")), _encode_doc(session_doc))
+            )
+
+    def list_user_sessions(self, user_id, limit=50, start=None, end=None):
+        fields = ("session_id", "title", "created_at", "summary", "topics")
+        sql = "SELECT doc FROM sessions WHERE user_id = ?"
+        params = [user_id]
+        if start is not None:
+            sql += " AND created_at >= ?"
+            params.append(_sortable_time(start))
+        if end is not None:
+            sql += " AND created_at < ?"
+            params.append(_sortable_time(end))
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit if limit else -1)
+        rows = self._query(sql, tuple(params))
+        return [{key: doc[key] for key in fields if key in doc} for doc in map(_decode_doc, (row[0] for row in rows))]
+
+    def iter_sessions(self, user_ids=None, start=None, end=None, after=None, batch_size=500, archived=None):
+        sql = "SELECT doc FROM sessions WHERE 1 = 1"
+        if archived is not None:
+            sql += f" AND json_extract(doc, '$.archive') IS {'NOT ' if archived else ''}NULL"
+        params = []
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            if not user_ids:
+                return
+            sql += f" AND user_id IN ({','.join('?' * len(user_ids))})"
+            params.extend(user_ids)
+        if start is not None:
+            sql += " AND created_at >= ?"
+            params.append(_sortable_time(start))
+        if end is not None:
+            sql += " AND created_at < ?"
+            params.append(_sortable_time(end))
+        if after is not None:
+            sql += " AND (created_at > ? OR (created_at = ? AND session_id > ?))"
+            params.extend([_sortable_time(after[0]), _sortable_time(after[0]), after[1]])
+        sql += " ORDER BY created_at, session_id"
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(sql, tuple(params))
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _decode_doc(row[0])
+        finally:
+            cursor.close()
+
+    def update_session(self, session_id, fields):
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT doc FROM sessions WHERE session_id = ?", (session_id,)).fetchall()
+            if not rows:
+                return
+            doc = _decode_doc(rows[0][0])
+            doc.update(fields)
+            self._conn.execute("UPDATE sessions SET doc = ? WHERE session_id = ?", (_encode_doc(doc), session_id))
+
+    def delete_session(self, session_id):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def delete_sessions(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return 0
+        with self._lock, self._conn:
+            return self._conn.execute(
+                f"DELETE FROM sessions WHERE session_id IN ({','.join('?' * len(session_ids))})", session_ids
+            ).rowcount
+
+    # ---------- messages ----------
+
+    def insert_messages(self, messages_list):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, timestamp, doc) VALUES (?, ?, ?)",
+                [(msg["session_id"], _sortable_time(msg.get("timestamp")), _encode_doc(msg)) for msg in messages_list]
+            )
+
+    def load_messages(self, session_id):
+        rows = self._query(
+            "SELECT doc FROM messages WHERE session_id = ? ORDER BY timestamp, id",
+            (session_id,)
+        )
+        messages = [_decode_doc(row[0]) for row in rows]
+        for doc in messages:
+            doc.pop("session_id", None)
+        return messages
+
+    def iter_messages(self, session_id, batch_size=500):
+        # A dedicated cursor keeps its position while other threads use the connection
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT doc FROM messages WHERE session_id = ? ORDER BY timestamp, id", (session_id,))
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    doc = _decode_doc(row[0])
+                    doc.pop("session_id", None)
+                    yield doc
+        finally:
+            cursor.close()
+
+    def load_messages_since(self, session_id, after=None, limit=500):
+        sql = "SELECT doc FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if after is not None:
+            sql += " AND timestamp >= ?"
+            params.append(_sortable_time(after))
+        rows = self._query(sql + " ORDER BY timestamp, id LIMIT ?", tuple(params + [limit]))
+        messages = [_decode_doc(row[0]) for row in rows]
+        for doc in messages:
+            doc.pop("session_id", None)
+        return messages
+
+    def load_recent_messages(self, session_id, limit):
+        rows = self._query(
+            "SELECT doc FROM messages WHERE session_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (session_id, limit)
+        )
+        messages = [_decode_doc(row[0]) for row in reversed(rows)]
+        for doc in messages:
+            doc.pop("session_id", None)
+        return messages
+
+    def delete_messages(self, session_id):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,)).rowcount
+
+    def delete_messages_many(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return 0
+        with self._lock, self._conn:
+            return self._conn.execute(
+                f"DELETE FROM messages WHERE session_id IN ({','.join('?' * len(session_ids))})", session_ids
+            ).rowcount
+
+    def load_turn_timings(self, session_ids):
+        if not session_ids:
+            return []
+        placeholders = ",".join("?" * len(session_ids))
+        rows = self._query(
+            f"SELECT json_extract(doc, '$.timings') FROM messages "
+            f"WHERE session_id IN ({placeholders}) AND json_extract(doc, '$.timings') IS NOT NULL",
+            tuple(session_ids)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+
+    # ---------- analytics ----------
+
+    def changed_session_ids(self, since=None):
+        if since is None:
+            rows = self._query("SELECT DISTINCT session_id FROM messages")
+        else:
+            rows = self._query("SELECT DISTINCT session_id FROM messages WHERE timestamp > ?", (_sortable_time(since),))
+        return [row[0] for row in rows]
+
+    def find_sessions(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return []
+        placeholders = ",".join("?" * len(session_ids))
+        rows = self._query(f"SELECT doc FROM sessions WHERE session_id IN ({placeholders})", tuple(session_ids))
+        return [_decode_doc(row[0]) for row in rows]
+
+    def get_job_state(self, job_name):
+        rows = self._query("SELECT doc FROM job_state WHERE name = ?", (job_name,))
+        return _decode_doc(rows[0][0]) if rows else {}
+
+    def set_job_state(self, job_name, fields):
+        with self._lock, self._conn:
+            state = self.get_job_state(job_name)
+            state.update(fields)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_state (name, doc) VALUES (?, ?)",
+                (job_name, _encode_doc(state))
+            )
+
+    def merge_child_metrics(self, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO child_metrics (session_id, user_id, session_date, doc) VALUES (?, ?, ?, ?)",
+                [(row["session_id"], row.get("user_id"), _sortable_time(row.get("session_date")), _encode_doc(row))
+                 for row in rows]
+            )
+
+    def load_child_metrics(self, user_id):
+        rows = self._query("SELECT doc FROM child_metrics WHERE user_id = ? ORDER BY session_date", (user_id,))
+        return [_decode_doc(row[0]) for row in rows]
+
+    def save_archive(self, session_id, codec, data):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO archive (session_id, codec, data) VALUES (?, ?, ?)",
+                (session_id, codec, data)
+            )
+
+    def load_archive(self, session_id):
+        rows = self._query("SELECT codec, data FROM archive WHERE session_id = ?", (session_id,))
+        return (rows[0][0], bytes(rows[0][1])) if rows else None
+
+    def delete_archives(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM archive WHERE session_id IN ({','.join('?' * len(session_ids))})", session_ids
+            )
+
+    def get_state_version(self, key):
+        rows = self._query("SELECT version FROM conversation_state WHERE key = ?", (key,))
+        return rows[0][0] if rows else 0
+
+    def load_state(self, key):
+        rows = self._query("SELECT version, data FROM conversation_state WHERE key = ?", (key,))
+        return (rows[0][0], bytes(rows[0][1])) if rows else (0, None)
+
+    def save_state(self, key, data, expected_version):
+        with self._lock, self._conn:
+            if expected_version == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO conversation_state (key, version, data) VALUES (?, 1, ?)", (key, data)
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE conversation_state SET version = ?, data = ? WHERE key = ? AND version = ?",
+                    (expected_version + 1, data, key, expected_version)
+                )
+            return cursor.rowcount == 1
+
+    def revoke_token(self, signature, expires_at):
+        with self._lock, self._conn:
+            # Expired revocations are pruned on each logout
+            self._conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (time.time(),))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO revoked_tokens (signature, expires_at) VALUES (?, ?)", (signature, expires_at)
+            )
+
+    def is_token_revoked(self, signature, now):
+        return bool(self._query(
+            "SELECT 1 FROM revoked_tokens WHERE signature = ? AND expires_at > ?", (signature, now)
+        ))
+
+
+def get_backend(db):
+    """Return the storage backend for db, wrapping a raw pymongo Database if needed"""
+    if isinstance(db, StorageBackend):
+        return db
+    return MongoBackend(db)
+
+def create_backend_from_env():
+    """Create the configured backend outside Streamlit (CLI tools and batch jobs)"""
+    storage_backend = os.getenv("STORAGE_BACKEND", "mongodb").strip().lower()
+    if storage_backend in ("sqlite", "memory", "mongomock"):
+        return create_local_backend(storage_backend)
+
+    import pymongo
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise RuntimeError("MongoDB URI not found. Please check your .env file.")
+    client = pymongo.MongoClient(mongodb_uri, retryWrites=True, w="majority")
+    return MongoBackend(client[os.getenv("MONGODB_DATABASE", "asd-therapy")])
+
+def create_local_backend(kind):
+    """Create a backend that needs no MongoDB server.
+
+    "memory" and "sqlite" (file from SQLITE_PATH) use SQLiteBackend;
+    "mongomock" runs the MongoBackend code path against mongomock.
+    """
+    if kind == "memory":
+        return SQLiteBackend(":memory:")
+    if kind == "mongomock":
+        import mongomock
+        return MongoBackend(mongomock.MongoClient()[os.getenv("MONGODB_DATABASE", "asd-therapy")])
+    return SQLiteBackend(os.getenv("SQLITE_PATH", "asd-therapy.db"))
@@ -0,0 +1,224 @@
+"""Offline summaries of finished sessions, stored on the sessions document.
+
+Once a session has been idle for SUMMARY_IDLE_MINUTES, the job sends its
+transcript to a summary client and saves a short clinical summary and the
+key topics on the session (summary, topics, summarized_through). Staff
+lists and PDFs read those fields instead of loading the messages.
+
+The job only looks at sessions with messages newer than its watermark
+(stored in job_state). Sessions that are still active hold the watermark
+back so they are picked up again once they go idle. Sessions that get new
+messages after being summarized are summarized again.
+
+The client is pluggable: "openai" (SUMMARY_MODEL, default gpt-4o-mini) or
+"stub", a deterministic local client for tests and offline runs.
+
+Usage (e.g. from cron at night):
+    python summarizer.py [--client openai|stub] [--idle-minutes 30] [--limit 500] [--full]
+"""
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from storage import create_backend_from_env, get_backend
+from search import STOPWORDS, fold_accents
+from openai_scheduler import BACKGROUND, estimate_tokens, get_scheduler, request_timeout_seconds
+
+JOB_NAME = "session_summaries"
+
+# Messages are timestamped by the app before they are written; re-reading this window is harmless
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def idle_after_from_env():
+    """Time without messages before a session is summarized (read when used, so .env values apply)"""
+    return timedelta(minutes=int(os.getenv("SUMMARY_IDLE_MINUTES", "30")))
+
+
+# Long sessions keep their beginning and end; the model context and cost stay bounded
+MAX_TRANSCRIPT_CHARS = 12000
+MAX_TOPICS = 5
+
+SUMMARY_PROMPT = """Eres un terapeuta infantil que revisa una sesión entre un niño y un asistente robot.
+Escribe un resumen clínico breve (3-5 frases, en español) para el equipo terapéutico: estado emocional,
+temas tratados, habilidades de lenguaje observadas y cualquier aspecto que requiera seguimiento.
+Responde SOLO con un objeto JSON: {"summary": "...", "topics": ["tema", ...]} con como máximo 5 temas cortos."""
+
+
+class StubSummaryClient:
+    """Deterministic local client: the child's first utterances and most frequent words"""
+
+    name = "stub"
+
+    def summarize(self, transcript):
+        child_lines = [line[len("Niño: "):] for line in transcript.splitlines() if line.startswith("Niño: ")]
+        words = Counter(
+            word for line in child_lines for word in re.findall(r"[a-záéíóúüñ]+", line.lower())
+            if len(word) > 3 and fold_accents(word) not in STOPWORDS
+        )
+        opening = " ".join(child_lines[:2])[:200]
+        return {
+            "summary": f"{len(child_lines)} intervenciones del niño. Inicio: {opening}",
+            "topics": [word for word, _ in words.most_common(MAX_TOPICS)]
+        }
+
+
+class OpenAISummaryClient:
+    """Summaries from an OpenAI chat model"""
+
+    name = "openai"
+
+    def __init__(self, model=None):
+        from langchain_openai import ChatOpenAI
+        self.model = model or os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+        self.llm = ChatOpenAI(
+            model=self.model,
+            temperature=0.2,
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            request_timeout=request_timeout_seconds(),
+            max_retries=0
+        )
+
+    def summarize(self, transcript):
+        from langchain.schema import SystemMessage, HumanMessage
+        messages = [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=transcript)]
+        # Background priority: leaves rate limit headroom to the chat turns
+        response = get_scheduler().call(
+            "chat",
+            lambda timeout: self.llm.invoke(messages, timeout=timeout),
+            priority=BACKGROUND,
+            tokens=estimate_tokens([SUMMARY_PROMPT, transcript])
+        )
+        return parse_summary(response.content)
+
+
+SUMMARY_CLIENTS = {
+    "openai": OpenAISummaryClient,
+    "stub": StubSummaryClient
+}
+
+
+def create_summary_client(name=None):
+    """Summary client by name, or from SUMMARY_CLIENT (default openai)"""
+    name = (name or os.getenv("SUMMARY_CLIENT", "openai")).strip().lower()
+    if name not in SUMMARY_CLIENTS:
+        raise ValueError(f"Unknown summary client '{name}' (expected one of {', '.join(SUMMARY_CLIENTS)})")
+    return SUMMARY_CLIENTS[name]()
+
+
+def parse_summary(text):
+    """{"summary", "topics"} from a model reply, tolerating code fences or plain text"""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    try:
+        data = json.loads(match.group(0)) if match else {}
+    except json.JSONDecodeError:
+        data = {}
+    if not isinstance(data, dict) or not data.get("summary"):
+        return {"summary": (text or "").strip(), "topics": []}
+    topics = data.get("topics") if isinstance(data.get("topics"), list) else []
+    return {
+        "summary": str(data["summary"]).strip(),
+        "topics": [str(topic).strip() for topic in topics if str(topic).strip()][:MAX_TOPICS]
+    }
+
+
+def build_transcript(messages, max_chars=MAX_TRANSCRIPT_CHARS):
+    """Plain-text transcript of the child and assistant turns, trimmed in the middle if too long"""
+    speakers = {"user": "Niño", "assistant": "Asistente"}
+    lines = [
+        f"{speakers[message.get('role')]}: {message.get('content') or ''}"
+        for message in messages if message.get("role") in speakers
+    ]
+    transcript = "\n".join(lines)
+    if len(transcript) <= max_chars:
+        return transcript
+    half = max_chars // 2
+    return f"{transcript[:half]}\n[...]\n{transcript[-half:]}"
+
+
+def run_summary_job(db, client, idle_after=None, full=False, limit=None, now=None, progress=None):
+    """Summarize the idle sessions changed since the watermark; returns a dict of counts"""
+    backend = get_backend(db)
+    idle_after = idle_after or idle_after_from_env()
+    now = now or datetime.now()
+    watermark = None if full else backend.get_job_state(JOB_NAME).get("watermark")
+    new_watermark = now - WATERMARK_OVERLAP
+    counts = {"summarized": 0, "active": 0, "failed": 0, "unchanged": 0}
+
+    session_ids = sorted(backend.changed_session_ids(watermark))
+    for position, session_id in enumerate(session_ids):
+        if limit is not None and counts["summarized"] >= limit:
+            # Budget spent: the remaining sessions are seen again on the next run
+            new_watermark = watermark
+            break
+        sessions = backend.find_sessions([session_id])
+        if not sessions:
+            # Messages of a deleted session
+            continue
+        session = sessions[0]
+        messages = list(backend.iter_messages(session_id))
+        last_timestamp = max((message["timestamp"] for message in messages if message.get("timestamp")), default=None)
+        if last_timestamp is None:
+            continue
+        if now - last_timestamp < idle_after:
+            # Still in progress: keep it inside the next run's window
+            counts["active"] += 1
+            new_watermark = min(new_watermark, last_timestamp - WATERMARK_OVERLAP)
+            continue
+        if session.get("summarized_through") is not None and session["summarized_through"] >= last_timestamp:
+            counts["unchanged"] += 1
+            continue
+
+        try:
+            result = client.summarize(build_transcript(messages))
+        except Exception as e:
+            # Retried on the next run
+            counts["failed"] += 1
+            new_watermark = min(new_watermark, last_timestamp - WATERMARK_OVERLAP)
+            if progress:
+                progress(f"Failed to summarize {session_id}: {e}")
+            continue
+
+        backend.update_session(session_id, {
+            "summary": result["summary"],
+            "topics": result["topics"],
+            "summarized_through": last_timestamp,
+            "summarized_at": now,
+            "summary_client": client.name
+        })
+        counts["summarized"] += 1
+        if progress:
+            progress(f"{position + 1}/{len(session_ids)} sessions checked")
+
+    backend.set_job_state(JOB_NAME, {"watermark": new_watermark, "last_run": now, **counts})
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize idle sessions for the staff dashboard")
+    parser.add_argument("--client", choices=sorted(SUMMARY_CLIENTS), help="Summary client (default: SUMMARY_CLIENT or openai)")
+    parser.add_argument("--idle-minutes", type=int,
+                        help="Minutes without messages before a session is summarized (default SUMMARY_IDLE_MINUTES or 30)")
+    parser.add_argument("--limit", type=int, help="Maximum sessions summarized in this run")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and check every session")
+    args = parser.parse_args()
+
+    load_dotenv()
+    backend = create_backend_from_env()
+    backend.setup_indexes()
+    counts = run_summary_job(
+        backend,
+        create_summary_client(args.client),
+        idle_after=timedelta(minutes=args.idle_minutes) if args.idle_minutes is not None else None,
+        full=args.full,
+        limit=args.limit,
+        progress=print
+    )
+    print(", ".join(f"{name}: {count}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import math
+import time
+from contextlib import contextmanager, nullcontext
+from metrics import REGISTRY
+
+# Stages of a child turn, in the order they usually run
+TURN_STAGES = (
+    "transcription",     # Whisper (AudioHandler), voice turns only
+    "llm",               # process_message -> agent_chain.invoke
+    "image_trigger",     # get_dalle_prompt heuristic
+    "image_generation",  # DALL·E request, only when triggered
+    "robot_selection",   # select_robot_emotion classifier
+    "tts",               # generate_speech
+    "state_save",        # SessionHandler.publish_state (conversation_state.py)
+    "db_write",          # save_message_batch, histogram only: a write cannot store its own duration
+)
+
+stage_latency = REGISTRY.histogram(
+    "turn_stage_duration_seconds",
+    "Duration of each stage of a child turn"
+)
+
+
+class TurnTrace:
+    """Collects how long each stage of one child turn took"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of code as one stage of the turn"""
+        stage_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - stage_started)
+
+    def record(self, name, seconds):
+        self.timings[f"{name}_ms"] = round(seconds * 1000, 1)
+        stage_latency.observe(seconds, stage=name)
+
+    def label(self, name, value):
+        """Store a non-timing attribute of the turn with its timings (e.g. the model route)"""
+        self.timings[name] = value
+
+    def mark_first_audio(self):
+        """Record the time from the start of the turn until the reply audio is ready"""
+        self.timings["time_to_first_audio_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def as_dict(self):
+        """Return the timings including the total turn time so far"""
+        return {**self.timings, "total_ms": round((time.perf_counter() - self.started) * 1000, 1)}
+
+
+def trace_stage(trace, name):
+    """Time a stage if a trace is given, otherwise do nothing"""
+    return trace.stage(name) if trace is not None else nullcontext()
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+def summarize_turn_timings(timings_list):
+    """Summarize stored turn timings as one row per stage with p50 and p95 in ms"""
+    columns = [f"{stage}_ms" for stage in TURN_STAGES] + ["time_to_first_audio_ms", "total_ms"]
+    rows = []
+    for column in columns:
+        values = [timings[column] for timings in timings_list if timings.get(column) is not None]
+        if not values:
+            continue
+        rows.append({
+            "stage": column[:-3],
+            "turns": len(values),
+            "p50 (ms)": percentile(values, 50),
+            "p95 (ms)": percentile(values, 95)
+        })
+
+    # The same for each model tier (model_router.py), to compare routed turns with full ones
+    for route in sorted({timings["route"] for timings in timings_list if timings.get("route")}):
+        routed = [timings for timings in timings_list if timings.get("route") == route]
+        for column in ("llm_ms", "total_ms"):
+            values = [timings[column] for timings in routed if timings.get(column) is not None]
+            if not values:
+                continue
+            rows.append({
+                "stage": f"{column[:-3]} ({route})",
+                "turns": len(values),
+                "p50 (ms)": percentile(values, 50),
+                "p95 (ms)": percentile(values, 95)
+            })
+    return rows